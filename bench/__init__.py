@@ -0,0 +1,50 @@
+import json
+import os
+
+from sqlalchemy import func
+
+from trips import db
+from trips.model import Trip
+from .driver import drive, scenarios, compare, report
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def sample_trips(size=10000):
+    """
+    Picks existing public trips to request, and users to request them of
+    """
+    return [tuple(row) for row in
+            db.session.query(Trip.username, Trip.id)
+                      .filter(Trip.public.is_(True))
+                      .order_by(func.random()).limit(size)]
+
+
+def run(url, secret, requests=2000, concurrency=16):
+    """
+    Drives each scenario against a running server in turn
+
+    Returns a summary of each scenario by name.
+    """
+    trips = sample_trips()
+    db.session.remove()
+    if not trips:
+        raise ValueError('no public trips to benchmark, run seed first')
+    results = {}
+    for name, make_request in scenarios(trips, secret):
+        result = drive(url, name, make_request, requests, concurrency)
+        results[name] = result.summary()
+    return results
+
+
+def load_baseline(path=BASELINE):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=BASELINE):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
@@ -0,0 +1,242 @@
+import json
+import time
+import random
+import threading
+from http.client import HTTPConnection, HTTPException, RemoteDisconnected
+from urllib.parse import urlsplit
+
+import jwt
+
+# How much slower, as a fraction, a run may be than its baseline
+TOLERANCE = 0.2
+
+
+class Client(object):
+    """
+    A keep-alive connection to the server under test, one per thread
+    """
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Makes a request, returning its status and body
+
+        A kept alive connection that the server has closed in the
+        meantime, as gunicorn does when it recycles a worker, is opened
+        again once.
+        """
+        reused = self.conn is not None
+        if self.conn is None:
+            self.conn = HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            self.conn.request(method, path, body=body,
+                              headers=headers or {})
+            resp = self.conn.getresponse()
+            return resp.status, resp.read()
+        except (HTTPException, OSError) as e:
+            self.conn.close()
+            self.conn = None
+            if reused and isinstance(e, (RemoteDisconnected,
+                                         ConnectionError)):
+                return self.request(method, path, body, headers)
+            raise
+
+
+class Result(object):
+    """ The latencies of one scenario """
+
+    def __init__(self, name, latencies, errors, elapsed):
+        self.name = name
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+
+    def percentile(self, q):
+        if not self.latencies:
+            return None
+        index = min(len(self.latencies) - 1,
+                    int(round(q / 100.0 * (len(self.latencies) - 1))))
+        return self.latencies[index]
+
+    def summary(self):
+        """
+        The counts, latencies and throughput of the scenario, with no
+        latencies when no requests were made
+        """
+        if not self.latencies:
+            return {'requests': 0, 'errors': self.errors, 'p50_ms': None,
+                    'p99_ms': None, 'rps': 0.0}
+        return {'requests': len(self.latencies),
+                'errors': self.errors,
+                'p50_ms': self.percentile(50) * 1000,
+                'p99_ms': self.percentile(99) * 1000,
+                'rps': len(self.latencies) / self.elapsed}
+
+
+def drive(url, name, make_request, requests, concurrency):
+    """
+    Sends `requests` requests from `concurrency` threads, each making
+    its next request as soon as the last one is answered
+
+    `make_request(client)` makes one request and returns its status.
+    Statuses of 400 and above and failed connections count as errors.
+    """
+    lock = threading.Lock()
+    remaining = [requests]
+    latencies = []
+    errors = [0]
+
+    def worker():
+        client = Client(url)
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            start = time.perf_counter()
+            try:
+                ok = make_request(client) < 400
+            except (HTTPException, OSError):
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += int(not ok)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return Result(name, latencies, errors[0], time.perf_counter() - start)
+
+
+def token(username, secret):
+    """
+    Signs a JWT for a user the way the auth service does
+    """
+    now = int(time.time())
+    return jwt.encode({'identity': {'username': username},
+                       'iat': now, 'nbf': now, 'exp': now + 3600},
+                      secret, algorithm='HS256').decode('utf-8')
+
+
+def scenarios(trips, secret, rng=random):
+    """
+    The requests to benchmark, as (name, make_request) pairs
+
+    `trips` is a list of existing public (username, id) pairs, whose
+    users are picked as often as they have trips. Trips created by the
+    create scenario are deleted by the delete scenario, so run them in
+    that order.
+    """
+    created = []
+    tokens = {}
+    lock = threading.Lock()
+
+    def auth(username):
+        if username not in tokens:
+            tokens[username] = 'JWT ' + token(username, secret)
+        return {'Authorization': tokens[username],
+                'Content-Type': 'application/json'}
+
+    def global_feed(client):
+        return client.request('GET', '/trips/?size=20')[0]
+
+    def user_feed(client):
+        path = '/trips/{}?size=20'.format(rng.choice(trips)[0])
+        return client.request('GET', path)[0]
+
+    def get_trip(client):
+        username, id = rng.choice(trips)
+        return client.request('GET',
+                              '/trips/{}/{}'.format(username, id))[0]
+
+    def create_trip(client):
+        username = rng.choice(trips)[0]
+        body = json.dumps({'title': 'bench trip', 'start': 'Hue',
+                           'finish': 'Hanoi', 'description': 'benchmark'})
+        status, body = client.request('POST', '/trips/' + username,
+                                      body, auth(username))
+        if status == 201:
+            with lock:
+                created.append((username, json.loads(
+                    body.decode('utf-8'))['trip']['id']))
+        return status
+
+    def delete_trip(client):
+        with lock:
+            if not created:
+                return 404
+            username, id = created.pop()
+        return client.request('DELETE', '/trips/{}/{}'.format(username, id),
+                              headers=auth(username))[0]
+
+    return [('global_feed', global_feed),
+            ('user_feed', user_feed),
+            ('get_trip', get_trip),
+            ('create_trip', create_trip),
+            ('delete_trip', delete_trip)]
+
+
+def error_rate(summary):
+    if not summary['requests']:
+        return 0.0
+    return summary['errors'] / summary['requests']
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Lists the scenarios that got slower than their baseline by more than
+    `tolerance`, in p99 latency or requests per second, or that failed
+    more often than their baseline
+
+    Failed requests are often the fastest, so errors are checked first
+    and the timings of a scenario are only compared without them.
+    """
+    regressions = []
+    for name, summary in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if error_rate(summary) > error_rate(base):
+            regressions.append('{}: {:.1%} errors, baseline {:.1%}'.format(
+                name, error_rate(summary), error_rate(base)))
+            continue
+        if summary['p99_ms'] is None or base['p99_ms'] is None:
+            continue
+        if summary['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append('{}: p99 {:.1f}ms, baseline {:.1f}ms'.format(
+                name, summary['p99_ms'], base['p99_ms']))
+        if summary['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append('{}: {:.0f} rps, baseline {:.0f} rps'.format(
+                name, summary['rps'], base['rps']))
+    return regressions
+
+
+def report(results, baseline=None):
+    """
+    Formats results as a table, next to their baseline if there is one
+    """
+    baseline = baseline or {}
+    lines = ['{:<12} {:>8} {:>6} {:>9} {:>9} {:>8} {:>9}'.format(
+        'scenario', 'requests', 'errors', 'p50 ms', 'p99 ms', 'rps',
+        'base p99')]
+    for name, summary in sorted(results.items()):
+        base = baseline.get(name, {}).get('p99_ms')
+        lines.append('{:<12} {:>8} {:>6} {:>9} {:>9} {:>8.0f} {:>9}'
+                     .format(name, summary['requests'], summary['errors'],
+                             milliseconds(summary['p50_ms']),
+                             milliseconds(summary['p99_ms']),
+                             summary['rps'], milliseconds(base)))
+    return '\n'.join(lines)
+
+
+def milliseconds(value):
+    return '-' if value is None else '{:.2f}'.format(value)
@@ -0,0 +1,103 @@
+import io
+import random
+import bisect
+from datetime import datetime, timedelta
+
+from trips import db
+
+PLACES = ('Ho Chi Minh', 'Hanoi', 'Hue', 'Da Nang', 'Hoi An', 'Sapa',
+          'Nha Trang', 'Da Lat', 'Can Tho', 'Halong', 'Vientiane',
+          'Luang Prabang', 'Phnom Penh', 'Siem Reap', 'Bangkok',
+          'Chiang Mai')
+WORDS = ('motorbike', 'train', 'boat', 'bus', 'coast', 'mountains',
+         'delta', 'rice', 'caves', 'temples', 'market', 'loop')
+COLUMNS = ('title', 'username', 'complete', 'created_at', 'start',
+           'finish', 'public', 'description')
+# Rows sent per COPY
+CHUNK_SIZE = 50000
+
+
+def username(rank):
+    return 'user{}'.format(rank)
+
+
+class SkewedUsers(object):
+    """
+    Picks users with Zipf-like weights, so a few heavy users own most
+    of the trips, like the real data
+    """
+
+    def __init__(self, users, skew=1.1, rng=random):
+        self.rng = rng
+        self.cumulative = []
+        total = 0.0
+        for rank in range(1, users + 1):
+            total += 1.0 / rank ** skew
+            self.cumulative.append(total)
+
+    def pick(self):
+        point = self.rng.random() * self.cumulative[-1]
+        return username(bisect.bisect(self.cumulative, point) + 1)
+
+
+def copy_value(value):
+    """
+    Formats a value for COPY's text format
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+                      .replace('\n', '\\n'))
+
+
+def trip_rows(trips, users, rng, now):
+    """
+    Yields made up trips of skewed users over the last three years
+    """
+    for n in range(trips):
+        words = rng.sample(WORDS, 3)
+        yield (' '.join(words[:2]).capitalize(),
+               users.pick(),
+               rng.random() < 0.8,
+               now - timedelta(seconds=rng.randrange(3 * 365 * 86400)),
+               rng.choice(PLACES),
+               rng.choice(PLACES),
+               rng.random() < 0.9,
+               'A trip by {} and {} number {}'.format(words[1], words[2],
+                                                      n))
+
+
+def seed(trips=1000000, users=100000, skew=1.1, random_seed=0):
+    """
+    Loads `trips` trips of `users` users into the trips table with COPY
+    and updates the planner's statistics
+
+    The same arguments always make the same data.
+    """
+    rng = random.Random(random_seed)
+    rows = trip_rows(trips, SkewedUsers(users, skew, rng), rng,
+                     datetime.utcnow())
+    sql = 'COPY trips ({}) FROM STDIN'.format(', '.join(COLUMNS))
+
+    conn = db.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        loaded = 0
+        while loaded < trips:
+            buf = io.StringIO()
+            for row in rows:
+                buf.write('\t'.join(copy_value(v) for v in row) + '\n')
+                loaded += 1
+                if loaded % CHUNK_SIZE == 0:
+                    break
+            buf.seek(0)
+            cursor.copy_expert(sql, buf)
+        conn.commit()
+    finally:
+        conn.close()
+    with db.engine.connect() as connection:
+        connection.execution_options(
+            isolation_level='AUTOCOMMIT').execute('ANALYZE trips')
+    return loaded
@@ -1,16 +1,126 @@
 import os
+import multiprocessing
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
+def env_flag(name, default):
+    """
+    Reads an on/off setting, where 0, false, no, off and empty are off
+    """
+    value = os.environ.get(name, default)
+    return value.strip().lower() not in ('0', 'false', 'no', 'off', '')
+
+
 class Config:
     HOST = '0.0.0.0'
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'hard to guess string'
     SSL_DISABLE = os.environ.get('SSL_DISABLE', False)
     JWT_AUTH_USERNAME_KEY = 'username'
     JWT_AUTH_PASSWORD_KEY = 'password'
+    # RS256 tokens are verified with a PEM public key or keys from a JWKS
+    # url, so that only the auth service holds the signing key
+    JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
+    JWT_PUBLIC_KEY = os.environ.get('JWT_PUBLIC_KEY')
+    JWT_JWKS_URL = os.environ.get('JWT_JWKS_URL')
+    JWT_JWKS_CACHE_SECONDS = 3600
+    # Verified tokens remembered until they expire
+    JWT_TOKEN_CACHE_SIZE = 10000
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI',
                                              'postgres://postgres:5432/stoic')
+    # Connections held per worker, and how many more may be opened briefly
+    SQLALCHEMY_POOL_SIZE = int(os.environ.get('SQLALCHEMY_POOL_SIZE', 5))
+    SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get('SQLALCHEMY_MAX_OVERFLOW',
+                                                 10))
+    SQLALCHEMY_POOL_TIMEOUT = int(os.environ.get('SQLALCHEMY_POOL_TIMEOUT',
+                                                 10))
+    SQLALCHEMY_POOL_RECYCLE = int(os.environ.get('SQLALCHEMY_POOL_RECYCLE',
+                                                 1800))
+    SQLALCHEMY_POOL_PRE_PING = env_flag('SQLALCHEMY_POOL_PRE_PING', '1')
+    # Connections shared by all requests of an ASGI worker
+    ASYNC_POOL_MIN_SIZE = int(os.environ.get('ASYNC_POOL_MIN_SIZE', 1))
+    ASYNC_POOL_MAX_SIZE = int(os.environ.get('ASYNC_POOL_MAX_SIZE', 20))
+    # Comma separated read replicas that list and search requests use
+    SQLALCHEMY_REPLICA_URIS = [
+        uri for uri in os.environ.get('SQLALCHEMY_REPLICA_URIS', '').split(',')
+        if uri]
+    # Seconds a user's trips are read from the primary after they change
+    # them, to hide replica lag. Kept in the cache, so it needs redis with
+    # more than one worker
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+    # Hold no connections when PgBouncer in front of postgres pools them
+    SQLALCHEMY_PGBOUNCER = env_flag('SQLALCHEMY_PGBOUNCER', '0')
+    # gunicorn, for ./manage.py serve. Keep GUNICORN_THREADS within the
+    # pool size plus overflow, as each thread may hold a connection
+    GUNICORN_BIND = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+    GUNICORN_WORKER_CLASS = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+    GUNICORN_WORKERS = int(os.environ.get('GUNICORN_WORKERS',
+                                          multiprocessing.cpu_count() * 2))
+    GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 4))
+    GUNICORN_KEEPALIVE = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+    GUNICORN_TIMEOUT = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+    # Recycle workers after this many requests, give or take the jitter
+    GUNICORN_MAX_REQUESTS = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+    GUNICORN_MAX_REQUESTS_JITTER = int(
+        os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+    # Seconds to wait on and then reuse a readiness check of the database
+    READY_TIMEOUT = float(os.environ.get('READY_TIMEOUT', 1.0))
+    READY_CACHE_SECONDS = float(os.environ.get('READY_CACHE_SECONDS', 2.0))
+    # Directory where workers leave their metrics for /metrics to add up.
+    # ./manage.py serve makes one when it runs more than one worker
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 1))
+    # Log queries taking at least this many seconds, 0 turns it off
+    SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS', 0))
+    # How list endpoints count their results unless ?total= is given
+    TRIPS_TOTAL_DEFAULT = os.environ.get('TRIPS_TOTAL_DEFAULT', 'none')
+    # Most trips that may be asked for in one page
+    TRIPS_PAGE_LIMIT = int(os.environ.get('TRIPS_PAGE_LIMIT', 100))
+    # Most trips that may be created or deleted in one batch request
+    TRIPS_BATCH_LIMIT = 1000
+    # Tab separated file of place names, latitudes and longitudes that the
+    # start and finish of new trips are geocoded against, such as
+    # bench/places.tsv. Without one trips are not geocoded
+    GAZETTEER_PATH = os.environ.get('GAZETTEER_PATH')
+    GAZETTEER_CACHE_SIZE = 10000
+    # Largest radius in km of a search for nearby trips
+    NEAR_MAX_RADIUS_KM = float(os.environ.get('NEAR_MAX_RADIUS_KM', 500))
+    # Services that hold the blurbs, images, lines and points of trips, as
+    # comma separated urls with {username} and {trip_id} in them. Each must
+    # delete up to ?limit= of a trip's items per DELETE and answer with
+    # {"deleted": n}
+    TRIP_CHILD_SERVICES = [
+        url for url in os.environ.get('TRIP_CHILD_SERVICES', '').split(',')
+        if url]
+    TRIP_CHILD_SERVICE_TOKEN = os.environ.get('TRIP_CHILD_SERVICE_TOKEN')
+    TRIP_CHILD_BATCH = 500
+    # Background jobs, kept in the jobs table and run by a thread that
+    # each worker starts when it boots. Turn JOBS_WORKER off to only run
+    # them with ./manage.py jobs
+    JOBS_EAGER = False
+    JOBS_WORKER = env_flag('JOBS_WORKER', '1')
+    JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 5))
+    JOBS_BACKOFF_SECONDS = float(os.environ.get('JOBS_BACKOFF_SECONDS', 2))
+    JOBS_LEASE_SECONDS = 300
+    JOBS_POLL_SECONDS = 1
+    # Compress response bodies of at least this many bytes, 0 turns it
+    # off. Brotli is used when the brotli package is installed and the
+    # client takes it, gzip otherwise
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+    COMPRESS_BROTLI = env_flag('COMPRESS_BROTLI', '1')
+    COMPRESS_BROTLI_LEVEL = int(os.environ.get('COMPRESS_BROTLI_LEVEL', 5))
+    # Indent JSON responses. Unset, they are indented in debug only
+    JSON_PRETTY_PRINT = (env_flag('JSON_PRETTY_PRINT', '0')
+                         if 'JSON_PRETTY_PRINT' in os.environ else None)
+    # memory, redis or null
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'memory')
+    CACHE_DEFAULT_TIMEOUT = int(os.environ.get('CACHE_DEFAULT_TIMEOUT', 30))
+    CACHE_THRESHOLD = int(os.environ.get('CACHE_THRESHOLD', 10000))
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL',
+                                     'redis://localhost:6379/0')
+    # Number of newest trips cached per user to serve first pages from
+    CACHE_FEED_SIZE = 50
 
     @staticmethod
     def init_app(app):
@@ -27,7 +137,9 @@ class TestingConfig(Config):
     TESTING = True
     SECRET_KEY = 'secret'
     DEBUG = True
-    SQLALCHEMY_DATABASE_URI = 'postgres:///stoic_test'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URI',
+                                             'postgres:///stoic_test')
+    JOBS_EAGER = True
 
 
 class ProductionConfig(Config):
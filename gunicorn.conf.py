@@ -0,0 +1,8 @@
+# Settings for running `gunicorn -c gunicorn.conf.py wsgi:app`, taken
+# from the same config as `./manage.py serve`
+import os
+from config import config
+from trips.server import server_options
+
+globals().update(server_options(config[os.getenv('FLASK_CONFIG') or
+                                       'default']))
@@ -31,10 +31,133 @@ def test(coverage=False):
     call(["python","-m","pytest","--pep8","test"])
     call(["python","-m","pytest","--pep8","trips"])
 
+@manager.option('-u', '--username', dest='username', default=None,
+                help='Only export trips of this user')
+@manager.option('-o', '--output', dest='output', default='-',
+                help='File to write to, - for stdout')
+@manager.option('-z', '--gzip', dest='compress', action='store_true',
+                default=False, help='Gzip the output')
+def export(username=None, output='-', compress=False):
+    """ Export trips, private ones too, as newline delimited JSON """
+    import sys
+    from trips.export import export_chunks
+    out = sys.stdout.buffer if output == '-' else open(output, 'wb')
+    try:
+        for chunk in export_chunks(username, compress, owner=True):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+
+@manager.command
+def serve():
+    """ Run the app under gunicorn """
+    import sys
+    from config import config
+    from trips.server import Server, server_options
+    try:
+        options = server_options(config[os.getenv('FLASK_CONFIG') or
+                                        'default'])
+    except ValueError as e:
+        sys.exit(str(e))
+    Server(app, options).run()
+
+
+@manager.command
+def jobs():
+    """ Run background jobs as they fall due """
+    from trips.jobs import work
+    work(app)
+
+
+@manager.command
+def geocode():
+    """ Geocode the places of trips from the gazetteer """
+    import sys
+    from trips.geo import geocode_trips
+    try:
+        print('geocoded {} places of trips'.format(geocode_trips()))
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+@manager.option('-n', '--partitions', dest='partitions', type=int,
+                default=16, help='Hash partitions, or 0 for one table')
+def partition(partitions=16):
+    """ Hash partition trips by username, or undo it, if not done yet """
+    from trips.partitions import partition_trips, unpartition_trips
+    with db.engine.begin() as conn:
+        if partitions:
+            changed = partition_trips(conn, partitions)
+        else:
+            changed = unpartition_trips(conn)
+    if not changed:
+        print('trips are already {}'.format(
+            'partitioned' if partitions else 'one table'))
+    elif partitions:
+        print('partitioned trips {} ways'.format(partitions))
+    else:
+        print('copied trips back into one table')
+
+
+@manager.command
+def stats():
+    """ Count every user's trips into their stats again """
+    from trips.stats import rebuild_stats
+    print('counted trips of {} users'.format(rebuild_stats()))
+
+
+@manager.option('-t', '--trips', dest='trips', type=int, default=1000000,
+                help='Number of trips to create')
+@manager.option('-u', '--users', dest='users', type=int, default=100000,
+                help='Number of users to spread them over')
+@manager.option('-s', '--skew', dest='skew', type=float, default=1.1,
+                help='How heavily trips favour the first users')
+def seed(trips=1000000, users=100000, skew=1.1):
+    """ Load made up trips for benchmarking """
+    from bench.seed import seed
+    from trips.stats import rebuild_stats
+    print('loaded {} trips'.format(seed(trips, users, skew)))
+    print('counted trips of {} users'.format(rebuild_stats()))
+
+
+@manager.option('--url', dest='url', default='http://localhost:5000',
+                help='Server to benchmark')
+@manager.option('-n', '--requests', dest='requests', type=int, default=2000,
+                help='Requests per scenario')
+@manager.option('-c', '--concurrency', dest='concurrency', type=int,
+                default=16, help='Requests in flight at once')
+@manager.option('-b', '--baseline', dest='baseline', default=None,
+                help='Baseline results to compare against')
+@manager.option('--tolerance', dest='tolerance', type=float, default=0.2,
+                help='Fraction by which results may be worse than baseline')
+@manager.option('--save', dest='save', action='store_true', default=False,
+                help='Store the results as the new baseline')
+def bench(url, requests=2000, concurrency=16, baseline=None, tolerance=0.2,
+          save=False):
+    """ Benchmark a running server against the baseline """
+    import sys
+    import bench as harness
+    path = baseline or harness.BASELINE
+    results = harness.run(url, app.config['JWT_SECRET_KEY'], requests,
+                          concurrency)
+    previous = harness.load_baseline(path)
+    print(harness.report(results, previous))
+    if save:
+        harness.save_baseline(results, path)
+    elif previous is not None:
+        regressions = harness.compare(results, previous, tolerance)
+        for regression in regressions:
+            print('regression: ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
 @manager.command
 def deploy():
     """ Run deployment tasks """
-    from flask.ext.migrate import upgrade
+    from flask_migrate import upgrade
 
     # migrate database to latest revision
     upgrade()
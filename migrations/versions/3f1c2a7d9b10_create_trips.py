@@ -0,0 +1,37 @@
+"""create trips
+
+Revision ID: 3f1c2a7d9b10
+Revises: 
+Create Date: 2017-05-04 01:47:05.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7d9b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('trips',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('title', sa.String(length=255), nullable=True),
+                    sa.Column('username', sa.String(length=32),
+                              nullable=True),
+                    sa.Column('complete', sa.Boolean(), nullable=True),
+                    sa.Column('created_at', sa.DateTime(), nullable=True),
+                    sa.Column('start', sa.String(length=32), nullable=True),
+                    sa.Column('finish', sa.String(length=32), nullable=True),
+                    sa.Column('public', sa.Boolean(), nullable=True),
+                    sa.Column('description', sa.Text(), nullable=True),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_trips_username', 'trips', ['username'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_trips_username', table_name='trips')
+    op.drop_table('trips')
@@ -0,0 +1,47 @@
+"""composite indexes for the trip feeds
+
+Revision ID: 8a4e6f0c2d31
+Revises: 3f1c2a7d9b10
+Create Date: 2026-10-18 09:12:44.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4e6f0c2d31'
+down_revision = '3f1c2a7d9b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # build the indexes without locking writes to the trips table
+    with op.get_context().autocommit_block():
+        op.create_index('ix_trips_username_created_at_id', 'trips',
+                        ['username', sa.text('created_at DESC'),
+                         sa.text('id DESC')],
+                        postgresql_concurrently=True)
+        op.create_index('ix_trips_created_at_id', 'trips',
+                        [sa.text('created_at DESC'), sa.text('id DESC')],
+                        postgresql_concurrently=True)
+        op.create_index('ix_trips_public_created_at_id', 'trips',
+                        [sa.text('created_at DESC'), sa.text('id DESC')],
+                        postgresql_where=sa.text('public IS true'),
+                        postgresql_concurrently=True)
+        # username lookups are covered by the composite index
+        op.drop_index('ix_trips_username', table_name='trips',
+                      postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_trips_username', 'trips', ['username'],
+                        postgresql_concurrently=True)
+        op.drop_index('ix_trips_public_created_at_id', table_name='trips',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_trips_created_at_id', table_name='trips',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_trips_username_created_at_id', table_name='trips',
+                      postgresql_concurrently=True)
@@ -0,0 +1,51 @@
+"""geocoded start and finish of trips
+
+Revision ID: a93d5c7e1f04
+Revises: f7c3a9e1b482
+Create Date: 2026-10-18 21:12:44.000000
+
+The new columns are empty until ./manage.py geocode fills them in for
+existing trips.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a93d5c7e1f04'
+down_revision = 'f7c3a9e1b482'
+branch_labels = None
+depends_on = None
+
+
+def is_partitioned():
+    return op.get_bind().execute(sa.text(
+        "SELECT relkind = 'p' FROM pg_class "
+        "WHERE relname = 'trips' AND relkind IN ('r', 'p')")).scalar()
+
+
+def upgrade():
+    # nullable columns without defaults do not rewrite the table
+    for prefix in ('start', 'finish'):
+        op.add_column('trips', sa.Column(prefix + '_lat', sa.Float()))
+        op.add_column('trips', sa.Column(prefix + '_lon', sa.Float()))
+        op.add_column('trips', sa.Column(prefix + '_geohash',
+                                         sa.String(12)))
+
+    # partitioned tables cannot be indexed concurrently
+    concurrently = not is_partitioned()
+    with op.get_context().autocommit_block():
+        for prefix in ('start', 'finish'):
+            column = prefix + '_geohash'
+            op.create_index('ix_trips_' + column, 'trips', [column],
+                            postgresql_ops={column: 'varchar_pattern_ops'},
+                            postgresql_where=sa.text(column + ' IS NOT NULL'),
+                            postgresql_concurrently=concurrently)
+
+
+def downgrade():
+    for prefix in ('start', 'finish'):
+        op.drop_index('ix_trips_{}_geohash'.format(prefix),
+                      table_name='trips')
+        for suffix in ('lat', 'lon', 'geohash'):
+            op.drop_column('trips', '{}_{}'.format(prefix, suffix))
@@ -0,0 +1,58 @@
+"""per user counts and newest trip
+
+Revision ID: b2e8d4f6a1c9
+Revises: a93d5c7e1f04
+Create Date: 2026-10-18 22:31:09.000000
+
+Trips are counted into the new table under a lock that blocks writes
+(but not reads) until the migration commits.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2e8d4f6a1c9'
+down_revision = 'a93d5c7e1f04'
+branch_labels = None
+depends_on = None
+
+
+REBUILD = """
+INSERT INTO user_trip_stats (username, trips, completed, latest_id,
+    latest_created_at, public_trips, public_completed, public_latest_id,
+    public_latest_created_at)
+SELECT c.username, c.trips, c.completed, l.id, l.created_at,
+       c.public_trips, c.public_completed, p.id, p.created_at
+FROM (SELECT username, count(*) AS trips,
+             count(*) FILTER (WHERE complete) AS completed,
+             count(*) FILTER (WHERE public) AS public_trips,
+             count(*) FILTER (WHERE public AND complete) AS public_completed
+      FROM trips WHERE username IS NOT NULL GROUP BY username) c
+JOIN (SELECT DISTINCT ON (username) username, id, created_at FROM trips
+      ORDER BY username, created_at DESC, id DESC) l USING (username)
+LEFT JOIN (SELECT DISTINCT ON (username) username, id, created_at
+           FROM trips WHERE public
+           ORDER BY username, created_at DESC, id DESC) p USING (username)
+"""
+
+
+def upgrade():
+    op.create_table(
+        'user_trip_stats',
+        sa.Column('username', sa.String(length=32), nullable=False),
+        sa.Column('trips', sa.Integer(), nullable=False),
+        sa.Column('completed', sa.Integer(), nullable=False),
+        sa.Column('latest_id', sa.Integer(), nullable=True),
+        sa.Column('latest_created_at', sa.DateTime(), nullable=True),
+        sa.Column('public_trips', sa.Integer(), nullable=False),
+        sa.Column('public_completed', sa.Integer(), nullable=False),
+        sa.Column('public_latest_id', sa.Integer(), nullable=True),
+        sa.Column('public_latest_created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('username'))
+    op.execute('LOCK TABLE trips IN SHARE MODE')
+    op.execute(REBUILD)
+
+
+def downgrade():
+    op.drop_table('user_trip_stats')
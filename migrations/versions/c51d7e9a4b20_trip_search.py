@@ -0,0 +1,62 @@
+"""full text and trigram search of trips
+
+Revision ID: c51d7e9a4b20
+Revises: 8a4e6f0c2d31
+Create Date: 2026-10-18 14:03:27.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c51d7e9a4b20'
+down_revision = '8a4e6f0c2d31'
+branch_labels = None
+depends_on = None
+
+
+SEARCH_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(start, '') || ' ' || "
+    "coalesce(finish, '')), 'C')")
+
+
+def trigram_available():
+    return op.get_bind().execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_available_extensions "
+        "WHERE name = 'pg_trgm')")).scalar()
+
+
+def upgrade():
+    # rewrites the table to fill in the column for existing trips
+    op.add_column('trips', sa.Column(
+        'search_vector', postgresql.TSVECTOR(),
+        sa.Computed(SEARCH_DOCUMENT, persisted=True)))
+    has_trigram = trigram_available()
+    if has_trigram:
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_trips_search_vector', 'trips', ['search_vector'],
+                        postgresql_using='gin',
+                        postgresql_concurrently=True)
+        # without pg_trgm, search falls back to matching whole words only
+        if has_trigram:
+            for column in ('start', 'finish'):
+                op.create_index('ix_trips_{}_trgm'.format(column), 'trips',
+                                [column], postgresql_using='gin',
+                                postgresql_ops={column: 'gin_trgm_ops'},
+                                postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for column in ('start', 'finish'):
+            op.execute('DROP INDEX CONCURRENTLY IF EXISTS '
+                       'ix_trips_{}_trgm'.format(column))
+        op.drop_index('ix_trips_search_vector', table_name='trips',
+                      postgresql_concurrently=True)
+    op.drop_column('trips', 'search_vector')
@@ -0,0 +1,31 @@
+"""partial index for the public view of user feeds
+
+Revision ID: e2b86f31d7a5
+Revises: c51d7e9a4b20
+Create Date: 2026-10-18 16:21:05.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b86f31d7a5'
+down_revision = 'c51d7e9a4b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_trips_username_public_created_at_id', 'trips',
+                        ['username', sa.text('created_at DESC'),
+                         sa.text('id DESC')],
+                        postgresql_where=sa.text('public IS true'),
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_trips_username_public_created_at_id',
+                      table_name='trips', postgresql_concurrently=True)
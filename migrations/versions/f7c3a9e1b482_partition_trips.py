@@ -0,0 +1,26 @@
+"""hash partition trips by username
+
+Revision ID: f7c3a9e1b482
+Revises: e2b86f31d7a5
+Create Date: 2026-10-18 19:40:12.000000
+
+This used to partition trips when TRIPS_PARTITIONS was set, which made
+the schema depend on the config at the time. Partitioning is now done,
+or undone, whenever it is needed with ./manage.py partition, so this
+revision changes nothing. Tables it already partitioned stay that way.
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7c3a9e1b482'
+down_revision = 'e2b86f31d7a5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    pass
+
+
+def downgrade():
+    pass
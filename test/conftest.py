@@ -0,0 +1,44 @@
+import os
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+
+from config import TestingConfig
+
+
+def create_database(url):
+    """
+    Creates the database of a url, if it does not exist yet, from the
+    server's postgres database
+    """
+    server = create_engine(with_database(url, 'postgres'),
+                           isolation_level='AUTOCOMMIT')
+    try:
+        exists = server.execute(
+            'SELECT 1 FROM pg_database WHERE datname = %s',
+            url.database).scalar()
+        if not exists:
+            server.execute("CREATE DATABASE {} TEMPLATE template0 "
+                           "ENCODING 'UTF8'".format(url.database))
+    finally:
+        server.dispose()
+
+
+def with_database(url, database):
+    url = make_url(str(url))
+    url.database = database
+    return url
+
+
+def pytest_configure(config):
+    """
+    Gives each pytest-xdist worker a database of its own, named after the
+    test database and the worker, so that their schemas do not collide
+    """
+    worker = os.environ.get('PYTEST_XDIST_WORKER')
+    if worker is None:
+        return
+    url = make_url(TestingConfig.SQLALCHEMY_DATABASE_URI)
+    url = with_database(url, '{}_{}'.format(url.database, worker))
+    create_database(url)
+    TestingConfig.SQLALCHEMY_DATABASE_URI = str(url)
@@ -0,0 +1,145 @@
+import json
+import asyncio
+import threading
+import unittest
+from unittest import mock
+
+from test.utils import FlaskTestCase
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+
+@unittest.skipIf(asyncpg is None, 'needs asyncpg')
+class asgiTestCase(FlaskTestCase):
+    """
+    Checks that the ASGI app serves the same bodies as the Flask app
+    """
+
+    # asyncpg only sees trips the Flask app committed
+    transactional = False
+
+    def setUp(self):
+        super(asgiTestCase, self).setUp()
+        from trips.asgi import create_asgi_app
+        self.asgi = create_asgi_app('testing')
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.asgi.shutdown())
+        self.loop.close()
+        super(asgiTestCase, self).tearDown()
+
+    def asgi_get(self, path, query=b'', headers=None):
+        """
+        Makes a GET request to the ASGI app
+        """
+        return self.loop.run_until_complete(
+            self.asgi_request(path, query, headers))
+
+    async def asgi_request(self, path, query=b'', headers=None):
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': path,
+                 'query_string': query,
+                 'headers': [(key.lower().encode('latin-1'),
+                              value.encode('latin-1'))
+                             for key, value in (headers or {}).items()]}
+        await self.asgi(scope, receive, send)
+        return sent[0]['status'], json.loads(sent[1]['body'].decode('utf-8'))
+
+    def flask_get(self, path, query=None):
+        resp = self.client.get(path, query_string=query)
+        return resp.status_code, json.loads(resp.data.decode('utf-8'))
+
+    def test_same_responses(self):
+        """
+        Test the feeds and a single trip against the Flask app
+        """
+        for i in range(3):
+            resp, json_resp = self.make_trip('Dan', title='Dans trip')
+        resp, json_resp = self.make_trip('Bob', title='Bobs trip')
+        tid = json_resp['trip']['id']
+
+        self.assertEqual(self.asgi_get('/trips/', b'size=2&total=exact'),
+                         self.flask_get('/trips/',
+                                        dict(size=2, total='exact')))
+        code, page = self.asgi_get('/trips/Dan', b'size=2')
+        self.assertEqual((code, page),
+                         self.flask_get('/trips/Dan', dict(size=2)))
+        query = 'cursor={}'.format(page['next_cursor']).encode('ascii')
+        self.assertEqual(self.asgi_get('/trips/Dan', query),
+                         self.flask_get('/trips/Dan',
+                                        dict(cursor=page['next_cursor'])))
+        self.assertEqual(self.asgi_get('/trips/', b'fields=id,title'),
+                         self.flask_get('/trips/', dict(fields='id,title')))
+        self.assertEqual(self.asgi_get('/trips/', b'fields=pw')[0], 400)
+        self.assertEqual(self.asgi_get('/trips/Bob/'+str(tid)),
+                         self.flask_get('/trips/Bob/'+str(tid)))
+
+    def test_not_found(self):
+        """
+        Test missing users and trips
+        """
+        code, body = self.asgi_get('/trips/Dan')
+        self.assertEqual(code, 404)
+        code, body = self.asgi_get('/trips/Dan/12')
+        self.assertEqual(code, 404)
+        code, body = self.asgi_get('/trips/', b'cursor=garbage')
+        self.assertEqual(code, 400)
+        code, body = self.asgi_get('/trips/', b'size=0')
+        self.assertEqual(code, 400)
+        code, body = self.asgi_get('/trips/', b'start=garbage')
+        self.assertEqual(code, 400)
+
+    def test_private_trips(self):
+        """
+        Test that private trips are only served to their owner
+        """
+        resp, json_resp = self.make_trip('Dan', public=False)
+        tid = json_resp['trip']['id']
+        path = '/trips/Dan/' + str(tid)
+        code, body = self.asgi_get(path)
+        self.assertEqual(code, 404)
+        code, body = self.asgi_get(path,
+                                   headers=self._api_headers(username='Bob'))
+        self.assertEqual(code, 404)
+        code, body = self.asgi_get(path,
+                                   headers=self._api_headers(username='Dan'))
+        self.assertEqual(code, 200)
+        code, body = self.asgi_get('/trips/Dan',
+                                   headers=self._api_headers(username='Dan'))
+        self.assertEqual(len(body['trips']), 1)
+
+    def test_token_off_loop(self):
+        """
+        Test that other requests are served while a token is verified
+        """
+        self.make_trip('Dan')
+        served = threading.Event()
+        waited = []
+
+        def slow_decode(token):
+            waited.append(served.wait(5))
+            return {'identity': {'username': 'Dan'}}
+
+        async def requests():
+            slow = asyncio.ensure_future(self.asgi_request(
+                '/trips/Dan', headers=self._api_headers(username='Dan')))
+            code, body = await self.asgi_request('/trips/Dan')
+            served.set()
+            return code, await slow
+
+        with mock.patch('trips.asgi.decode_token', slow_decode):
+            code, (slow_code, body) = self.loop.run_until_complete(
+                requests())
+        self.assertEqual(waited, [True])
+        self.assertEqual((code, slow_code), (200, 200))
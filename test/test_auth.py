@@ -0,0 +1,83 @@
+import json
+import time
+import unittest
+
+import jwt
+
+from trips import create_app
+from trips.auth import TokenCache
+from test.utils import FlaskTestCase
+
+
+class tokenCacheTestCase(unittest.TestCase):
+
+    def test_hit_and_expiry(self):
+        """
+        Test that payloads are reused until the token expires
+        """
+        cache = TokenCache()
+        self.assertIsNone(cache.get(b'a'))
+        cache.set(b'a', {'identity': 'Dan'}, time.time() + 60)
+        cache.set(b'b', {'identity': 'Bob'}, time.time() - 1)
+        self.assertEqual(cache.get(b'a'), {'identity': 'Dan'})
+        self.assertIsNone(cache.get(b'b'))
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_bounded(self):
+        """
+        Test that the least recently used token is dropped first
+        """
+        cache = TokenCache(maxsize=1)
+        cache.set(b'a', {}, time.time() + 60)
+        cache.set(b'b', {}, time.time() + 60)
+        self.assertIsNone(cache.get(b'a'))
+        self.assertEqual(cache.get(b'b'), {})
+
+
+class authTestCase(FlaskTestCase):
+
+    def test_cached_verification(self):
+        """
+        Test that repeated writes with one token verify it once
+        """
+        for i in range(3):
+            resp, json_resp = self.make_trip('Dan')
+            self.assertEqual(resp.status_code, 201)
+        resp = self.client.get('/status/auth')
+        stats = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+
+    @unittest.skipIf(not jwt.algorithms.has_crypto, 'needs cryptography')
+    def test_rs256(self):
+        """
+        Test verifying tokens against a public key
+        """
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        private = rsa.generate_private_key(65537, 2048, default_backend())
+        public = private.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo)
+        self.app.config['JWT_ALGORITHM'] = 'RS256'
+        self.app.extensions['jwt_keys'].pem = public
+
+        token = jwt.encode({'identity': {'username': 'Dan'},
+                            'nbf': 1493862425,
+                            'exp': 9999999999,
+                            'iat': 1493862425}, private, algorithm='RS256')
+        headers = self._api_headers()
+        headers['Authorization'] = 'JWT ' + token.decode('utf-8')
+        resp = self.client.post('/trips/Dan', headers=headers,
+                                data=json.dumps({'title': 'trip 1'}))
+        self.assertEqual(resp.status_code, 201)
+
+        # tokens signed with the old shared secret are now refused
+        resp = self.client.post('/trips/Dan',
+                                headers=self._api_headers(username='Dan'),
+                                data=json.dumps({'title': 'trip 1'}))
+        self.assertEqual(resp.status_code, 403)
@@ -0,0 +1,54 @@
+import random
+import unittest
+from collections import Counter
+
+from bench.driver import Result, compare, report
+from bench.seed import SkewedUsers, copy_value
+
+
+class benchTestCase(unittest.TestCase):
+
+    def test_skewed_users(self):
+        """
+        Test that the first users get most of the trips
+        """
+        users = SkewedUsers(1000, rng=random.Random(0))
+        picks = Counter(users.pick() for _ in range(10000))
+        self.assertEqual(picks.most_common(1)[0][0], 'user1')
+        self.assertGreater(picks['user1'], picks['user100'] * 10)
+
+    def test_copy_value(self):
+        """
+        Test escaping of values for COPY
+        """
+        self.assertEqual(copy_value(None), '\\N')
+        self.assertEqual(copy_value(True), 't')
+        self.assertEqual(copy_value('a\tb\\'), 'a\\tb\\\\')
+
+    def test_compare(self):
+        """
+        Test that slower results are reported against the baseline
+        """
+        result = Result('feed', [0.01] * 98 + [0.1, 0.2], 0, 1.0)
+        self.assertEqual(result.percentile(50), 0.01)
+        self.assertEqual(result.percentile(99), 0.1)
+        summary = result.summary()
+        baseline = {'feed': dict(summary, p99_ms=50, rps=200)}
+        self.assertEqual(len(compare({'feed': summary}, baseline)), 2)
+        self.assertEqual(compare({'feed': summary}, {'feed': summary}), [])
+
+    def test_compare_errors(self):
+        """
+        Test that failing faster than the baseline is a regression, and
+        that runs without requests can be reported
+        """
+        baseline = {'feed': Result('feed', [0.05] * 100, 0, 1.0).summary()}
+        failing = Result('feed', [0.001] * 100, 100, 0.1).summary()
+        regressions = compare({'feed': failing}, baseline)
+        self.assertEqual(regressions,
+                         ['feed: 100.0% errors, baseline 0.0%'])
+
+        empty = Result('feed', [], 0, 0.0).summary()
+        self.assertIsNone(empty['p99_ms'])
+        self.assertEqual(compare({'feed': empty}, baseline), [])
+        self.assertIn('feed', report({'feed': empty}, baseline))
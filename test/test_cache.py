@@ -0,0 +1,41 @@
+import time
+import unittest
+
+from trips.cache import MemoryBackend
+
+
+class memoryCacheTestCase(unittest.TestCase):
+
+    def test_get_set(self):
+        """
+        Test storing and deleting values
+        """
+        cache = MemoryBackend()
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', {'trips': []})
+        self.assertEqual(cache.get('a'), {'trips': []})
+        cache.delete('a', 'b')
+        self.assertIsNone(cache.get('a'))
+
+    def test_expiry(self):
+        """
+        Test that entries expire after their timeout
+        """
+        cache = MemoryBackend()
+        cache.set('a', 1, timeout=0.05)
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_lru_eviction(self):
+        """
+        Test that the least recently used entry is evicted first
+        """
+        cache = MemoryBackend(threshold=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
@@ -0,0 +1,116 @@
+import gzip
+import json
+import unittest
+
+from trips.compress import brotli
+from test.utils import FlaskTestCase
+
+
+class compressTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(compressTestCase, self).setUp()
+        for i in range(10):
+            self.make_trip('Dan', description='A long way ' * 20)
+
+    def get(self, url, encoding=None, **params):
+        headers = self._api_headers()
+        if encoding is not None:
+            headers['Accept-Encoding'] = encoding
+        return self.client.get(url, headers=headers, query_string=params)
+
+    def test_gzip(self):
+        """
+        Test that large responses are gzipped for clients that take it
+        """
+        plain = self.get('/trips/')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+
+        resp = self.get('/trips/', 'gzip, deflate')
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+        self.assertLess(len(resp.data), len(plain.data) / 4)
+        self.assertEqual(int(resp.headers['Content-Length']),
+                         len(resp.data))
+
+        for encoding in ('identity', 'gzip;q=0'):
+            resp = self.get('/trips/', encoding)
+            self.assertNotIn('Content-Encoding', resp.headers)
+
+    def test_threshold(self):
+        """
+        Test that small responses and COMPRESS_MIN_SIZE=0 are left alone
+        """
+        resp = self.get('/trips/', 'gzip', size=1, fields='id')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.app.config['COMPRESS_MIN_SIZE'] = 0
+        resp = self.get('/trips/', 'gzip')
+        self.assertNotIn('Content-Encoding', resp.headers)
+
+    def test_not_recompressed(self):
+        """
+        Test that streamed, already encoded and empty responses are left
+        alone
+        """
+        resp = self.get('/trips/_export', 'gzip', gzip=1)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(resp.data).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 10)
+
+        resp = self.get('/trips/', 'gzip')
+        headers = self._api_headers()
+        headers.update({'Accept-Encoding': 'gzip',
+                        'If-None-Match': resp.headers['ETag']})
+        resp = self.client.get('/trips/', headers=headers)
+        self.assertEqual(resp.status_code, 304)
+        self.assertNotIn('Content-Encoding', resp.headers)
+
+    @unittest.skipIf(brotli is None, 'needs brotli')
+    def test_brotli(self):
+        """
+        Test that brotli is preferred when the client takes it
+        """
+        plain = self.get('/trips/')
+        resp = self.get('/trips/', 'gzip, br')
+        self.assertEqual(resp.headers['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(resp.data), plain.data)
+        self.app.config['COMPRESS_BROTLI'] = False
+        resp = self.get('/trips/', 'gzip, br')
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+
+    def test_fields(self):
+        """
+        Test that ?fields leaves out the other fields of trips
+        """
+        full = self.get('/trips/Dan')
+        for url in ('/trips/', '/trips/Dan', '/trips/_search'):
+            resp = self.get(url, fields='title, id', q='long')
+            self.assertEqual(resp.status_code, 200)
+            trips = json.loads(resp.data.decode('utf-8'))['trips']
+            self.assertEqual(len(trips), 10)
+            self.assertEqual(list(trips[0]), ['id', 'title'])
+        resp = self.get('/trips/Dan', fields='title,id')
+        self.assertNotEqual(resp.headers['ETag'], full.headers['ETag'])
+
+        for fields in ('', 'title,password', ','):
+            resp = self.get('/trips/', fields=fields)
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn('fields must be some of',
+                          json.loads(resp.data.decode('utf-8'))['message'])
+
+    def test_pretty_print(self):
+        """
+        Test that JSON_PRETTY_PRINT overrides indenting in debug
+        """
+        self.assertTrue(self.app.debug)
+        self.assertGreater(self.get('/trips/').data.count(b'\n'), 1)
+        self.app.config['JSON_PRETTY_PRINT'] = False
+        self.assertEqual(self.get('/trips/').data.count(b'\n'), 1)
+        resp, json_resp = self.make_trip('Dan')
+        self.assertEqual(resp.data.count(b'\n'), 1)
+
+        self.app.debug = False
+        self.app.config['JSON_PRETTY_PRINT'] = True
+        self.assertGreater(self.get('/trips/').data.count(b'\n'), 1)
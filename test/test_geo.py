@@ -0,0 +1,111 @@
+import os
+import json
+
+from trips import db
+from trips.geo import (Gazetteer, covering_cells, encode_geohash,
+                       geocode_trips)
+from trips.model import Trip
+from test.utils import FlaskTestCase
+
+PLACES = os.path.join(os.path.dirname(__file__), '..', 'bench',
+                      'places.tsv')
+HANOI = {'lat': 21.0278, 'lon': 105.8342}
+
+
+class geoTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(geoTestCase, self).setUp()
+        self.app.config['GAZETTEER_PATH'] = PLACES
+
+    def near(self, **params):
+        resp = self.client.get('/trips/_near', query_string=params)
+        return resp.status_code, json.loads(resp.data.decode('utf-8'))
+
+    def test_geohash(self):
+        """
+        Test geohashes and the cells that cover a radius
+        """
+        self.assertEqual(encode_geohash(57.64911, 10.40744), 'u4pruydqq')
+        self.assertEqual(encode_geohash(-25.382708, -49.265506, 5), '6gkzw')
+        cells = covering_cells(21.0278, 105.8342, 20)
+        self.assertIn(encode_geohash(21.0278, 105.8342)[:len(cells[0])],
+                      cells)
+        # a point 19km north is in one of the cells
+        self.assertIn(encode_geohash(21.2, 105.8342)[:len(cells[0])], cells)
+        self.assertIsNone(covering_cells(0, 0, 10000))
+
+    def test_gazetteer(self):
+        """
+        Test that places are found by any of their names
+        """
+        places = Gazetteer(PLACES)
+        self.assertEqual(places.lookup('Hanoi'), (21.0278, 105.8342))
+        self.assertEqual(places.lookup('  ha noi '), (21.0278, 105.8342))
+        self.assertEqual(places.lookup('Saigon, Vietnam'),
+                         places.lookup('Ho Chi Minh'))
+        self.assertIsNone(places.lookup('Atlantis'))
+
+    def test_near(self):
+        """
+        Test that trips starting or finishing near a point are listed
+        """
+        self.make_trip('Dan', start='Ho Chi Minh', finish='Hanoi')
+        self.make_trip('Bob', start='Hue', finish='Ha Noi')
+        self.make_trip('Ann', start='Bangkok', finish='Chiang Mai')
+        self.make_trip('Eve', start='Hanoi', public=False)
+        self.make_trip('Sam', start='Atlantis', finish='Hanoi, Vietnam')
+        trip = Trip.query.filter_by(username='Ann').one()
+        self.assertEqual(trip.start_geohash[:3], 'w4r')
+        self.assertEqual(Trip.query.filter_by(username='Sam').one()
+                         .start_lat, None)
+
+        code, body = self.near(radius=20, size=2, **HANOI)
+        self.assertEqual(code, 200)
+        self.assertEqual([t['username'] for t in body['trips']],
+                         ['Sam', 'Bob'])
+        code, body = self.near(radius=20, cursor=body['next_cursor'],
+                               **HANOI)
+        self.assertEqual([t['username'] for t in body['trips']], ['Dan'])
+        self.assertIsNone(body['next_cursor'])
+
+        # Hue is about 500km from Hanoi, Bangkok further still
+        code, body = self.near(lat=16.4637, lon=107.5909, radius=50)
+        self.assertEqual([t['username'] for t in body['trips']], ['Bob'])
+        code, body = self.near(lat=13.7, lon=100.5, radius=20)
+        self.assertEqual([t['username'] for t in body['trips']], ['Ann'])
+
+    def test_near_params(self):
+        """
+        Test that a point and radius are required to be sensible
+        """
+        for params in ({}, {'lat': 91, 'lon': 0}, {'lat': 0, 'lon': 181},
+                       {'lat': 'x', 'lon': 0}, dict(HANOI, radius=0),
+                       dict(HANOI, radius=501), dict(HANOI, radius='nan'),
+                       dict(HANOI, cursor='garbage')):
+            code, body = self.near(**params)
+            self.assertEqual(code, 400, params)
+
+    def test_geocode_trips(self):
+        """
+        Test that trips made before there was a gazetteer are geocoded
+        """
+        self.app.config['GAZETTEER_PATH'] = None
+        self.make_trip('Dan', start='Hue', finish='Atlantis')
+        resp = self.client.post(
+            '/trips/Bob/batch', headers=self._api_headers(username='Bob'),
+            data=json.dumps({'trips': [{'title': 'a', 'start': 'Hanoi'}]}))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(Trip.query.filter(
+            Trip.start_geohash.isnot(None)).count(), 0)
+        with self.assertRaises(ValueError):
+            geocode_trips()
+
+        self.app.extensions['geo'].clear()
+        self.app.config['GAZETTEER_PATH'] = PLACES
+        self.assertEqual(geocode_trips(), 2)
+        self.assertEqual(geocode_trips(), 0)
+        code, body = self.near(radius=20, **HANOI)
+        self.assertEqual([t['username'] for t in body['trips']], ['Bob'])
+        dan = Trip.query.filter_by(username='Dan').one()
+        self.assertEqual((dan.start_lat, dan.finish_lat), (16.4637, None))
@@ -0,0 +1,184 @@
+import io
+import json
+import threading
+from unittest import mock
+from urllib.error import HTTPError
+
+from trips import db, jobs
+from trips.jobs import handler, run_job, QUEUED, DONE, FAILED
+from trips.model import Job
+from test.utils import FlaskTestCase
+
+
+class ChildService(object):
+    """
+    Answers DELETEs for a trip's content like the other services would,
+    failing the first `failures` of them
+    """
+
+    def __init__(self, items, failures=0):
+        self.items = items
+        self.failures = failures
+        self.urls = []
+
+    def __call__(self, request, timeout=None):
+        self.urls.append(request.full_url)
+        if self.failures:
+            self.failures -= 1
+            raise HTTPError(request.full_url, 503, 'unavailable', {}, None)
+        limit = int(request.full_url.split('limit=')[1])
+        deleted = min(limit, self.items)
+        self.items -= deleted
+        return io.BytesIO(json.dumps({'deleted': deleted}).encode('utf-8'))
+
+
+class jobsTestCase(FlaskTestCase):
+
+    def setUp(self):
+        super(jobsTestCase, self).setUp()
+        self.app.config['TRIP_CHILD_SERVICES'] = [
+            'http://points/{username}/{trip_id}']
+        self.app.config['TRIP_CHILD_BATCH'] = 2
+
+    def queue(self, payload, key):
+        """
+        Queues a job to delete a trip's content, commits and runs it
+        """
+        job = jobs.enqueue('trip_deleted', payload, key)
+        db.session.commit()
+        job, = jobs.committed([job])
+        return job
+
+    def test_delete_content(self):
+        """
+        Test that deleting a trip deletes its content in batches and
+        reports the job
+        """
+        resp, json_resp = self.make_trip('Dan')
+        tid = json_resp['trip']['id']
+        service = ChildService(5)
+        with mock.patch('urllib.request.urlopen', service):
+            resp = self.client.delete(
+                '/trips/Dan/{}'.format(tid),
+                headers=self._api_headers(username='Dan'))
+        self.assertEqual(resp.status_code, 202)
+        job = json.loads(resp.data.decode('utf-8'))['job']
+        self.assertEqual(job['status'], DONE)
+        self.assertEqual(service.items, 0)
+        self.assertEqual(service.urls,
+                         ['http://points/Dan/{}?limit=2'.format(tid)] * 3)
+
+        location = resp.headers['Location']
+        resp = self.client.get(location,
+                               headers=self._api_headers(username='Dan'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data.decode('utf-8'))['job'], job)
+        resp = self.client.get(location,
+                               headers=self._api_headers(username='Bob'))
+        self.assertEqual(resp.status_code, 403)
+        resp = self.client.get('/trips/_jobs/nope',
+                               headers=self._api_headers(username='Dan'))
+        self.assertEqual(resp.status_code, 404)
+
+    def test_retries(self):
+        """
+        Test that failed jobs are retried until they run out of attempts
+        """
+        self.app.config['TRIP_CHILD_BATCH'] = 10
+        service = ChildService(1, failures=2)
+        with mock.patch('urllib.request.urlopen', service):
+            job = self.queue({'username': 'Dan', 'trip_id': 1}, 'a')
+        self.assertEqual(job.status, DONE)
+        self.assertEqual(job.attempts, 3)
+
+        service = ChildService(1, failures=10)
+        with mock.patch('urllib.request.urlopen', service):
+            job = self.queue({'username': 'Dan', 'trip_id': 2}, 'b')
+        self.assertEqual(job.status, FAILED)
+        self.assertEqual(job.attempts, 5)
+        self.assertIn('503', job.error)
+
+    def test_idempotent(self):
+        """
+        Test that a job is only queued and run once per key
+        """
+        service = ChildService(0)
+        with mock.patch('urllib.request.urlopen', service):
+            first = self.queue({'username': 'Dan', 'trip_id': 1}, 'a')
+            second = self.queue({'username': 'Dan', 'trip_id': 1}, 'a')
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(len(service.urls), 1)
+
+    def test_queued_with_delete(self):
+        """
+        Test that a delete that fails to commit queues no job
+        """
+        resp, json_resp = self.make_trip('Dan')
+        tid = json_resp['trip']['id']
+        service = ChildService(0)
+        with mock.patch('urllib.request.urlopen', service), \
+                mock.patch.object(db.session, 'commit',
+                                  side_effect=ValueError('gone')):
+            resp = self.client.delete(
+                '/trips/Dan/{}'.format(tid),
+                headers=self._api_headers(username='Dan'))
+        self.assertEqual(resp.status_code, 500)
+        db.session.rollback()
+        self.assertEqual(Job.query.count(), 0)
+        self.assertEqual(service.urls, [])
+        resp = self.client.get('/trips/Dan/{}'.format(tid),
+                               headers=self._api_headers(username='Dan'))
+        self.assertEqual(resp.status_code, 200)
+
+    def test_backoff(self):
+        """
+        Test that a worker leaves failed jobs until they are due again
+        """
+        queue = self.app.extensions['jobs']
+        queue.backoff = 60
+        calls = []
+
+        @handler('flaky')
+        def flaky(payload):
+            calls.append(payload)
+            raise ValueError('not yet')
+
+        job = queue.put('flaky', {'n': 1}, 'flaky:1')
+        db.session.commit()
+        self.assertTrue(run_job(self.app, queue, queue.claim()))
+        self.assertFalse(run_job(self.app, queue, queue.claim()))
+        self.assertEqual(len(calls), 1)
+        job = queue.get(job.id)
+        self.assertEqual(job.status, QUEUED)
+        self.assertGreater((job.run_at - job.updated_at).total_seconds(), 59)
+
+
+class workerTestCase(FlaskTestCase):
+    """
+    Runs jobs with the thread a worker starts when it boots
+    """
+
+    # the thread only sees jobs once they are committed
+    transactional = False
+
+    def test_worker(self):
+        """
+        Test that the worker runs jobs queued by requests until stopped
+        """
+        self.app.config['JOBS_EAGER'] = False
+        self.app.config['JOBS_POLL_SECONDS'] = 0.01
+        done = threading.Event()
+
+        @handler('ping')
+        def ping(payload):
+            done.set()
+
+        jobs.start(self.app)
+        self.addCleanup(jobs.stop, self.app)
+        job = jobs.enqueue('ping', {}, 'ping')
+        self.assertEqual(job.status, QUEUED)
+        db.session.commit()
+        self.assertTrue(done.wait(5))
+        jobs.stop(self.app)
+        self.assertIsNone(self.app.extensions['jobs_worker'])
+        self.assertEqual(jobs.get(job.id).status, DONE)
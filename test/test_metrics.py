@@ -0,0 +1,142 @@
+import json
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy.exc import ProgrammingError
+
+from trips import db
+from trips.metrics import (Histogram, Registry, format_families,
+                           merge_families, read_snapshots, write_snapshot,
+                           retire_snapshot)
+from test.utils import FlaskTestCase
+
+
+class histogramTestCase(unittest.TestCase):
+
+    def test_render(self):
+        """
+        Test that buckets are rendered cumulatively with sum and count
+        """
+        registry = Registry()
+        latency = registry.histogram('latency', 'Latency', ('endpoint',),
+                                     (0.1, 1))
+        latency.observe(0.05, endpoint='/a')
+        latency.observe(0.5, endpoint='/a')
+        latency.observe(5, endpoint='/a')
+        lines = registry.render().splitlines()
+        self.assertEqual(lines[:2], ['# HELP latency Latency',
+                                     '# TYPE latency histogram'])
+        self.assertIn('latency_bucket{endpoint="/a",le="0.1"} 1.0', lines)
+        self.assertIn('latency_bucket{endpoint="/a",le="1.0"} 2.0', lines)
+        self.assertIn('latency_bucket{endpoint="/a",le="+Inf"} 3.0', lines)
+        self.assertIn('latency_sum{endpoint="/a"} 5.55', lines)
+        self.assertIn('latency_count{endpoint="/a"} 3.0', lines)
+
+
+class snapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def worker(self, requests, connections):
+        registry = Registry()
+        registry.counter('requests', 'Requests').inc(requests)
+        registry.collectors.append(lambda: [
+            ('connections', 'gauge', 'Connections',
+             [('connections', [], connections)])])
+        return registry.collect()
+
+    def render(self):
+        merged = merge_families(read_snapshots(self.directory))
+        return format_families(merged).splitlines()
+
+    def test_merge(self):
+        """
+        Test that the samples of workers are added up, and that a dead
+        worker's counters are kept but not its gauges
+        """
+        write_snapshot(self.directory, '1', self.worker(3, 2))
+        write_snapshot(self.directory, '2', self.worker(4, 5))
+        lines = self.render()
+        self.assertIn('requests 7.0', lines)
+        self.assertIn('connections 7.0', lines)
+
+        retire_snapshot(self.directory, 1)
+        lines = self.render()
+        self.assertIn('requests 7.0', lines)
+        self.assertIn('connections 5.0', lines)
+
+
+class metricsTestCase(FlaskTestCase):
+
+    def test_metrics(self):
+        """
+        Test that requests are timed and exposed at /metrics
+        """
+        self.make_trip('Dan')
+        resp = self.client.get('/trips/Dan')
+        self.assertIn('db;dur=', resp.headers['Server-Timing'])
+        self.assertIn('serialize;dur=', resp.headers['Server-Timing'])
+
+        resp = self.client.get('/metrics')
+        self.assertEqual(resp.mimetype, 'text/plain')
+        lines = resp.data.decode('utf-8').splitlines()
+        self.assertIn('trips_request_duration_seconds_count{method="GET",'
+                      'endpoint="/trips/<string:username>",status="200"} 1.0',
+                      lines)
+        self.assertIn('trips_db_pool_size{bind="primary"} 5.0', lines)
+        self.assertIn('trips_token_cache_misses_total 1.0', lines)
+
+    def test_slow_query_log(self):
+        """
+        Test that queries over the threshold are logged
+        """
+        self.app.config['SLOW_QUERY_SECONDS'] = 1e-9
+        with self.assertLogs(self.app.logger, 'WARNING') as logs:
+            self.client.get('/trips/')
+        self.assertIn('slow query', logs.output[0])
+        self.assertIn('FROM trips', logs.output[0])
+
+    def test_failed_query(self):
+        """
+        Test that queries that fail leave no start time behind
+        """
+        with db.engine.connect() as conn:
+            with self.assertRaises(ProgrammingError):
+                conn.execute('SELECT nope')
+            self.assertEqual(conn.info['query_start'], [])
+
+    def test_metrics_dir(self):
+        """
+        Test that /metrics adds up the samples of all workers
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        metrics = self.app.extensions['metrics']
+        self.addCleanup(metrics.stop)
+        self.app.config['METRICS_DIR'] = directory
+        write_snapshot(directory, 'other', [
+            ('trips_slow_queries_total', 'counter', 'Slow', [
+                ('trips_slow_queries_total', [], 2)])])
+        resp = self.client.get('/metrics')
+        lines = resp.data.decode('utf-8').splitlines()
+        self.assertIn('trips_slow_queries_total 2.0', lines)
+
+    def test_stop_flusher(self):
+        """
+        Test that stopping the metrics ends the flusher thread
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.app.config['METRICS_DIR'] = directory
+        self.app.config['METRICS_FLUSH_SECONDS'] = 60
+        metrics = self.app.extensions['metrics']
+        self.client.get('/trips/')
+        flusher = metrics._flusher
+        self.assertTrue(flusher.is_alive())
+        metrics.stop()
+        self.assertFalse(flusher.is_alive())
+        self.client.get('/trips/')
+        self.assertIsNone(metrics._flusher)
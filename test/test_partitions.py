@@ -0,0 +1,83 @@
+import re
+import json
+
+from sqlalchemy import text
+
+from trips import db
+from trips.model import Trip
+from trips.pagination import keyset_query
+from trips.partitions import partition_trips, unpartition_trips
+from trips.sql import explain
+from test.utils import FlaskTestCase
+
+
+class partitionTestCase(FlaskTestCase):
+    """
+    Runs the app against a trips table partitioned by ./manage.py
+    partition
+    """
+
+    # partitioning runs on a connection of its own
+    transactional = False
+
+    def setUp(self):
+        super(partitionTestCase, self).setUp()
+        self.assertTrue(self.partition(partition_trips, 4))
+
+    def partition(self, convert, *args):
+        # the conversion waits on any lock the session still holds
+        db.session.commit()
+        with db.engine.begin() as conn:
+            return convert(conn, *args)
+
+    def indexes(self):
+        return set(row[0] for row in db.session.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'trips'")))
+
+    def plan(self, query):
+        rows = db.session.execute(explain(query.statement)).fetchall()
+        return '\n'.join(row[0] for row in rows)
+
+    def test_partitioned(self):
+        """
+        Test that trips are spread over partitions and read back in order
+        """
+        for username in ('Dan', 'Bob', 'Ann', 'Eve', 'Sam'):
+            for i in range(2):
+                resp, json_resp = self.make_trip(username)
+                self.assertEqual(resp.status_code, 201)
+        partitions = db.session.execute(
+            'SELECT count(DISTINCT tableoid) FROM trips').scalar()
+        self.assertGreater(partitions, 1)
+
+        resp = self.client.get('/trips/', query_string=dict(size=20))
+        ids = [t['id'] for t in json.loads(resp.data.decode('utf-8'))['trips']]
+        self.assertEqual(ids, list(range(10, 0, -1)))
+
+        plan = self.plan(keyset_query(Trip.query.filter_by(username='Dan'),
+                                      None, 10))
+        self.assertEqual(len(set(re.findall(r'on (trips_p\d+)', plan))), 1)
+        plan = self.plan(keyset_query(Trip.query, None, 10))
+        self.assertIn('Merge Append', plan)
+
+        indexes = self.indexes()
+        self.assertIn('ix_trips_start_geohash', indexes)
+        self.assertFalse(self.partition(partition_trips, 4))
+        self.assertTrue(self.partition(unpartition_trips))
+        self.assertEqual(Trip.query.count(), 10)
+        self.assertEqual(self.indexes(), indexes)
+        self.assertFalse(self.partition(unpartition_trips))
+
+    def test_delete(self):
+        """
+        Test that deleting needs the trip's user as well as its id
+        """
+        resp, json_resp = self.make_trip('Dan')
+        tid = json_resp['trip']['id']
+        resp = self.client.delete('/trips/Bob/{}'.format(tid),
+                                  headers=self._api_headers(username='Bob'))
+        self.assertEqual(resp.status_code, 404)
+        resp = self.client.delete('/trips/Dan/{}'.format(tid),
+                                  headers=self._api_headers(username='Dan'))
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(Trip.query.count(), 0)
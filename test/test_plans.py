@@ -0,0 +1,80 @@
+from datetime import datetime
+
+from trips import db
+from trips.model import Trip
+from trips.pagination import keyset_query, encode_cursor
+from trips.geo import near
+from trips.search import fulltext
+from trips.sql import explain
+
+from test.utils import FlaskTestCase
+
+
+class planTestCase(FlaskTestCase):
+    """
+    Checks that the hot feed queries are planned as index scans
+    """
+
+    def plan(self, query):
+        """
+        Returns the text EXPLAIN of a query with sequential scans
+        discouraged, as they always win on the tiny test tables
+        """
+        db.session.execute('SET LOCAL enable_seqscan = off')
+        rows = db.session.execute(explain(query.statement)).fetchall()
+        return '\n'.join(row[0] for row in rows)
+
+    def test_user_feed_plan(self):
+        """
+        Test that a user's feed seeks on the username composite index
+        """
+        cursor = encode_cursor(datetime.utcnow(), 10)
+        q = keyset_query(Trip.query.filter_by(username='Dan'), cursor, 10)
+        plan = self.plan(q)
+        self.assertIn('ix_trips_username_created_at_id', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_global_feed_plan(self):
+        """
+        Test that the global feed reads the created_at index in order
+        """
+        q = keyset_query(Trip.query, None, 10)
+        plan = self.plan(q)
+        self.assertIn('ix_trips_created_at_id', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_public_feed_plan(self):
+        """
+        Test that the public feed uses the partial index
+        """
+        q = keyset_query(Trip.query.filter(Trip.public.is_(True)), None, 10)
+        plan = self.plan(q)
+        self.assertIn('ix_trips_public_created_at_id', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_public_user_feed_plan(self):
+        """
+        Test that the public view of a user's feed uses the partial index
+        """
+        q = keyset_query(Trip.query.filter_by(username='Dan')
+                                   .filter(Trip.public.is_(True)), None, 10)
+        plan = self.plan(q)
+        self.assertIn('ix_trips_username_public_created_at_id', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_search_plan(self):
+        """
+        Test that full text search reads the GIN index
+        """
+        q, rank = fulltext(Trip.query, 'boat')
+        plan = self.plan(q)
+        self.assertIn('ix_trips_search_vector', plan)
+
+    def test_near_plan(self):
+        """
+        Test that nearby trips are found on the geohash indexes
+        """
+        q = near(Trip.query, 21.0278, 105.8342, 20)
+        plan = self.plan(q)
+        self.assertIn('ix_trips_start_geohash', plan)
+        self.assertIn('ix_trips_finish_geohash', plan)
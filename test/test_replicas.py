@@ -0,0 +1,78 @@
+import json
+from unittest import mock
+
+from sqlalchemy import event
+
+from config import TestingConfig
+from trips import cache, db
+from test.utils import FlaskTestCase
+
+
+class replicaTestCase(FlaskTestCase):
+    """
+    Routes reads to a replica that is the test database under another url
+    """
+
+    # the replica's connection only sees committed trips
+    transactional = False
+
+    def setUp(self):
+        patch = mock.patch.object(TestingConfig, 'SQLALCHEMY_REPLICA_URIS',
+                                  [TestingConfig.SQLALCHEMY_DATABASE_URI])
+        patch.start()
+        self.addCleanup(patch.stop)
+        super(replicaTestCase, self).setUp()
+
+        self.replica_queries = 0
+        replica = db.replica_engines()['replica0']
+        event.listen(replica, 'before_cursor_execute', self.count)
+        self.addCleanup(event.remove, replica, 'before_cursor_execute',
+                        self.count)
+
+    def count(self, *args):
+        self.replica_queries += 1
+
+    def test_reads_use_replica(self):
+        """
+        Test that list reads go to the replica and writes do not
+        """
+        resp, json_resp = self.make_trip('Dan')
+        self.assertEqual(self.replica_queries, 0)
+        resp = self.client.get('/trips/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertGreater(self.replica_queries, 0)
+
+    def test_sticky_after_write(self):
+        """
+        Test that a user's trips are read from the primary after a write
+        """
+        resp, json_resp = self.make_trip('Dan')
+        resp = self.client.get('/trips/Dan')
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(len(json_resp['trips']), 1)
+        self.assertEqual(self.replica_queries, 0)
+
+        cache.clear()
+        resp = self.client.get('/trips/Dan')
+        self.assertGreater(self.replica_queries, 0)
+
+    def test_sticky_needs_cache(self):
+        """
+        Test that serving replicas without a cache to keep reads after a
+        write on the primary is refused
+        """
+        from trips.server import server_options
+        with mock.patch.multiple(TestingConfig, CACHE_TYPE='null',
+                                 GUNICORN_WORKERS=2):
+            self.assertRaises(ValueError, server_options, TestingConfig)
+        with mock.patch.multiple(TestingConfig, CACHE_TYPE='redis',
+                                 GUNICORN_WORKERS=2):
+            self.assertEqual(server_options(TestingConfig)['workers'], 2)
+
+    def test_pool_status(self):
+        """
+        Test that the replica pools are reported
+        """
+        resp = self.client.get('/status/pool')
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertIn('replica0', json_resp['replicas'])
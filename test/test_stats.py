@@ -0,0 +1,82 @@
+import json
+
+from trips.model import UserTripStats
+from trips.stats import rebuild_stats
+from test.utils import FlaskTestCase
+
+
+class statsTestCase(FlaskTestCase):
+
+    def stats(self, username, viewer=None):
+        resp = self.client.get('/trips/{}/stats'.format(username),
+                               headers=self._api_headers(username=viewer))
+        return resp.status_code, json.loads(resp.data.decode('utf-8'))
+
+    def rows(self):
+        return sorted((s.username, s.trips, s.completed, s.latest_id,
+                       s.latest_created_at, s.public_trips,
+                       s.public_completed, s.public_latest_id,
+                       s.public_latest_created_at)
+                      for s in UserTripStats.query.all())
+
+    def test_stats(self):
+        """
+        Test that stats follow trips as they are created and deleted
+        """
+        code, body = self.stats('Dan')
+        self.assertEqual(code, 404)
+        ids = []
+        for complete, public in ((True, True), (False, True),
+                                 (True, False)):
+            resp, json_resp = self.make_trip('Dan', complete=complete,
+                                             public=public)
+            ids.append(json_resp['trip']['id'])
+        resp = self.client.post(
+            '/trips/Dan/batch', headers=self._api_headers(username='Dan'),
+            data=json.dumps({'trips': [{'title': 'a', 'complete': True},
+                                       {'title': 'b', 'public': False}]}))
+        ids.extend(r['id'] for r in
+                   json.loads(resp.data.decode('utf-8'))['results'])
+
+        code, body = self.stats('Dan', 'Dan')
+        self.assertEqual(code, 200)
+        self.assertEqual((body['stats']['trips'], body['stats']['completed'],
+                          body['stats']['latest_trip_id']), (5, 3, ids[4]))
+        code, body = self.stats('Dan')
+        self.assertEqual((body['stats']['trips'], body['stats']['completed'],
+                          body['stats']['latest_trip_id']), (3, 2, ids[3]))
+
+        # deleting the newest trips finds the next newest
+        self.client.delete('/trips/Dan/{}'.format(ids[4]),
+                           headers=self._api_headers(username='Dan'))
+        self.client.delete('/trips/Dan/batch',
+                           headers=self._api_headers(username='Dan'),
+                           data=json.dumps({'ids': [ids[3], ids[0], 999]}))
+        code, body = self.stats('Dan', 'Dan')
+        self.assertEqual((body['stats']['trips'], body['stats']['completed'],
+                          body['stats']['latest_trip_id']), (2, 1, ids[2]))
+        code, body = self.stats('Dan')
+        self.assertEqual((body['stats']['trips'], body['stats']['completed'],
+                          body['stats']['latest_trip_id']), (1, 0, ids[1]))
+
+        # the same as counting from scratch
+        counted = self.rows()
+        self.assertEqual(rebuild_stats(), 1)
+        self.assertEqual(self.rows(), counted)
+
+    def test_private_only(self):
+        """
+        Test that users with only private trips have no public stats
+        """
+        resp, json_resp = self.make_trip('Dan', public=False)
+        code, body = self.stats('Dan', 'Bob')
+        self.assertEqual(code, 404)
+        code, body = self.stats('Dan', 'Dan')
+        self.assertEqual(body['stats']['trips'], 1)
+
+        self.client.delete('/trips/Dan/{}'.format(json_resp['trip']['id']),
+                           headers=self._api_headers(username='Dan'))
+        code, body = self.stats('Dan', 'Dan')
+        self.assertEqual(code, 404)
+        self.assertEqual(self.rows(),
+                         [('Dan', 0, 0, None, None, 0, 0, None, None)])
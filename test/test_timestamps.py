@@ -0,0 +1,49 @@
+import unittest
+from datetime import datetime
+
+from trips.timestamps import parse_timestamp, TimestampError
+
+
+class timestampTestCase(unittest.TestCase):
+
+    def test_iso_8601(self):
+        """
+        Test the ISO 8601 forms that are accepted, as naive UTC
+        """
+        cases = {
+            '2017-05-04': datetime(2017, 5, 4),
+            '2017-05-04T01:02': datetime(2017, 5, 4, 1, 2),
+            '2017-05-04 01:02:03': datetime(2017, 5, 4, 1, 2, 3),
+            '2017-05-04T01:02:03.5': datetime(2017, 5, 4, 1, 2, 3, 500000),
+            '2017-05-04T01:02:03.123456789Z':
+                datetime(2017, 5, 4, 1, 2, 3, 123456),
+            '2017-05-04T01:02:03+02:00': datetime(2017, 5, 3, 23, 2, 3),
+            '2017-05-04T23:02:03-0130': datetime(2017, 5, 5, 0, 32, 3),
+        }
+        for value, expected in cases.items():
+            self.assertEqual(parse_timestamp(value), expected, value)
+        now = datetime.utcnow()
+        self.assertEqual(parse_timestamp(now.isoformat()), now)
+
+    def test_epoch_millis(self):
+        """
+        Test that strings of digits are milliseconds since the epoch
+        """
+        self.assertEqual(parse_timestamp('1493862425123'),
+                         datetime(2017, 5, 4, 1, 47, 5, 123000))
+        self.assertEqual(parse_timestamp('0'), datetime(1970, 1, 1))
+        self.assertEqual(parse_timestamp('-1000'),
+                         datetime(1969, 12, 31, 23, 59, 59))
+        self.assertEqual(parse_timestamp(1493862425123),
+                         datetime(2017, 5, 4, 1, 47, 5, 123000))
+
+    def test_invalid(self):
+        """
+        Test that anything else is refused rather than guessed at
+        """
+        for value in ('', 'garbage', 'May 4 2017', '04/05/2017',
+                      '2017-13-01', '2017-05-04T25:00', '2017-05-04T1:02',
+                      '2017-05-04Z', ' 2017-05-04', '1e10',
+                      '9' * 15, 10 ** 15, 1493862425.0, True, None):
+            with self.assertRaises(TimestampError, msg=repr(value)):
+                parse_timestamp(value)
@@ -1,11 +1,14 @@
 import json
 import time
 import unittest
+from collections import OrderedDict
 from datetime import datetime
 
 from flask import current_app, url_for
-from trips import create_app, db
+from trips import create_app, db, cache
+from trips.cache import trip_key
 from trips.model import Trip
+from trips.pagination import encode_cursor
 
 from test.utils import FlaskTestCase
 
@@ -21,6 +24,26 @@ class tripTestCase(FlaskTestCase):
         self.assertEqual(json_resp['status'], 200)
         self.assertEqual(len(json_resp['version']), 7)
 
+    def test_ready(self):
+        """
+        Test the readiness endpoint
+        """
+        resp = self.client.get('/status/ready')
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json_resp['status'], 200)
+
+    def test_pool_status(self):
+        """
+        Test the pool status endpoint
+        """
+        resp = self.client.get('/status/pool')
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(json_resp['pool'], 'TimedQueuePool')
+        self.assertEqual(json_resp['size'], 5)
+        self.assertGreaterEqual(json_resp['checkouts'], 0)
+        self.assertLessEqual(json_resp['saturation'], 1)
+
     def test_new_trip(self):
         """
         Test trip creation via REST API
@@ -111,7 +134,7 @@ class tripTestCase(FlaskTestCase):
         resp, json_resp = self.make_trip('Dan', title='Dans trip')
         resp, json_resp = self.make_trip('Bob', title='Bobs trip')
         self.assertEqual(Trip.query.count(), 2)
-        resp = self.client.get('/trips/')
+        resp = self.client.get('/trips/', query_string=dict(total='exact'))
         json_resp = json.loads(resp.data.decode('utf-8'))
         self.assertEqual(json_resp['total'], 2)
 
@@ -134,7 +157,7 @@ class tripTestCase(FlaskTestCase):
 
         resp = self.client.delete('/trips/Dan/1',
                                   headers=self._api_headers(username='Dan'))
-        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.status_code, 202)
         self.assertEqual(Trip.query.count(), 2)
 
         resp = self.client.delete('/trips/Dan/1',
@@ -156,18 +179,33 @@ class tripTestCase(FlaskTestCase):
         # Test size
         resp = self.client.get('/trips/',
                                headers=self._api_headers(),
-                               query_string=dict(size=5))
+                               query_string=dict(size=5, total='exact'))
         json_resp = json.loads(resp.data.decode('utf-8'))
         self.assertEqual(len(json_resp['trips']), 5)
         self.assertEqual(json_resp['total'], 33)
 
         resp = self.client.get('/trips/Dan',
                                headers=self._api_headers(),
-                               query_string=dict(size=8))
+                               query_string=dict(size=8, total='exact'))
         json_resp = json.loads(resp.data.decode('utf-8'))
         self.assertEqual(len(json_resp['trips']), 8)
         self.assertEqual(json_resp['total'], 17)
 
+    def test_size_bounds(self):
+        """
+        Test that page sizes outside 1 to TRIPS_PAGE_LIMIT are refused
+        """
+        self.make_trip('Dan')
+        limit = current_app.config['TRIPS_PAGE_LIMIT']
+        for url in ('/trips/', '/trips/Dan', '/trips/_search'):
+            for size in (0, -1, limit + 1):
+                resp = self.client.get(url, query_string=dict(q='trip',
+                                                              size=size))
+                self.assertEqual(resp.status_code, 400)
+            resp = self.client.get(url, query_string=dict(q='trip',
+                                                          size=limit))
+            self.assertEqual(resp.status_code, 200)
+
     def test_start_param(self):
         """
         Test the ?start param
@@ -188,18 +226,52 @@ class tripTestCase(FlaskTestCase):
         # Test start
         resp = self.client.get('/trips/',
                                headers=self._api_headers(),
-                               query_string=dict(start=t1))
+                               query_string=dict(start=t1, total='exact'))
         json_resp = json.loads(resp.data.decode('utf-8'))
         self.assertEqual(len(json_resp['trips']), 4)
         self.assertEqual(json_resp['total'], 4)
 
         resp = self.client.get('/trips/Dan',
                                headers=self._api_headers(),
-                               query_string=dict(start=t1))
+                               query_string=dict(start=t1, total='exact'))
         json_resp = json.loads(resp.data.decode('utf-8'))
         self.assertEqual(len(json_resp['trips']), 2)
         self.assertEqual(json_resp['total'], 2)
 
+    def test_invalid_start(self):
+        """
+        Test that ?start takes epoch millis and refuses other formats
+        """
+        t0 = datetime(2017, 5, 4, 1, 2, 3)
+        self.make_trip('Dan', created_at=t0.isoformat() + 'Z')
+        self.make_trip('Dan', created_at='1493862425000')
+        # 01:02:02 and 01:47:06 on the day
+        for start, count in (('1493859722000', 2), ('1493862426000', 0)):
+            resp = self.client.get('/trips/', query_string=dict(start=start))
+            json_resp = json.loads(resp.data.decode('utf-8'))
+            self.assertEqual(len(json_resp['trips']), count)
+        for url in ('/trips/', '/trips/Dan'):
+            for start in ('garbage', 'May 4 2017', '2017-02-30'):
+                resp = self.client.get(url, query_string=dict(start=start))
+                self.assertEqual(resp.status_code, 400)
+                json_resp = json.loads(resp.data.decode('utf-8'))
+                self.assertIn('ISO 8601', json_resp['message'])
+
+        resp, json_resp = self.make_trip('Dan', created_at='May 4 2017')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_numeric_created_at(self):
+        """
+        Test that created_at takes epoch millis as a JSON number too
+        """
+        resp, json_resp = self.make_trip('Dan', created_at=1493862425000)
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(json_resp['trip']['created_at'],
+                         '2017-05-04T01:47:05')
+        for value in (True, 1493862425000.0):
+            resp, json_resp = self.make_trip('Dan', created_at=value)
+            self.assertEqual(resp.status_code, 400)
+
     def test_auth(self):
         """
         Test the authorization when posting to /trips/username/
@@ -212,3 +284,410 @@ class tripTestCase(FlaskTestCase):
         self.assertEqual(resp.status_code, 403)
         json_resp = json.loads(resp.data.decode('utf-8'))
         self.assertEqual(json_resp['message'], 'not allowed')
+
+    def test_cursor_param(self):
+        """
+        Test paging with ?cursor across trips created at the same time
+        """
+        t0 = datetime.utcnow().isoformat()
+        for i in range(7):
+            resp = self.make_trip('Dan', title='Dans', created_at=t0)
+        seen = []
+        cursor = None
+        for page in range(3):
+            query = dict(size=3)
+            if cursor:
+                query['cursor'] = cursor
+            resp = self.client.get('/trips/Dan',
+                                   headers=self._api_headers(),
+                                   query_string=query)
+            json_resp = json.loads(resp.data.decode('utf-8'))
+            seen.extend(t['id'] for t in json_resp['trips'])
+            cursor = json_resp['next_cursor']
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+        self.assertIsNone(cursor)
+
+        resp = self.client.get('/trips/',
+                               headers=self._api_headers(),
+                               query_string=dict(cursor='garbage'))
+        self.assertEqual(resp.status_code, 400)
+
+    def test_total_param(self):
+        """
+        Test the ?total param
+        """
+        for i in range(3):
+            resp = self.make_trip('Dan', title='Dans trip')
+        resp = self.client.get('/trips/Dan', headers=self._api_headers())
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(len(json_resp['trips']), 3)
+        self.assertIsNone(json_resp['total'])
+
+        resp = self.client.get('/trips/Dan',
+                               headers=self._api_headers(),
+                               query_string=dict(total='estimate'))
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertIsInstance(json_resp['total'], int)
+
+        resp = self.client.get('/trips/',
+                               headers=self._api_headers(),
+                               query_string=dict(total='all'))
+        self.assertEqual(resp.status_code, 400)
+
+    def test_cache_invalidation(self):
+        """
+        Test that cached reads reflect creation and deletion of trips
+        """
+        resp, json_resp = self.make_trip('Dan', title='Dans trip')
+        tid = json_resp['trip']['id']
+        resp = self.client.get('/trips/Dan', headers=self._api_headers())
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(len(json_resp['trips']), 1)
+        resp = self.client.get('/trips/Dan/'+str(tid),
+                               headers=self._api_headers())
+        self.assertEqual(resp.status_code, 200)
+
+        resp, json_resp = self.make_trip('Dan', title='Dans 2nd trip')
+        resp = self.client.get('/trips/Dan', headers=self._api_headers())
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(len(json_resp['trips']), 2)
+        self.assertEqual(json_resp['trips'][0]['title'], 'Dans 2nd trip')
+
+        resp = self.client.delete('/trips/Dan/'+str(tid),
+                                  headers=self._api_headers(username='Dan'))
+        resp = self.client.get('/trips/Dan/'+str(tid),
+                               headers=self._api_headers())
+        self.assertEqual(resp.status_code, 404)
+        resp = self.client.get('/trips/Dan', headers=self._api_headers())
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(len(json_resp['trips']), 1)
+
+    def test_cache_race(self):
+        """
+        Test that a read cached after a delete it raced with is not served
+        """
+        resp, json_resp = self.make_trip('Dan', title='Dans trip')
+        tid = json_resp['trip']['id']
+        # a reader looks up the generation, then queries before the delete
+        generation = cache.generation('Dan')
+        stale = {'trip': json_resp['trip'],
+                 'cursor': encode_cursor(datetime.utcnow(), tid)}
+        resp = self.client.delete('/trips/Dan/'+str(tid),
+                                  headers=self._api_headers(username='Dan'))
+        self.assertEqual(resp.status_code, 202)
+        # and caches what it read after the delete committed
+        cache.set(trip_key('Dan', tid, generation), stale)
+        resp = self.client.get('/trips/Dan/'+str(tid))
+        self.assertEqual(resp.status_code, 404)
+
+    def test_conditional_get(self):
+        """
+        Test ETag and If-None-Match on trip reads
+        """
+        resp, json_resp = self.make_trip('Dan', title='Dans trip')
+        tid = json_resp['trip']['id']
+        for url in ['/trips/', '/trips/Dan', '/trips/Dan/'+str(tid)]:
+            resp = self.client.get(url, headers=self._api_headers())
+            self.assertEqual(resp.status_code, 200)
+            etag = resp.headers['ETag']
+            self.assertIn('Last-Modified', resp.headers)
+
+            headers = self._api_headers()
+            headers['If-None-Match'] = etag
+            resp = self.client.get(url, headers=headers)
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b'')
+
+        headers = self._api_headers()
+        resp = self.client.get('/trips/Dan', headers=headers)
+        headers['If-None-Match'] = resp.headers['ETag']
+        resp, json_resp = self.make_trip('Dan', title='Dans 2nd trip')
+        resp = self.client.get('/trips/Dan', headers=headers)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], headers['If-None-Match'])
+
+    def test_batch_create(self):
+        """
+        Test creating many trips with one request
+        """
+        trips = [{'title': 'trip 1', 'start': 'Hue'},
+                 {'start': 'Hue'},
+                 {'title': 'trip 3', 'public': False},
+                 {'title': 'trip 4', 'owner': 'Bob'}]
+        resp = self.client.post('/trips/Dan/batch',
+                                headers=self._api_headers(username='Dan'),
+                                data=json.dumps({'trips': trips}))
+        self.assertEqual(resp.status_code, 200)
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(json_resp['count'], 2)
+        statuses = [r['status'] for r in json_resp['results']]
+        self.assertEqual(statuses, [201, 400, 201, 400])
+        self.assertEqual(json_resp['results'][1]['message'],
+                         'missing fields: title')
+        self.assertEqual(json_resp['results'][3]['message'],
+                         'unknown fields: owner')
+        self.assertEqual(Trip.query.count(), 2)
+        trip = Trip.query.get(json_resp['results'][2]['id'])
+        self.assertEqual(trip.title, 'trip 3')
+        self.assertEqual(trip.public, False)
+        self.assertEqual(trip.username, 'Dan')
+
+        resp = self.client.post('/trips/Dan/batch',
+                                headers=self._api_headers(username='Bob'),
+                                data=json.dumps({'trips': trips}))
+        self.assertEqual(resp.status_code, 403)
+
+    def test_invalid_fields(self):
+        """
+        Test that trips with mistyped or overlong fields are refused one
+        by one rather than failing the request
+        """
+        trips = [{'title': 'trip 1'},
+                 {'title': 'trip 2', 'start': 'x' * 40},
+                 {'title': 'trip 3', 'public': 'no'},
+                 {'title': 7},
+                 {'title': 'x' * 256},
+                 {'title': 'trip 6', 'created_at': 1493862425.5}]
+        resp = self.client.post('/trips/Dan/batch',
+                                headers=self._api_headers(username='Dan'),
+                                data=json.dumps({'trips': trips}))
+        self.assertEqual(resp.status_code, 200)
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        statuses = [r['status'] for r in json_resp['results']]
+        self.assertEqual(statuses, [201, 400, 400, 400, 400, 400])
+        self.assertEqual(json_resp['results'][1]['message'],
+                         'start must be at most 32 characters')
+        self.assertEqual(json_resp['results'][2]['message'],
+                         'public must be true or false')
+        self.assertEqual(Trip.query.count(), 1)
+
+        resp, json_resp = self.make_trip('Dan', public='no')
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(json_resp['message'], 'public must be true or false')
+
+    def test_batch_delete(self):
+        """
+        Test deleting many trips with one request
+        """
+        resp, dan1 = self.make_trip('Dan')
+        resp, dan2 = self.make_trip('Dan')
+        resp, bob1 = self.make_trip('Bob')
+        ids = [dan1['trip']['id'], bob1['trip']['id'], dan2['trip']['id']]
+        resp = self.client.delete('/trips/Dan/batch',
+                                  headers=self._api_headers(username='Dan'),
+                                  data=json.dumps({'ids': ids}))
+        self.assertEqual(resp.status_code, 200)
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(json_resp['count'], 2)
+        statuses = [r['status'] for r in json_resp['results']]
+        self.assertEqual(statuses, [200, 404, 200])
+        self.assertEqual(Trip.query.count(), 1)
+        self.assertEqual(Trip.query.first().username, 'Bob')
+
+        resp = self.client.delete('/trips/Bob/batch',
+                                  headers=self._api_headers(username='Bob'),
+                                  data=json.dumps({'ids': [True]}))
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(Trip.query.count(), 1)
+
+    def test_fast_path_matches_marshal(self):
+        """
+        Test that list responses are byte for byte what marshalling the
+        trips with the paginated model gives
+        """
+        from flask_restplus import marshal
+        from flask_restplus.representations import output_json
+        from trips.api.trip import paginated
+
+        for i in range(3):
+            resp = self.make_trip('Dan', title='Dans trip', public=i > 0)
+        resp = self.client.get('/trips/Dan',
+                               headers=self._api_headers(username='Dan'),
+                               query_string=dict(size=2, total='exact'))
+        json_resp = json.loads(resp.data.decode('utf-8'))
+
+        trips = (Trip.query.order_by(Trip.created_at.desc(), Trip.id.desc())
+                           .limit(2))
+        expected = marshal({'trips': [t.to_json() for t in trips],
+                            'total': 3,
+                            'next_cursor': json_resp['next_cursor'],
+                            'message': 'found trips for Dan'}, paginated)
+        self.assertEqual(resp.data, output_json(expected, 200).data)
+        self.assertEqual(resp.headers['Content-Type'], 'application/json')
+
+    def test_fast_encoder_matches_marshal(self):
+        """
+        Test that without an indent, list responses are one line of the
+        same JSON that marshalling gives, in the same key order
+        """
+        from flask_restplus import marshal
+        from trips.api.trip import paginated
+
+        self.app.debug = False
+        resp = self.make_trip('Dan', title='Chuyến đi Huế', start='Huế')
+        resp = self.client.get('/trips/Dan', query_string=dict(total='exact'))
+        self.assertEqual(resp.data.count(b'\n'), 1)
+        json_resp = json.loads(resp.data.decode('utf-8'),
+                               object_pairs_hook=OrderedDict)
+
+        expected = marshal({'trips': [t.to_json() for t in Trip.query],
+                            'total': 1,
+                            'next_cursor': None,
+                            'message': 'found trips for Dan'}, paginated)
+        self.assertEqual(json.dumps(json_resp), json.dumps(expected))
+
+    def test_export(self):
+        """
+        Test streaming trips as newline delimited JSON
+        """
+        import gzip
+        for i in range(3):
+            resp = self.make_trip('Dan', title='Dans trip')
+        resp = self.make_trip('Bob', title='Bobs trip')
+
+        resp = self.client.get('/trips/Dan/export')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        lines = resp.data.decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])['username'], 'Dan')
+
+        resp = self.client.get('/trips/_export',
+                               query_string=dict(gzip=1))
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(resp.data).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 4)
+
+    def test_route_names(self):
+        """
+        Test that users named like the routes that are not theirs can
+        still list their trips
+        """
+        for username in ('export', 'search', 'near', 'jobs'):
+            resp, json_resp = self.make_trip(username)
+            tid = json_resp['trip']['id']
+            resp = self.client.get('/trips/' + username)
+            self.assertEqual(resp.status_code, 200, username)
+            json_resp = json.loads(resp.data.decode('utf-8'))
+            self.assertEqual(json_resp['trips'][0]['username'], username)
+            resp = self.client.get('/trips/{}/{}'.format(username, tid))
+            self.assertEqual(resp.status_code, 200, username)
+
+    def test_search(self):
+        """
+        Test full text search, best matches first
+        """
+        self.make_trip('Dan', title='Mekong delta by boat',
+                       description='Boats and floating markets')
+        self.make_trip('Dan', title='Sapa', description='Rice by boat',
+                       public=False)
+        self.make_trip('Bob', title='Halong bay', finish='Halong')
+
+        resp = self.client.get('/trips/_search',
+                               headers=self._api_headers(username='Dan'),
+                               query_string=dict(q='boats', username='Dan'))
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(resp.status_code, 200)
+        titles = [t['title'] for t in json_resp['trips']]
+        self.assertEqual(titles, ['Mekong delta by boat', 'Sapa'])
+
+        resp = self.client.get('/trips/_search',
+                               headers=self._api_headers(username='Dan'),
+                               query_string=dict(q='boat', username='Dan',
+                                                 public='false'))
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(json_resp['trips'][0]['title'], 'Sapa')
+        self.assertEqual(len(json_resp['trips']), 1)
+        resp = self.client.get('/trips/_search',
+                               query_string=dict(q='chi minh', username='Bob'))
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(json_resp['trips'][0]['title'], 'Halong bay')
+
+        resp = self.client.get('/trips/_search')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get('/trips/_search',
+                               query_string=dict(q='boat', public='maybe'))
+        self.assertEqual(resp.status_code, 400)
+
+    def test_search_cursor(self):
+        """
+        Test paging through search results with equal ranks
+        """
+        for i in range(5):
+            self.make_trip('Dan', title='Dans trip')
+        seen = []
+        cursor = None
+        for page in range(3):
+            query = dict(q='trip', size=2)
+            if cursor:
+                query['cursor'] = cursor
+            resp = self.client.get('/trips/_search', query_string=query)
+            json_resp = json.loads(resp.data.decode('utf-8'))
+            seen.extend(t['id'] for t in json_resp['trips'])
+            cursor = json_resp['next_cursor']
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(set(seen)), 5)
+        self.assertIsNone(cursor)
+
+        resp = self.client.get('/trips/_search',
+                               query_string=dict(q='trip', cursor='garbage'))
+        self.assertEqual(resp.status_code, 400)
+
+    def test_search_trigram(self):
+        """
+        Test that prefixes and misspellings of places still match
+        """
+        from trips.search import trigram_enabled
+        if not trigram_enabled():
+            self.skipTest('pg_trgm is not installed')
+        self.make_trip('Dan', finish='Hanoi')
+        for q in ('Han', 'Hanio'):
+            resp = self.client.get('/trips/_search', query_string=dict(q=q))
+            json_resp = json.loads(resp.data.decode('utf-8'))
+            self.assertEqual(len(json_resp['trips']), 1)
+
+    def test_visibility(self):
+        """
+        Test that private trips are only shown to their owner
+        """
+        self.make_trip('Dan', title='Dans trip')
+        resp, json_resp = self.make_trip('Dan', title='Secret trip',
+                                         public=False)
+        tid = json_resp['trip']['id']
+        dan = self._api_headers(username='Dan')
+        bob = self._api_headers(username='Bob')
+
+        # the owner's view is cached first, and must not leak
+        resp = self.client.get('/trips/Dan', headers=dan)
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(len(json_resp['trips']), 2)
+        self.assertEqual(resp.headers['Vary'],
+                         'Authorization, Accept-Encoding')
+        for headers in (self._api_headers(), bob):
+            resp = self.client.get('/trips/Dan', headers=headers)
+            json_resp = json.loads(resp.data.decode('utf-8'))
+            self.assertEqual([t['title'] for t in json_resp['trips']],
+                             ['Dans trip'])
+        resp = self.client.get('/trips/', headers=dan)
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(len(json_resp['trips']), 1)
+
+        resp = self.client.get('/trips/Dan/'+str(tid), headers=dan)
+        self.assertEqual(resp.status_code, 200)
+        resp = self.client.get('/trips/Dan/'+str(tid), headers=bob)
+        self.assertEqual(resp.status_code, 404)
+
+        resp = self.client.get('/trips/Dan/export')
+        self.assertEqual(len(resp.data.splitlines()), 1)
+        resp = self.client.get('/trips/Dan/export', headers=dan)
+        self.assertEqual(len(resp.data.splitlines()), 2)
+
+        resp = self.client.get('/trips/_search', headers=bob,
+                               query_string=dict(q='trip', username='Dan'))
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(len(json_resp['trips']), 1)
+        resp = self.client.get('/trips/_search', headers=dan,
+                               query_string=dict(q='trip', username='Dan'))
+        json_resp = json.loads(resp.data.decode('utf-8'))
+        self.assertEqual(len(json_resp['trips']), 2)
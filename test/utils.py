@@ -1,24 +1,94 @@
 import jwt
 import json
 import unittest
+from sqlalchemy import event
 from trips import create_app, db
 
+# Whether this process has made the schema yet, see `create_schema`
+schema = {'created': False}
+
+
+def create_schema():
+    """
+    Makes the schema afresh, once per process, or per xdist worker as
+    each has its own database
+    """
+    if schema['created']:
+        return
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    schema['created'] = True
+
 
 class FlaskTestCase(unittest.TestCase):
-    """ Contains base logic for setting up a Flask app """
+    """
+    Contains base logic for setting up a Flask app
+
+    Each test runs in a transaction that is rolled back afterwards, with
+    the app's commits turned into savepoints, so the schema is only made
+    once. Tests whose data must be seen by other connections, such as
+    those of asyncpg or a migration, set `transactional` to False and
+    make the schema afresh after each test instead.
+    """
+
+    transactional = True
 
     def setUp(self):
         self.app = create_app('testing')
         self.app_context = self.app.app_context()
         self.app_context.push()
         self.client = self.app.test_client()
-        db.create_all()
+        create_schema()
+        if self.transactional:
+            self.begin()
 
     def tearDown(self):
-        db.session.remove()
-        db.drop_all()
+        if self.transactional:
+            self.rollback()
+        else:
+            db.session.remove()
+            db.drop_all()
+            db.create_all()
         self.app_context.pop()
 
+    def begin(self):
+        """
+        Joins the app's sessions into a transaction on one connection,
+        with a savepoint that is restarted whenever the app commits or
+        rolls back
+        """
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        # sequences are not rolled back, so ids start from 1 again here
+        self.connection.execute(
+            "SELECT setval(oid::regclass, 1, false) FROM pg_class "
+            "WHERE relkind = 'S'")
+        self.scoped_session = db.session
+        db.session = db.create_scoped_session(
+            options={'bind': self.connection, 'binds': {}})
+        self.session = db.session()
+        self.session.begin_nested()
+        # opens the savepoint now rather than on the test's first query
+        self.session.connection()
+        event.listen(self.session, 'after_transaction_end',
+                     self.restart_savepoint)
+
+    def restart_savepoint(self, session, transaction):
+        if transaction.nested and not transaction._parent.nested:
+            session.expire_all()
+            session.begin_nested()
+
+    def rollback(self):
+        event.remove(self.session, 'after_transaction_end',
+                     self.restart_savepoint)
+        # closing the session would leave its savepoint open
+        self.session.rollback()
+        db.session.remove()
+        db.session = self.scoped_session
+        self.transaction.rollback()
+        self.connection.close()
+
     def _api_headers(self, username=None):
         """
         Returns headers for a json request along with a JWT for authenticating
@@ -1,11 +1,18 @@
-import subprocess
 from datetime import datetime
-from flask import Flask, jsonify
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, Response, jsonify
 from flask_jwt import JWT, _default_jwt_payload_handler
 from config import config
+from .auth import init_auth
+from .cache import Cache
+from .compress import init_compression
+from .health import resolve_version, Readiness
+from .jobs import Jobs
+from .metrics import init_metrics
+from .pool import PooledSQLAlchemy, pool_status
 
-db = SQLAlchemy()
+db = PooledSQLAlchemy()
+cache = Cache()
+jobs = Jobs()
 
 
 def authenticate(username, password):
@@ -23,20 +30,50 @@ def create_app(config_name):
     config[config_name].init_app(app)
 
     db.init_app(app)
+    cache.init_app(app)
+    jobs.init_app(app)
     from .api import api
     api.init_app(app)
     jwt = JWT(app, authenticate, identity)
+    init_auth(app, jwt)
+    metrics = init_metrics(app, db)
+    # after metrics, so that compressing counts towards request times
+    init_compression(app)
 
     @app.errorhandler(404)
     def page_not_found(e):
         return jsonify({'message': 'not found'}), 404
 
+    version = resolve_version()
+    readiness = Readiness(app, db)
+
     @app.route('/status')
     def status():
-        return jsonify({
-            "version": (subprocess.check_output(
-                        ['git', 'rev-parse', '--short', 'HEAD'])
-                        .decode('utf-8').strip()),
-            "status": 200})
+        return jsonify({"version": version, "status": 200})
+
+    @app.route('/status/ready')
+    def ready():
+        ok, reason = readiness.check()
+        if not ok:
+            return jsonify({"message": reason, "status": 503}), 503
+        return jsonify({"version": version, "status": 200})
+
+    @app.route('/status/pool')
+    def pool():
+        status = pool_status(db.engine)
+        replicas = db.replica_engines()
+        if replicas:
+            status['replicas'] = {bind: pool_status(engine)
+                                  for bind, engine in replicas.items()}
+        return jsonify(status)
+
+    @app.route('/status/auth')
+    def auth():
+        return jsonify(app.extensions['token_cache'].stats())
+
+    @app.route('/metrics')
+    def prometheus():
+        return Response(metrics.render(),
+                        mimetype='text/plain; version=0.0.4')
 
     return app
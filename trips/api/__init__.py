@@ -1,4 +1,5 @@
 from flask_restplus import Api
+from ..serialize import json_response
 from .trip import api as trip_ns
 
 api = Api(
@@ -11,3 +12,12 @@ api = Api(
 )
 
 api.add_namespace(trip_ns)
+
+
+@api.representation('application/json')
+def timed_output_json(data, code, headers=None):
+    """
+    Encodes marshalled responses like the fast paths do, so that they are
+    timed and follow JSON_PRETTY_PRINT too
+    """
+    return json_response(data, code, headers)
@@ -1,12 +1,27 @@
-from flask import request, jsonify, session, abort
-from datetime import datetime
-from dateutil import parser
-from sqlalchemy import desc
+import hashlib
+from collections import OrderedDict
+from flask import (current_app, request, jsonify, session, abort,
+                   make_response, Response, stream_with_context, url_for)
+from werkzeug.http import http_date, quote_etag
 
-from flask_restplus import Api, Resource, Namespace, fields
+from flask_restplus import Api, Resource, Namespace, fields, inputs
 from flask_jwt import _jwt_required, JWTError, current_identity
-from .. import db
+from .. import db, cache, jobs
+from ..cache import trip_key, feed_key, sticky_key
+from ..bulk import trip_row, insert_trips, delete_trips
+from ..export import export_chunks
+from ..geo import geocode, near
+from ..jobs import job_json
+from ..search import search_page
+from ..stats import count_created, count_deleted, user_stats
+from ..timestamps import EPOCH, TimestampError, parse_timestamp
 from ..model import Trip
+from ..pool import replica_binds
+from ..serialize import (TRIP_COLUMNS, trip_dict, json_response,
+                         trip_fields, project)
+from ..pagination import (keyset_page, page_total, has_results,
+                          encode_cursor, decode_cursor, CursorError,
+                          TOTAL_MODES)
 
 
 api = Namespace('trips', description='Trip service', catch_all_404s=True)
@@ -26,7 +41,8 @@ trip_model = api.model('Trip', {
 
 paginated = api.model('PagedTrips', {
         'trips': fields.List(fields.Nested(trip_model), allow_null=True),
-        'total': fields.Integer(description='Number of results'),
+        'total': fields.Integer(description='Number of results, if counted'),
+        'next_cursor': fields.String(description='Cursor for the next page'),
         'message': fields.String(description='Response message')
     })
 
@@ -37,6 +53,61 @@ resp_model = api.model('TripResp', {
     })
 
 
+batch_item = api.model('BatchItem', {
+        'index': fields.Integer(description='Position in the request'),
+        'id': fields.Integer(description='Id of the trip'),
+        'status': fields.Integer(description='Status code for this item'),
+        'message': fields.String(description='Item message'),
+        'trip': fields.Nested(trip_model, allow_null=True)
+    })
+
+
+stats_model = api.model('UserStats', {
+        'username': fields.String(description='Whose trips were counted'),
+        'trips': fields.Integer(description='Number of trips'),
+        'completed': fields.Integer(description='Number of complete trips'),
+        'latest_trip_id': fields.Integer(description='Id of the newest trip'),
+        'latest_created_at': fields.DateTime(description='Time of creation '
+                                                         'of the newest trip')
+    })
+
+
+stats_resp = api.model('UserStatsResp', {
+        'stats': fields.Nested(stats_model),
+        'message': fields.String(description='Response message')
+    })
+
+
+job_model = api.model('Job', {
+        'id': fields.String(description='Id of the job'),
+        'kind': fields.String(description='What the job does'),
+        'status': fields.String(description='queued, running, done or '
+                                            'failed'),
+        'attempts': fields.Integer(description='Times the job was run'),
+        'error': fields.String(description='Why the last attempt failed'),
+        'created_at': fields.Float(description='When it was queued, in '
+                                               'seconds since the epoch'),
+        'updated_at': fields.Float(description='When it last changed')
+    })
+
+
+job_resp = api.model('JobResp', {
+        'job': fields.Nested(job_model),
+        'message': fields.String(description='Response message')
+    })
+
+
+batch_model = api.model('BatchResp', {
+        'results': fields.List(fields.Nested(batch_item)),
+        'count': fields.Integer(description='Number of trips changed'),
+        'message': fields.String(description='Response message')
+    })
+
+
+TRIP_FIELDS = ('title', 'complete', 'created_at', 'start', 'finish',
+               'public', 'description')
+
+
 def belongs_to(username):
     """
     Checks a username against the username in the JWT token
@@ -51,6 +122,248 @@ def belongs_to(username):
     return True
 
 
+def is_owner(username):
+    """
+    Checks whether the request carries a valid JWT for `username`,
+    without requiring one
+    """
+    try:
+        _jwt_required(None)
+    except JWTError:
+        return False
+    return current_identity.get('username') == username
+
+
+def visible(query, owner=False):
+    """
+    Hides private trips from anyone but their owner
+    """
+    if owner:
+        return query
+    return query.filter(Trip.public.is_(True))
+
+
+def read_replica(username=None):
+    """
+    Reads the rest of the request from a replica, unless `username`
+    changed their trips in the last REPLICA_STICKY_SECONDS
+    """
+    if username is not None and cache.get(sticky_key(username)):
+        return
+    db.session().use_replica()
+
+
+def wrote(username):
+    """
+    Keeps reads of a user's trips on the primary for a while after they
+    change, so that a lagging replica does not undo the change for them
+    or put stale trips back in the cache
+    """
+    seconds = current_app.config['REPLICA_STICKY_SECONDS']
+    if seconds > 0 and replica_binds(current_app):
+        cache.set(sticky_key(username), True, seconds)
+
+
+def total_param():
+    """
+    Reads the ?total mode, falling back to the configured default
+    """
+    mode = request.args.get('total',
+                            current_app.config['TRIPS_TOTAL_DEFAULT'],
+                            type=str)
+    if mode not in TOTAL_MODES:
+        abort(400, 'total must be one of: ' + ' '.join(TOTAL_MODES))
+    return mode
+
+
+def size_param():
+    """
+    Reads the ?size of a page, which must be between 1 and
+    TRIPS_PAGE_LIMIT
+    """
+    size = request.args.get('size', 10, type=int)
+    limit = current_app.config['TRIPS_PAGE_LIMIT']
+    if not 1 <= size <= limit:
+        abort(400, 'size must be between 1 and {}'.format(limit))
+    return size
+
+
+def fields_param():
+    """
+    Reads the ?fields of trips to send, as a comma separated list, or
+    None for all of them
+    """
+    value = request.args.get('fields', None, type=str)
+    if value is None:
+        return None
+    try:
+        return trip_fields(value)
+    except ValueError as e:
+        abort(400, str(e))
+
+
+def start_param():
+    """
+    Reads the ?start time, as ISO 8601 or epoch millis, that trips must
+    be created after
+    """
+    start = request.args.get('start', None, type=str)
+    if start is None:
+        return EPOCH
+    try:
+        return parse_timestamp(start)
+    except TimestampError:
+        abort(400, 'start must be an ISO 8601 time or epoch millis')
+
+
+def trip_errors(trip):
+    """
+    Validates a trip sent by a client and parses its created_at
+
+    Returns what is wrong with the trip, or None if it is fine.
+    """
+    if not isinstance(trip, dict):
+        return 'trip must be an object'
+    missing = [field for field in ['title'] if field not in trip]
+    if missing:
+        return 'missing fields: ' + ' '.join(missing)
+    unknown = sorted(set(trip) - set(TRIP_FIELDS))
+    if unknown:
+        return 'unknown fields: ' + ' '.join(unknown)
+    for field in ('complete', 'public'):
+        if field in trip and not isinstance(trip[field], bool):
+            return '{} must be true or false'.format(field)
+    for field in ('title', 'start', 'finish', 'description'):
+        value = trip.get(field)
+        if value is None and field != 'title':
+            continue
+        if not isinstance(value, str):
+            return '{} must be a string'.format(field)
+        # longer strings would fail the whole insert, not just this trip
+        length = Trip.__table__.c[field].type.length
+        if length is not None and len(value) > length:
+            return '{} must be at most {} characters'.format(field, length)
+    if trip.get('created_at') is not None:
+        try:
+            trip['created_at'] = parse_timestamp(trip['created_at'])
+        except TimestampError:
+            return 'created_at is not a valid time'
+    return None
+
+
+def delete_content(username, ids):
+    """
+    Queues the deletion of the blurbs, images, lines and points of
+    deleted trips from the services that hold them, in the transaction
+    that deletes the trips
+    """
+    return [jobs.enqueue('trip_deleted',
+                         {'username': username, 'trip_id': id},
+                         'trip_deleted:{}:{}'.format(username, id))
+            for id in ids]
+
+
+def batch_param(key):
+    """
+    Reads the list under `key` from the body of a batch request
+    """
+    body = request.json
+    items = body.get(key) if isinstance(body, dict) else None
+    if not isinstance(items, list):
+        abort(400, '{} must be a list'.format(key))
+    limit = current_app.config['TRIPS_BATCH_LIMIT']
+    if len(items) > limit:
+        abort(400, 'at most {} {} per batch'.format(limit, key))
+    return items
+
+
+def first_page(username, query, size, owner=False):
+    """
+    Serves the first page of a user's feed from the cache
+
+    On a miss the newest CACHE_FEED_SIZE trips are cached along with their
+    cursors, so that any smaller page size can be sliced from them.
+    """
+    key = feed_key(username, owner, cache.generation(username))
+    feed = cache.get(key)
+    if feed is None:
+        trips, next_cursor = keyset_page(
+            query, None, current_app.config['CACHE_FEED_SIZE'])
+        feed = {'trips': [trip_dict(t) for t in trips],
+                'cursors': [encode_cursor(t.created_at, t.id)
+                            for t in trips],
+                'more': next_cursor is not None}
+        cache.set(key, feed)
+
+    trips = feed['trips'][:size]
+    cursors = feed['cursors'][:size]
+    next_cursor = None
+    if len(feed['trips']) > size or (trips and feed['more']):
+        next_cursor = cursors[-1]
+    return trips, cursors, next_cursor
+
+
+def validators(cursors, *extra):
+    """
+    Builds the ETag and Last-Modified headers for a response of trips
+
+    Trips are never edited in place, so the cursors of the trips in a
+    response identify its body without having to serialize it.
+    """
+    parts = list(cursors) + [str(part) for part in extra]
+    digest = hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+    # owners and everyone else see different trips at the same url
+    headers = {'ETag': quote_etag(digest, weak=True),
+               'Vary': 'Authorization'}
+    if cursors:
+        newest, _ = decode_cursor(cursors[0])
+        headers['Last-Modified'] = http_date(newest)
+    return headers
+
+
+def not_modified(headers):
+    """
+    Checks the client's If-None-Match against a response's ETag
+    """
+    return request.if_none_match.contains_raw(headers['ETag'])
+
+
+def paged_response(trips, total, next_cursor, message, headers, keys=None):
+    """
+    Encodes a page of trip dicts as the paginated model would, with only
+    the `keys` of each trip if given
+    """
+    if keys is not None:
+        trips = [project(trip, keys) for trip in trips]
+    return json_response(OrderedDict([('trips', trips),
+                                      ('total', total),
+                                      ('next_cursor', next_cursor),
+                                      ('message', message)]),
+                         200, headers)
+
+
+def trips_query():
+    """
+    A query for only the columns of trips that responses carry, as
+    tuples rather than hydrated Trip objects
+    """
+    return db.session.query(*TRIP_COLUMNS)
+
+
+def export_response(username=None):
+    """
+    Streams trips as newline delimited JSON, gzipped if ?gzip=1
+    """
+    compress = request.args.get('gzip', 0, type=int) == 1
+    owner = username is not None and is_owner(username)
+    chunks = export_chunks(username, compress, owner)
+    resp = Response(stream_with_context(chunks),
+                    mimetype='application/x-ndjson')
+    if compress:
+        resp.headers['Content-Encoding'] = 'gzip'
+    return resp
+
+
 @api.route('/status')
 class Status(Resource):
     def get(self, **kwargs):
@@ -59,54 +372,197 @@ class Status(Resource):
 
 @api.route('/')
 class Trips(Resource):
-    @api.marshal_with(paginated)
-    @api.doc(responses={200: 'found trips'},
-             params={'start': 'Return only trips starting after this time',
-                     'size': 'Number of trips to retrieve'})
+    @api.response(200, 'found trips', paginated)
+    @api.doc(responses={304: 'not modified',
+                        400: 'invalid start, cursor, size, fields or '
+                             'total mode'},
+             params={'start': 'Return only trips created after this ISO '
+                              '8601 time or epoch millis',
+                     'size': 'Number of trips to retrieve',
+                     'fields': 'Comma separated fields of trips to send',
+                     'cursor': 'The next_cursor of the previous page',
+                     'total': 'How to count results: exact, estimate or none'})
     def get(self, **kwargs):
         """
-        List all trips
+        List all public trips
         """
-        epoch = datetime.fromtimestamp(0).isoformat()
-        start = request.args.get('start', epoch, type=str)
-        start_dt = parser.parse(start)
-        size = request.args.get('size', 10, type=int)
+        read_replica()
+        start_dt = start_param()
+        size = size_param()
+        keys = fields_param()
+        cursor = request.args.get('cursor', None, type=str)
+        total_mode = total_param()
+
+        q = visible(trips_query()).filter(Trip.created_at > start_dt)
+        try:
+            trips, next_cursor = keyset_page(q, cursor, size)
+        except CursorError as e:
+            abort(400, str(e))
+        total = page_total(q, total_mode)
 
-        q = (Trip.query.order_by(desc(Trip.created_at))
-                       .filter(Trip.created_at > start_dt))
-        trips = q.limit(size)
-        total = q.count()
-        q = Trip.query.order_by(desc(Trip.created_at))
+        cursors = [encode_cursor(t.created_at, t.id) for t in trips]
+        headers = validators(cursors, total, next_cursor, keys)
+        if not_modified(headers):
+            return make_response('', 304, headers)
 
-        return {'trips': [t.to_json() for t in trips], 'total': total}, 200
+        return paged_response([trip_dict(t) for t in trips],
+                              total, next_cursor, None, headers, keys)
+
+
+# Routes that are not a user's start with an underscore, so that they
+# cannot be taken for a username
+@api.route('/_export')
+class TripsExport(Resource):
+    @api.doc(responses={200: 'streamed trips'},
+             params={'gzip': 'Set to 1 to gzip the stream'})
+    def get(self):
+        """
+        Export all public trips as newline delimited JSON
+        """
+        read_replica()
+        return export_response()
+
+
+@api.route('/_search')
+class TripsSearch(Resource):
+    @api.response(200, 'found trips', paginated)
+    @api.doc(responses={400: 'missing query or invalid parameters'},
+             params={'q': 'Words to search titles, descriptions and places',
+                     'username': 'Only search this user\'s trips, and '
+                                 'their private ones if they are the user',
+                     'public': 'Only search public (true) or private trips',
+                     'size': 'Number of trips to retrieve',
+                     'fields': 'Comma separated fields of trips to send',
+                     'cursor': 'The next_cursor of the previous page'})
+    def get(self):
+        """
+        Search trips, best matches first
+        """
+        terms = request.args.get('q', '', type=str).strip()
+        if not terms:
+            abort(400, 'q is required')
+        username = request.args.get('username', None, type=str)
+        read_replica(username)
+        public = request.args.get('public', None, type=str)
+        size = size_param()
+        keys = fields_param()
+        cursor = request.args.get('cursor', None, type=str)
+
+        q = trips_query()
+        if username is not None:
+            q = q.filter(Trip.username == username)
+        q = visible(q, username is not None and is_owner(username))
+        if public is not None:
+            try:
+                q = q.filter(Trip.public.is_(inputs.boolean(public)))
+            except ValueError:
+                abort(400, 'public must be true or false')
+        try:
+            rows, next_cursor = search_page(q, terms, cursor, size)
+        except CursorError as e:
+            abort(400, str(e))
+
+        return paged_response([trip_dict(row) for row in rows], None,
+                              next_cursor, 'found {} trips'.format(len(rows)),
+                              {'Vary': 'Authorization'}, keys)
+
+
+@api.route('/_near')
+class TripsNear(Resource):
+    @api.response(200, 'found trips', paginated)
+    @api.doc(responses={400: 'invalid point, radius or cursor'},
+             params={'lat': 'Latitude of the point, in degrees',
+                     'lon': 'Longitude of the point, in degrees',
+                     'radius': 'Distance from the point in km',
+                     'size': 'Number of trips to retrieve',
+                     'fields': 'Comma separated fields of trips to send',
+                     'cursor': 'The next_cursor of the previous page'})
+    def get(self):
+        """
+        List public trips starting or finishing near a point, newest
+        first
+
+        Only trips whose places were geocoded when they were created can
+        be found.
+        """
+        lat = request.args.get('lat', None, type=float)
+        lon = request.args.get('lon', None, type=float)
+        radius = request.args.get('radius', 10, type=float)
+        if lat is None or not -90 <= lat <= 90:
+            abort(400, 'lat must be between -90 and 90')
+        if lon is None or not -180 <= lon <= 180:
+            abort(400, 'lon must be between -180 and 180')
+        limit = current_app.config['NEAR_MAX_RADIUS_KM']
+        if radius is None or not 0 < radius <= limit:
+            abort(400, 'radius must be more than 0 and at most {} km'
+                       .format(limit))
+        read_replica()
+        size = size_param()
+        keys = fields_param()
+        cursor = request.args.get('cursor', None, type=str)
+
+        q = near(visible(trips_query()), lat, lon, radius)
+        try:
+            trips, next_cursor = keyset_page(q, cursor, size)
+        except CursorError as e:
+            abort(400, str(e))
+
+        return paged_response([trip_dict(t) for t in trips], None,
+                              next_cursor,
+                              'found {} trips'.format(len(trips)), {}, keys)
 
 
 @api.route('/<string:username>')
 class UserTrips(Resource):
-    @api.marshal_with(paginated)
-    @api.doc(responses={200: 'found trips'},
-             params={'start': 'Return only trips starting after this time',
-                     'size': 'Number of trips to retrieve'})
+    @api.response(200, 'found trips', paginated)
+    @api.doc(responses={304: 'not modified',
+                        400: 'invalid start, cursor, size, fields or '
+                             'total mode'},
+             params={'start': 'Return only trips created after this ISO '
+                              '8601 time or epoch millis',
+                     'size': 'Number of trips to retrieve',
+                     'fields': 'Comma separated fields of trips to send',
+                     'cursor': 'The next_cursor of the previous page',
+                     'total': 'How to count results: exact, estimate or none'})
     def get(self, username):
         """
-        List trips for a user
+        List trips for a user, including private ones for the user
         """
-        epoch = datetime.fromtimestamp(0).isoformat()
-        start = request.args.get('start', epoch, type=str)
-        start_dt = parser.parse(start)
-        size = request.args.get('size', 10, type=int)
+        read_replica(username)
+        start_dt = start_param()
+        size = size_param()
+        keys = fields_param()
+        cursor = request.args.get('cursor', None, type=str)
+        total_mode = total_param()
+        owner = is_owner(username)
 
-        q = (Trip.query.filter_by(username=username)
-                       .order_by(desc(Trip.created_at))
-                       .filter(Trip.created_at > start_dt))
-        trips = q.limit(size)
-        total = q.count()
-        if total == 0:
-            abort(404, 'user does not exist or has no trips')
+        q = visible(trips_query(), owner)
+        q = (q.filter(Trip.username == username)
+              .filter(Trip.created_at > start_dt))
+        if (cursor is None and 'start' not in request.args and
+                size <= current_app.config['CACHE_FEED_SIZE']):
+            trips, cursors, next_cursor = first_page(username, q, size,
+                                                     owner)
+            if not trips:
+                abort(404, 'user does not exist or has no trips')
+        else:
+            try:
+                trips, next_cursor = keyset_page(q, cursor, size)
+            except CursorError as e:
+                abort(400, str(e))
+            if not trips and not has_results(q):
+                abort(404, 'user does not exist or has no trips')
+            cursors = [encode_cursor(t.created_at, t.id) for t in trips]
+            trips = [trip_dict(t) for t in trips]
+        total = page_total(q, total_mode)
+
+        headers = validators(cursors, total, next_cursor, keys)
+        if not_modified(headers):
+            return make_response('', 304, headers)
 
-        return {'trips': [t.to_json() for t in trips],
-                'total': total,
-                'message': 'found trips for {}'.format(username)}, 200
+        return paged_response(trips, total, next_cursor,
+                              'found trips for {}'.format(username), headers,
+                              keys)
 
     @api.marshal_with(resp_model)
     @api.doc(responses={201: 'created trip'})
@@ -118,17 +574,19 @@ class UserTrips(Resource):
         if allowed is not True:
             return allowed
         trip = request.json
-        missing = []
-        for field in ['title']:
-            if field not in trip:
-                missing.append(field)
-        if missing:
-            return {'trip': {},
-                    'message': 'missing fields: '+' '.join(missing)}, 400
+        error = trip_errors(trip)
+        if error is not None:
+            return {'trip': {}, 'message': error}, 400
 
+        trip.update(geocode(trip.get('start'), trip.get('finish')))
         trip = Trip(username=username, **trip)
         db.session.add(trip)
+        db.session.flush()
+        count_created(username, [(trip.id, trip.created_at, trip.public,
+                                   trip.complete)])
         db.session.commit()
+        cache.invalidate(username)
+        wrote(username)
         return {'trip': trip,
                 'message': 'created trip'}, 201
 
@@ -136,35 +594,209 @@ class UserTrips(Resource):
 @api.route('/<string:username>/<int:trip_id>')
 class UserTrip(Resource):
     @api.marshal_with(resp_model)
-    @api.doc(responses={200: 'found trip'})
+    @api.doc(responses={200: 'found trip', 304: 'not modified'})
     def get(self, username, trip_id):
         """
         Get a specific trip
         """
-        trip = (Trip.query.filter_by(username=username)
-                          .filter_by(id=trip_id)
-                          .first())
-        if trip is None:
+        read_replica(username)
+        key = trip_key(username, trip_id, cache.generation(username))
+        cached = cache.get(key)
+        if cached is None:
+            trip = (Trip.query.filter_by(username=username)
+                              .filter_by(id=trip_id)
+                              .first())
+            if trip is None:
+                abort(404, 'no trip with this id for this user')
+            cached = {'trip': trip.to_json(),
+                      'cursor': encode_cursor(trip.created_at, trip.id)}
+            cache.set(key, cached)
+        if cached['trip']['public'] is not True and not is_owner(username):
             abort(404, 'no trip with this id for this user')
 
-        return {'trip': trip,
-                'message': 'found trip'}, 200
+        headers = validators([cached['cursor']])
+        if not_modified(headers):
+            return {}, 304, headers
 
+        return {'trip': cached['trip'],
+                'message': 'found trip'}, 200, headers
+
+    @api.marshal_with(job_resp, code=202)
     @api.doc(responses={403: 'not allowed',
                         404: 'not found',
-                        200: 'post deleted'})
+                        202: 'trip deleted, its content is being deleted'})
     def delete(self, username, trip_id):
         """
         Delete a trip
 
-        TODO: Delete all blurbs/images/lines/points
+        The trip is gone once this returns. Its blurbs, images, lines and
+        points are deleted by a background job, which the Location
+        header points to.
         """
         # check the trip belongs to the authenticated user
         allowed = belongs_to(username)
         if allowed is not True:
             return allowed
-        trip = Trip.query.get(trip_id)
-        if trip is None:
+        deleted = delete_trips(username, [trip_id])
+        if not deleted:
             abort(404, 'not found')
-        db.session.delete(trip)
+        count_deleted(username, deleted.values())
+        queued = delete_content(username, [trip_id])
         db.session.commit()
+        cache.invalidate(username)
+        wrote(username)
+        job, = jobs.committed(queued)
+        location = url_for('trips_trip_job', job_id=job.id)
+        return ({'job': job_json(job), 'message': 'deleted trip'}, 202,
+                {'Location': location})
+
+
+@api.route('/<string:username>/export')
+class UserTripsExport(Resource):
+    @api.doc(responses={200: 'streamed trips'},
+             params={'gzip': 'Set to 1 to gzip the stream'})
+    def get(self, username):
+        """
+        Export a user's trips as newline delimited JSON, including
+        private ones for the user
+        """
+        read_replica(username)
+        return export_response(username)
+
+
+@api.route('/<string:username>/stats')
+class UserTripsStats(Resource):
+    @api.marshal_with(stats_resp)
+    @api.doc(responses={200: 'found stats',
+                        404: 'user does not exist or has no trips'})
+    def get(self, username):
+        """
+        Count a user's trips and complete trips and find their newest,
+        including private ones for the user
+        """
+        read_replica(username)
+        stats = user_stats(username)
+        prefix = '' if is_owner(username) else 'public_'
+        if stats is None or not getattr(stats, prefix + 'trips'):
+            abort(404, 'user does not exist or has no trips')
+        view = {'username': username,
+                'trips': getattr(stats, prefix + 'trips'),
+                'completed': getattr(stats, prefix + 'completed'),
+                'latest_trip_id': getattr(stats, prefix + 'latest_id'),
+                'latest_created_at': getattr(stats,
+                                             prefix + 'latest_created_at')}
+        # owners and everyone else see different counts at the same url
+        return ({'stats': view,
+                 'message': 'found stats for {}'.format(username)}, 200,
+                {'Vary': 'Authorization'})
+
+
+@api.route('/<string:username>/batch')
+class UserTripsBatch(Resource):
+    @api.marshal_with(batch_model)
+    @api.doc(responses={200: 'created valid trips',
+                        400: 'invalid batch',
+                        403: 'not allowed'})
+    def post(self, username):
+        """
+        Create many trips in one transaction
+
+        Takes {"trips": [...]} and reports the outcome of each trip in the
+        order given. Invalid trips are skipped, the rest are inserted.
+        """
+        allowed = belongs_to(username)
+        if allowed is not True:
+            return allowed
+        items = batch_param('trips')
+
+        results = []
+        rows = []
+        for index, trip in enumerate(items):
+            error = trip_errors(trip)
+            if error is not None:
+                results.append({'index': index,
+                                'status': 400,
+                                'message': error})
+                continue
+            row = trip_row(username, trip)
+            row.update(geocode(row['start'], row['finish']))
+            rows.append(row)
+            results.append({'index': index,
+                            'status': 201,
+                            'message': 'created trip',
+                            'trip': row})
+
+        keys = insert_trips(rows)
+        count_created(username, keys)
+        db.session.commit()
+        if rows:
+            cache.invalidate(username)
+            wrote(username)
+        for row, key in zip(rows, keys):
+            row.update(id=key[0], created_at=key[1])
+        for result in results:
+            if result['status'] == 201:
+                result['id'] = result['trip']['id']
+
+        return {'results': results,
+                'count': len(rows),
+                'message': 'created {} trips'.format(len(rows))}, 200
+
+    @api.marshal_with(batch_model)
+    @api.doc(responses={200: 'deleted found trips',
+                        400: 'invalid batch',
+                        403: 'not allowed'})
+    def delete(self, username):
+        """
+        Delete many trips in one transaction
+
+        Takes {"ids": [...]} and reports whether each trip was deleted.
+        The content of deleted trips is deleted by background jobs.
+        """
+        allowed = belongs_to(username)
+        if allowed is not True:
+            return allowed
+        ids = batch_param('ids')
+        # bool is a subclass of int, but true is not a trip id
+        if not all(type(id) is int for id in ids):
+            abort(400, 'ids must be integers')
+
+        deleted = delete_trips(username, ids) if ids else {}
+        count_deleted(username, deleted.values())
+        queued = delete_content(username, sorted(deleted))
+        db.session.commit()
+        if deleted:
+            cache.invalidate(username)
+            wrote(username)
+            jobs.committed(queued)
+
+        results = []
+        for index, id in enumerate(ids):
+            if id in deleted:
+                results.append({'index': index, 'id': id,
+                                'status': 200, 'message': 'deleted trip'})
+            else:
+                results.append({'index': index, 'id': id,
+                                'status': 404, 'message': 'not found'})
+        return {'results': results,
+                'count': len(deleted),
+                'message': 'deleted {} trips'.format(len(deleted))}, 200
+
+
+@api.route('/_jobs/<string:job_id>')
+class TripJob(Resource):
+    @api.marshal_with(job_resp)
+    @api.doc(responses={200: 'found job', 403: 'not allowed',
+                        404: 'not found'})
+    def get(self, job_id):
+        """
+        Get the status of a background job, such as the deletion of a
+        trip's content
+        """
+        job = jobs.get(job_id)
+        if job is None:
+            abort(404, 'not found')
+        allowed = belongs_to(job.payload['username'])
+        if allowed is not True:
+            return allowed
+        return {'job': job_json(job), 'message': 'found job'}, 200
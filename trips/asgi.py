@@ -0,0 +1,267 @@
+import os
+import json
+import asyncio
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from config import config
+from .auth import decode_token
+from .pagination import (encode_cursor, decode_cursor, CursorError,
+                         TOTAL_MODES)
+from .serialize import (TRIP_KEYS, trip_dict, dumps_line, trip_fields,
+                        project)
+from .timestamps import EPOCH, TimestampError, parse_timestamp
+
+COLUMNS = ', '.join(TRIP_KEYS)
+
+
+class BadRequest(ValueError):
+    """ Raised for query parameters that cannot be served """
+
+
+def asyncpg_dsn(uri):
+    """
+    Turns an SQLAlchemy database uri into one asyncpg understands
+    """
+    return 'postgresql://' + uri.split('://', 1)[1]
+
+
+class TripsApp(object):
+    """
+    An ASGI app serving the read-only /trips routes from a shared asyncpg
+    pool, for deployments with many concurrent, mostly idle feed requests
+
+    Responses have the same schemas as the trip_model and paginated models
+    of the Flask api. Writes and all other routes are served by the Flask
+    app, so the two are meant to run side by side behind one proxy.
+    """
+
+    def __init__(self, config_name):
+        self.config_name = config_name
+        self.config = config[config_name]
+        self.pool = None
+        self.flask_app = None
+        self._connecting = None
+
+    async def startup(self):
+        import asyncpg
+        from . import create_app
+        # tokens are verified with the Flask app's settings and caches
+        self.flask_app = create_app(self.config_name)
+        self.pool = await asyncpg.create_pool(
+            asyncpg_dsn(self.config.SQLALCHEMY_DATABASE_URI),
+            min_size=self.config.ASYNC_POOL_MIN_SIZE,
+            max_size=self.config.ASYNC_POOL_MAX_SIZE,
+            # PgBouncer's transaction pooling cannot keep prepared statements
+            statement_cache_size=(0 if self.config.SQLALCHEMY_PGBOUNCER
+                                  else 100))
+
+    async def connect(self):
+        """
+        Opens the pool once, for servers that do not send lifespan events
+        """
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self.startup())
+        await self._connecting
+
+    async def shutdown(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+            self._connecting = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        await self.connect()
+        code, body = await self.dispatch(scope)
+        await send({'type': 'http.response.start',
+                    'status': code,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body',
+                    'body': dumps_line(body)})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.connect()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def viewer(self, scope):
+        """
+        The username of a valid JWT sent with the request, or None
+
+        Tokens are verified on the default executor, as RS256 signatures
+        take a while to check and fetching a JWKS blocks.
+        """
+        headers = dict(scope.get('headers', []))
+        parts = headers.get(b'authorization', b'').decode('latin-1').split()
+        prefix = self.flask_app.config['JWT_AUTH_HEADER_PREFIX']
+        if len(parts) != 2 or parts[0].lower() != prefix.lower():
+            return None
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.token_username,
+                                          parts[1])
+
+    def token_username(self, token):
+        """
+        Verifies a token with the Flask app's settings and caches
+        """
+        import jwt
+        with self.flask_app.app_context():
+            try:
+                payload = decode_token(token)
+            except jwt.InvalidTokenError:
+                return None
+        identity = payload.get('identity')
+        if not isinstance(identity, dict):
+            return None
+        return identity.get('username')
+
+    async def dispatch(self, scope):
+        """
+        Routes a request, returning the status code and body
+        """
+        if scope['method'] not in ('GET', 'HEAD'):
+            return 405, {'message': 'method not allowed'}
+        parts = scope['path'].strip('/').split('/')
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        args = {key: values[0] for key, values in query.items()}
+
+        try:
+            if parts == ['status']:
+                return 200, {'status': 200}
+            if parts[0] != 'trips':
+                return 404, {'message': 'not found'}
+            if len(parts) == 1:
+                return await self.list_trips(args)
+            if len(parts) == 2 and parts[1] == 'status':
+                return 200, {'version': '1.0'}
+            if len(parts) == 2:
+                owner = await self.viewer(scope) == parts[1]
+                return await self.list_trips(args, parts[1], owner)
+            if len(parts) == 3 and parts[2].isdigit():
+                owner = await self.viewer(scope) == parts[1]
+                return await self.get_trip(parts[1], int(parts[2]), owner)
+        except (BadRequest, CursorError) as e:
+            return 400, {'message': str(e)}
+        return 404, {'message': 'not found'}
+
+    async def list_trips(self, args, username=None, owner=False):
+        """
+        A page of all trips, or of a user's trips, as UserTrips.get and
+        Trips.get serve it
+        """
+        start_dt = EPOCH
+        if 'start' in args:
+            try:
+                start_dt = parse_timestamp(args['start'])
+            except TimestampError:
+                raise BadRequest('start must be an ISO 8601 time or epoch '
+                                 'millis')
+        try:
+            size = int(args.get('size', 10))
+        except ValueError:
+            raise BadRequest('invalid size')
+        limit = self.config.TRIPS_PAGE_LIMIT
+        if not 1 <= size <= limit:
+            raise BadRequest('size must be between 1 and {}'.format(limit))
+        keys = None
+        if 'fields' in args:
+            try:
+                keys = trip_fields(args['fields'])
+            except ValueError as e:
+                raise BadRequest(str(e))
+        total_mode = args.get('total', self.config.TRIPS_TOTAL_DEFAULT)
+        if total_mode not in TOTAL_MODES:
+            raise BadRequest('total must be one of: ' + ' '.join(TOTAL_MODES))
+
+        where = ['created_at > $1']
+        params = [start_dt]
+        if username is not None:
+            params.append(username)
+            where.append('username = ${}'.format(len(params)))
+        if not owner:
+            where.append('public IS true')
+        filters = ' AND '.join(where)
+        filter_params = list(params)
+
+        if 'cursor' in args:
+            created_at, id = decode_cursor(args['cursor'])
+            params.extend([created_at, id])
+            where.append('(created_at, id) < (${}, ${})'.format(
+                len(params) - 1, len(params)))
+        params.append(size + 1)
+        sql = ('SELECT {} FROM trips WHERE {} '
+               'ORDER BY created_at DESC, id DESC LIMIT ${}'
+               .format(COLUMNS, ' AND '.join(where), len(params)))
+
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(sql, *params)
+            if username is not None and not rows:
+                exists = await conn.fetchval(
+                    'SELECT EXISTS (SELECT 1 FROM trips WHERE {})'
+                    .format(filters), *filter_params)
+                if not exists:
+                    return 404, {'message':
+                                 'user does not exist or has no trips'}
+            total = await self.total(conn, total_mode, filters, filter_params)
+
+        next_cursor = None
+        if len(rows) > size:
+            rows = rows[:size]
+            next_cursor = encode_cursor(rows[-1]['created_at'],
+                                        rows[-1]['id'])
+        message = None
+        if username is not None:
+            message = 'found trips for {}'.format(username)
+        trips = [trip_dict(r) for r in rows]
+        if keys is not None:
+            trips = [project(trip, keys) for trip in trips]
+        return 200, OrderedDict([('trips', trips),
+                                 ('total', total),
+                                 ('next_cursor', next_cursor),
+                                 ('message', message)])
+
+    async def total(self, conn, mode, filters, params):
+        """
+        Counts the trips matching `filters` as pagination.page_total does
+        """
+        if mode == 'exact':
+            return await conn.fetchval(
+                'SELECT count(*) FROM trips WHERE ' + filters, *params)
+        if mode == 'estimate':
+            plan = await conn.fetchval(
+                'EXPLAIN (FORMAT JSON) SELECT 1 FROM trips WHERE ' + filters,
+                *params)
+            return int(json.loads(plan)[0]['Plan']['Plan Rows'])
+        return None
+
+    async def get_trip(self, username, trip_id, owner=False):
+        """
+        A single trip, as UserTrip.get serves it
+        """
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                'SELECT {} FROM trips WHERE username = $1 AND id = $2'
+                .format(COLUMNS), username, trip_id)
+        if row is None or (row['public'] is not True and not owner):
+            return 404, {'message': 'no trip with this id for this user'}
+        return 200, OrderedDict([('trip', trip_dict(row)),
+                                 ('message', 'found trip')])
+
+
+def create_asgi_app(config_name):
+    return TripsApp(config_name)
+
+
+app = create_asgi_app(os.getenv('FLASK_CONFIG') or 'default')
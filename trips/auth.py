@@ -0,0 +1,159 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.request import urlopen
+
+import jwt
+from flask import current_app
+
+
+class TokenCache(object):
+    """
+    A bounded least recently used cache of verified JWT payloads, keyed
+    by a digest of the token and dropped once the token expires
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                exp, payload = entry
+                if exp > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, payload, exp):
+        with self._lock:
+            self._entries[key] = (exp, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else None}
+
+
+class KeySet(object):
+    """
+    Public keys that tokens signed with RS256 are verified against, from
+    a PEM or a JWKS url that is fetched again every `ttl` seconds
+    """
+
+    def __init__(self, pem=None, jwks_url=None, ttl=3600):
+        self.pem = pem
+        self.jwks_url = jwks_url
+        self.ttl = ttl
+        self._keys = {}
+        self._fetched_at = 0
+        self._lock = threading.Lock()
+
+    def get(self, kid):
+        if self.pem is not None:
+            return self.pem
+        if self.jwks_url is None:
+            return None
+        with self._lock:
+            age = time.time() - self._fetched_at
+            # a key we do not know yet may have just been rotated in
+            if age > self.ttl or (kid not in self._keys and age > 60):
+                try:
+                    self._keys = self.fetch()
+                    self._fetched_at = time.time()
+                except (IOError, ValueError, KeyError) as e:
+                    # keep the keys we have and try again in a minute
+                    current_app.logger.warning('fetching JWKS failed: %s', e)
+                    self._fetched_at = time.time() - self.ttl + 60
+            return self._keys.get(kid)
+
+    def fetch(self):
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives.asymmetric.rsa import (
+            RSAPublicNumbers)
+
+        with urlopen(self.jwks_url, timeout=5) as resp:
+            jwks = json.loads(resp.read().decode('utf-8'))
+        keys = {}
+        for jwk in jwks.get('keys', []):
+            if jwk.get('kty') != 'RSA':
+                continue
+            numbers = RSAPublicNumbers(b64_int(jwk['e']), b64_int(jwk['n']))
+            keys[jwk.get('kid')] = numbers.public_key(default_backend())
+        return keys
+
+
+def b64_int(value):
+    """
+    Decodes a base64url encoded big-endian integer from a JWK
+    """
+    raw = jwt.utils.base64url_decode(value.encode('ascii'))
+    return int.from_bytes(raw, 'big')
+
+
+def init_auth(app, jwt_ext):
+    """
+    Makes flask_jwt verify tokens through the token cache
+    """
+    app.extensions['token_cache'] = TokenCache(
+        app.config['JWT_TOKEN_CACHE_SIZE'])
+    app.extensions['jwt_keys'] = KeySet(app.config['JWT_PUBLIC_KEY'],
+                                        app.config['JWT_JWKS_URL'],
+                                        app.config['JWT_JWKS_CACHE_SECONDS'])
+    jwt_ext.jwt_decode_handler(decode_token)
+
+
+def decode_token(token):
+    """
+    Verifies a JWT, or returns the payload of the same token verified
+    before if it has not expired yet
+    """
+    if not isinstance(token, bytes):
+        token = token.encode('utf-8')
+    cache = current_app.extensions['token_cache']
+    key = hashlib.sha256(token).digest()
+    payload = cache.get(key)
+    if payload is None:
+        payload = verify_token(token)
+        if 'exp' in payload:
+            cache.set(key, payload, payload['exp'])
+    return payload
+
+
+def verify_token(token):
+    """
+    Checks a token's signature and claims as flask_jwt does, with the
+    public key set when the algorithm is asymmetric
+    """
+    config = current_app.config
+    algorithm = config['JWT_ALGORITHM']
+    options = {'verify_' + claim: True
+               for claim in config['JWT_VERIFY_CLAIMS']}
+    options.update({'require_' + claim: True
+                    for claim in config['JWT_REQUIRED_CLAIMS']})
+
+    if algorithm.startswith('HS'):
+        key = config['JWT_SECRET_KEY']
+    else:
+        kid = jwt.get_unverified_header(token).get('kid')
+        key = current_app.extensions['jwt_keys'].get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError('Unknown signing key')
+    return jwt.decode(token, key, options=options, algorithms=[algorithm],
+                      leeway=config['JWT_LEEWAY'])
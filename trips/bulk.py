@@ -0,0 +1,59 @@
+from datetime import datetime
+from . import db
+from .model import Trip
+
+# Rows per INSERT statement, keeps statements well under the
+# parameter limit of the postgres protocol
+CHUNK_SIZE = 500
+
+
+def trip_row(username, trip):
+    """
+    Fills in the column defaults of a trip, as multi-row inserts need
+    every row to have the same columns
+    """
+    row = {'title': None,
+           'complete': False,
+           'created_at': datetime.utcnow(),
+           'start': None,
+           'finish': None,
+           'public': True,
+           'description': None}
+    row.update(trip)
+    row['username'] = username
+    return row
+
+
+def insert_trips(rows):
+    """
+    Inserts rows made by `trip_row` with multi-row INSERTs in the
+    current transaction
+
+    Returns the (id, created_at, public, complete) of each trip in the
+    order given.
+    """
+    table = Trip.__table__
+    keys = []
+    for i in range(0, len(rows), CHUNK_SIZE):
+        stmt = (table.insert().values(rows[i:i + CHUNK_SIZE])
+                     .returning(table.c.id, table.c.created_at,
+                                table.c.public, table.c.complete))
+        # ids are drawn from the sequence in the order of the VALUES list
+        keys.extend(sorted(db.session.execute(stmt).fetchall()))
+    return [tuple(key) for key in keys]
+
+
+def delete_trips(username, ids):
+    """
+    Deletes a user's trips by id in the current transaction
+
+    Returns the trips that existed and were deleted by id, as
+    (id, created_at, public, complete).
+    """
+    table = Trip.__table__
+    stmt = (table.delete()
+                 .where(table.c.username == username)
+                 .where(table.c.id.in_(ids))
+                 .returning(table.c.id, table.c.created_at,
+                            table.c.public, table.c.complete))
+    return dict((row[0], tuple(row)) for row in db.session.execute(stmt))
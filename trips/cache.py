@@ -0,0 +1,192 @@
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from flask import current_app
+
+
+class NullBackend(object):
+    """ Caches nothing, for turning the cache off """
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryBackend(object):
+    """
+    An in-process cache with per-entry expiry and least recently used
+    eviction once `threshold` entries are stored
+
+    Each process has its own copy, so writes handled by one worker do
+    not invalidate the others. ./manage.py serve refuses to run it with
+    more than one worker, use redis then.
+    """
+
+    def __init__(self, threshold=10000, default_timeout=60):
+        self.threshold = threshold
+        self.default_timeout = default_timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        with self._lock:
+            self._entries[key] = (time.time() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.threshold:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend(object):
+    """
+    Stores JSON encoded values in redis, or anything that speaks its
+    protocol, so that all workers share one cache
+    """
+
+    def __init__(self, url, default_timeout=60, key_prefix='trips:'):
+        import redis
+        self.client = redis.StrictRedis.from_url(url)
+        self.default_timeout = default_timeout
+        self.key_prefix = key_prefix
+
+    def get(self, key):
+        value = self.client.get(self.key_prefix + key)
+        if value is None:
+            return None
+        return json.loads(value.decode('utf-8'),
+                          object_pairs_hook=OrderedDict)
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        self.client.setex(self.key_prefix + key, int(timeout),
+                          json.dumps(value))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.key_prefix + key for key in keys])
+
+    def clear(self):
+        keys = self.client.keys(self.key_prefix + '*')
+        if keys:
+            self.client.delete(*keys)
+
+
+class Cache(object):
+    """
+    Read-through cache for trip responses, configured with the
+    CACHE_* settings and stored per app like the other extensions
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_TYPE', 'memory')
+        app.config.setdefault('CACHE_DEFAULT_TIMEOUT', 60)
+        app.config.setdefault('CACHE_THRESHOLD', 10000)
+        app.config.setdefault('CACHE_KEY_PREFIX', 'trips:')
+        app.config.setdefault('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+        cache_type = app.config['CACHE_TYPE']
+        timeout = app.config['CACHE_DEFAULT_TIMEOUT']
+        if cache_type == 'memory':
+            backend = MemoryBackend(app.config['CACHE_THRESHOLD'], timeout)
+        elif cache_type == 'redis':
+            backend = RedisBackend(app.config['CACHE_REDIS_URL'], timeout,
+                                   app.config['CACHE_KEY_PREFIX'])
+        elif cache_type == 'null':
+            backend = NullBackend()
+        else:
+            raise ValueError('unknown CACHE_TYPE: {}'.format(cache_type))
+        app.extensions['cache'] = backend
+
+    @property
+    def backend(self):
+        return current_app.extensions['cache']
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.backend.set(key, value, timeout)
+
+    def delete(self, *keys):
+        self.backend.delete(*keys)
+
+    def clear(self):
+        self.backend.clear()
+
+    def generation(self, username):
+        """
+        The generation that a user's trips and feeds are cached under
+
+        Read it before querying for what is to be cached, so that a
+        write committed during the query moves readers on to a new
+        generation rather than to the stale entry.
+        """
+        return self.get(generation_key(username)) or '0'
+
+    def invalidate(self, username):
+        """
+        Moves a user's cache to a new generation after their trips change
+
+        Entries of older generations are never read again and expire on
+        their own. The generation outlives them so that readers do not
+        fall back to entries cached before it.
+        """
+        timeout = current_app.config['CACHE_DEFAULT_TIMEOUT'] * 2
+        self.set(generation_key(username), uuid.uuid4().hex, timeout)
+
+
+def generation_key(username):
+    return 'generation:{}'.format(username)
+
+
+def trip_key(username, trip_id, generation):
+    return 'trip:{}:{}:{}'.format(username, generation, trip_id)
+
+
+def sticky_key(username):
+    return 'sticky:{}'.format(username)
+
+
+def feed_key(username, owner, generation):
+    """
+    The owner's view of a feed includes private trips, so is cached apart
+    """
+    return 'feed:{}:{}:{}'.format(username, generation,
+                                  'all' if owner else 'public')
@@ -0,0 +1,64 @@
+import gzip
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies worth compressing, the rest are small or compressed already
+COMPRESSIBLE = ('application/json', 'text/plain', 'text/html')
+
+
+def choose_encoding(accept_encodings, brotli_enabled):
+    """
+    Picks the encoding the client likes best of brotli and gzip, or None
+    if it takes neither
+    """
+    offered = ['gzip']
+    if brotli_enabled and brotli is not None:
+        offered.insert(0, 'br')
+    return accept_encodings.best_match(offered)
+
+
+def compress_response(response, config):
+    """
+    Compresses the body of a response as the request's Accept-Encoding
+    allows, if it is at least COMPRESS_MIN_SIZE bytes
+
+    Streamed responses, such as exports, and ones already encoded are
+    left alone.
+    """
+    if (response.direct_passthrough or response.is_streamed or
+            response.mimetype not in COMPRESSIBLE or
+            'Content-Encoding' in response.headers or
+            not 200 <= response.status_code < 300 or
+            response.status_code == 204):
+        return response
+    # caches must keep a copy per encoding whether or not this one is
+    response.vary.add('Accept-Encoding')
+    threshold = config['COMPRESS_MIN_SIZE']
+    body = response.get_data()
+    if threshold <= 0 or len(body) < threshold:
+        return response
+    encoding = choose_encoding(request.accept_encodings,
+                               config['COMPRESS_BROTLI'])
+    if encoding is None:
+        return response
+
+    if encoding == 'br':
+        body = brotli.compress(body, quality=config['COMPRESS_BROTLI_LEVEL'])
+    else:
+        body = gzip.compress(body, compresslevel=config['COMPRESS_LEVEL'])
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_compression(app):
+    """
+    Compresses the responses of an app
+    """
+    @app.after_request
+    def compress(response):
+        return compress_response(response, app.config)
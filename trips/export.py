@@ -0,0 +1,46 @@
+import zlib
+from sqlalchemy import desc
+
+from . import db
+from .model import Trip
+from .serialize import TRIP_COLUMNS, trip_dict, dumps_line
+
+# Rows fetched per round trip from the server side cursor
+YIELD_PER = 1000
+
+
+def export_rows(username=None, owner=False):
+    """
+    Streams trips newest first from a server side cursor, so only
+    YIELD_PER rows are held in memory at a time
+
+    Private trips are only included for their `owner`.
+    """
+    q = db.session.query(*TRIP_COLUMNS)
+    if username is not None:
+        q = q.filter(Trip.username == username)
+    if not owner:
+        q = q.filter(Trip.public.is_(True))
+    q = q.order_by(desc(Trip.created_at), desc(Trip.id))
+    return q.execution_options(stream_results=True).yield_per(YIELD_PER)
+
+
+def export_chunks(username=None, compress=False, owner=False):
+    """
+    Yields trips as newline delimited JSON, one chunk per YIELD_PER trips,
+    optionally as a single gzip stream
+    """
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    lines = []
+    for row in export_rows(username, owner):
+        lines.append(dumps_line(trip_dict(row)))
+        if len(lines) == YIELD_PER:
+            chunk = b''.join(lines)
+            lines = []
+            yield gzip.compress(chunk) if gzip else chunk
+
+    chunk = b''.join(lines)
+    if gzip:
+        yield gzip.compress(chunk) + gzip.flush()
+    elif chunk:
+        yield chunk
@@ -0,0 +1,225 @@
+import math
+import functools
+from flask import current_app
+from sqlalchemy import func, or_, text
+
+from . import db
+from .model import Trip
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Characters of the geohashes stored for trips, cells of about 5m
+PRECISION = 9
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+
+def encode_geohash(lat, lon, precision=PRECISION):
+    """
+    Encodes a point as a geohash, whose prefixes are the ever larger
+    cells that contain it
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        bounds, point = (lon_range, lon) if even else (lat_range, lat)
+        middle = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if point >= middle:
+            value |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """
+    The height and width in degrees of geohash cells of a precision
+    """
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def covering_cells(lat, lon, radius):
+    """
+    Geohash prefixes of the cells that hold every point within `radius`
+    km of a point
+
+    Cells are picked at least as large as the radius, so the nine around
+    the point cover it. Returns None when the radius is too large for
+    any cell to narrow the search.
+    """
+    dlat = radius / KM_PER_DEGREE
+    dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+    precision = 0
+    while precision < PRECISION:
+        height, width = cell_size(precision + 1)
+        if height < dlat or width < dlon:
+            break
+        precision += 1
+    if precision == 0:
+        return None
+    cells = set()
+    for a in (-dlat, 0, dlat):
+        for b in (-dlon, 0, dlon):
+            cells.add(encode_geohash(max(-90.0, min(90.0, lat + a)),
+                                     (lon + b + 180.0) % 360.0 - 180.0,
+                                     precision))
+    return sorted(cells)
+
+
+def distance_km(lat_col, lon_col, lat, lon):
+    """
+    Great circle distance in km between a point and the points in two
+    columns, by the haversine formula
+    """
+    dlat = func.radians(lat_col - lat) / 2
+    dlon = func.radians(lon_col - lon) / 2
+    a = (func.power(func.sin(dlat), 2) +
+         math.cos(math.radians(lat)) * func.cos(func.radians(lat_col)) *
+         func.power(func.sin(dlon), 2))
+    return 2 * EARTH_RADIUS_KM * func.asin(func.sqrt(func.least(a, 1.0)))
+
+
+def near(query, lat, lon, radius):
+    """
+    Filters a query to trips starting or finishing within `radius` km
+    of a point
+
+    Candidates are found by geohash prefix, which the geohash indexes
+    serve, and then checked by distance.
+    """
+    cells = covering_cells(lat, lon, radius)
+    if cells is not None:
+        query = query.filter(or_(*[
+            column.like(cell + '%') for cell in cells
+            for column in (Trip.start_geohash, Trip.finish_geohash)]))
+    # least() skips the end of a trip that was not geocoded
+    distance = func.least(
+        distance_km(Trip.start_lat, Trip.start_lon, lat, lon),
+        distance_km(Trip.finish_lat, Trip.finish_lon, lat, lon))
+    return query.filter(distance <= radius)
+
+
+def normalize(name):
+    return ' '.join(name.casefold().replace('-', ' ').split())
+
+
+class Gazetteer(object):
+    """
+    Places read from a tab separated file of name, latitude and
+    longitude, with any alternate names in a fourth comma separated
+    column
+
+    Lookups are remembered, as trips mostly go between the same places.
+    """
+
+    def __init__(self, path, cache_size=10000):
+        self.places = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip() or line.startswith('#'):
+                    continue
+                parts = line.rstrip('\n').split('\t')
+                point = (float(parts[1]), float(parts[2]))
+                names = [parts[0]]
+                if len(parts) > 3:
+                    names.extend(parts[3].split(','))
+                for name in names:
+                    # the first place listed under a name wins
+                    self.places.setdefault(normalize(name), point)
+        self.lookup = functools.lru_cache(maxsize=cache_size)(self._lookup)
+
+    def _lookup(self, name):
+        """
+        The (lat, lon) of a place, trying the part before any comma if
+        the whole name is not known, or None
+        """
+        name = normalize(name)
+        if name in self.places:
+            return self.places[name]
+        head = name.split(',')[0].strip()
+        return self.places.get(head)
+
+
+def gazetteer():
+    """
+    The app's gazetteer, read from GAZETTEER_PATH the first time it is
+    needed, or None if there is none
+    """
+    state = current_app.extensions.setdefault('geo', {})
+    if 'gazetteer' not in state:
+        path = current_app.config['GAZETTEER_PATH']
+        state['gazetteer'] = path and Gazetteer(
+            path, current_app.config['GAZETTEER_CACHE_SIZE'])
+    return state['gazetteer'] or None
+
+
+def geocode(start, finish):
+    """
+    Geocodes the start and finish of a trip into the values of its
+    point columns, which are None for places that are not known
+    """
+    places = gazetteer()
+    columns = {}
+    for prefix, name in (('start', start), ('finish', finish)):
+        point = places.lookup(name) if places and name else None
+        columns[prefix + '_lat'] = point and point[0]
+        columns[prefix + '_lon'] = point and point[1]
+        columns[prefix + '_geohash'] = point and encode_geohash(*point)
+    return columns
+
+
+def geocode_trips():
+    """
+    Geocodes the places of trips that were not geocoded when they were
+    created, such as seeded trips or ones made before the gazetteer knew
+    their places
+
+    Each distinct place is looked up once, and the trips from and to the
+    known ones are updated with a join in one transaction. Returns how
+    many starts and finishes were geocoded.
+    """
+    places = gazetteer()
+    if places is None:
+        raise ValueError('GAZETTEER_PATH is not set')
+    names = set()
+    for prefix in ('start', 'finish'):
+        names.update(row[0] for row in db.session.execute(text(
+            'SELECT DISTINCT {0} FROM trips '
+            'WHERE {0} IS NOT NULL AND {0}_geohash IS NULL'.format(prefix))))
+    known = []
+    for name in names:
+        point = places.lookup(name)
+        if point is not None:
+            known.append({'name': name, 'lat': point[0], 'lon': point[1],
+                          'geohash': encode_geohash(*point)})
+    if not known:
+        return 0
+
+    db.session.execute(text(
+        'CREATE TEMPORARY TABLE geocoded (name varchar(32) PRIMARY KEY, '
+        'lat float, lon float, geohash varchar(12))'))
+    db.session.execute(text(
+        'INSERT INTO geocoded VALUES (:name, :lat, :lon, :geohash)'), known)
+    geocoded = 0
+    for prefix in ('start', 'finish'):
+        geocoded += db.session.execute(text(
+            'UPDATE trips SET {0}_lat = g.lat, {0}_lon = g.lon, '
+            '{0}_geohash = g.geohash FROM geocoded g '
+            'WHERE trips.{0} = g.name AND trips.{0}_geohash IS NULL'
+            .format(prefix))).rowcount
+    # dropped here rather than ON COMMIT, which a savepoint never reaches
+    db.session.execute(text('DROP TABLE geocoded'))
+    db.session.commit()
+    return geocoded
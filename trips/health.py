@@ -0,0 +1,78 @@
+import os
+import time
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from sqlalchemy import text
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def resolve_version():
+    """
+    Works out the running version once, at startup
+
+    Prefers the TRIPS_VERSION environment variable, then a VERSION file
+    written at build time and only then asks git.
+    """
+    version = os.environ.get('TRIPS_VERSION')
+    if version:
+        return version
+    try:
+        with open(os.path.join(basedir, 'VERSION')) as f:
+            return f.read().strip()
+    except IOError:
+        pass
+    try:
+        return (subprocess.check_output(['git', 'rev-parse', '--short',
+                                         'HEAD'], cwd=basedir,
+                                        stderr=subprocess.DEVNULL)
+                .decode('utf-8').strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class Readiness(object):
+    """
+    Pings the app's database pool in the background, giving up after
+    READY_TIMEOUT seconds and reusing the result for READY_CACHE_SECONDS
+    so that frequent probes do not each take a connection
+    """
+
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self.timeout = app.config['READY_TIMEOUT']
+        self.ttl = app.config['READY_CACHE_SECONDS']
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._lock = threading.Lock()
+        self._pending = None
+        self._checked_at = 0
+        self._result = (False, 'not checked')
+
+    def _ping(self):
+        with self.app.app_context():
+            with self.db.engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+
+    def check(self):
+        """
+        Returns whether the service is ready and why it is not
+        """
+        with self._lock:
+            if time.time() - self._checked_at < self.ttl:
+                return self._result
+            # a ping that is still hung is waited on again, not repeated
+            if self._pending is None:
+                self._pending = self._executor.submit(self._ping)
+            try:
+                self._pending.result(self.timeout)
+                self._result = (True, None)
+            except TimeoutError:
+                self._result = (False, 'database ping timed out')
+            except Exception as e:
+                self._result = (False, 'database error: {}'.format(e))
+            if self._pending.done():
+                self._pending = None
+            self._checked_at = time.time()
+            return self._result
@@ -0,0 +1,293 @@
+import json
+import uuid
+import threading
+import urllib.request
+from datetime import datetime, timedelta
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from flask import current_app
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects.postgresql import insert
+
+from .timestamps import EPOCH
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Functions that run each kind of job, called with the job's payload in
+# an app context
+HANDLERS = {}
+
+
+def handler(kind):
+    """
+    Registers a function to run jobs of a kind
+    """
+    def register(f):
+        HANDLERS[kind] = f
+        return f
+    return register
+
+
+class JobQueue(object):
+    """
+    Jobs stored in the jobs table, which the workers of every host share
+
+    Jobs are put in the caller's transaction, like an outbox, and only
+    workers see them once it commits. Jobs that fail are retried with
+    exponential backoff up to `max_attempts` times, and jobs left running
+    longer than `lease` seconds, by a worker that died, are run again.
+    Handlers must be safe to run twice.
+    """
+
+    def __init__(self, db, model, max_attempts=5, backoff=2, lease=300):
+        self.db = db
+        self.model = model
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+
+    def put(self, kind, payload, key):
+        """
+        Queues a job in the current transaction, or returns the job
+        already queued under `key`
+        """
+        now = datetime.utcnow()
+        self.db.session.execute(
+            insert(self.model.__table__).values(
+                id=uuid.uuid4().hex, key=key, kind=kind, payload=payload,
+                status=QUEUED, attempts=0, run_at=now, created_at=now,
+                updated_at=now)
+            .on_conflict_do_nothing(index_elements=['key']))
+        return self.db.session.query(self.model).filter_by(key=key).one()
+
+    def get(self, job_id):
+        return self.db.session.query(self.model).get(job_id)
+
+    def claim(self, job_id=None):
+        """
+        Marks the next job that is due as running, commits and returns
+        it, or None if no job is due
+
+        Jobs locked by other workers claiming them are skipped rather
+        than waited on. With `job_id`, only that job is claimed, whenever
+        it is due.
+        """
+        Job = self.model
+        now = datetime.utcnow()
+        query = self.db.session.query(Job)
+        if job_id is None:
+            query = query.filter(or_(
+                and_(Job.status == QUEUED, Job.run_at <= now),
+                and_(Job.status == RUNNING,
+                     Job.updated_at < now - timedelta(seconds=self.lease))))
+        else:
+            query = query.filter(Job.id == job_id, Job.status == QUEUED)
+        job = (query.order_by(Job.run_at)
+               .with_for_update(skip_locked=True).first())
+        if job is not None:
+            job.status = RUNNING
+            job.attempts += 1
+            job.updated_at = now
+        self.db.session.commit()
+        return job
+
+    def finish(self, job, error=None):
+        """
+        Records the outcome of a claimed job, queueing it to be retried
+        if it failed and has attempts left
+        """
+        now = datetime.utcnow()
+        if error is None:
+            job.status = DONE
+        elif job.attempts >= self.max_attempts:
+            job.status = FAILED
+        else:
+            job.status = QUEUED
+            job.run_at = now + timedelta(
+                seconds=self.backoff * 2 ** (job.attempts - 1))
+        job.error = error
+        job.updated_at = now
+        self.db.session.commit()
+
+
+class Jobs(object):
+    """
+    Background jobs, configured with the JOBS_* settings and stored per
+    app like the other extensions
+
+    Jobs are run by a thread that each web worker starts when it boots,
+    unless JOBS_WORKER is off, and by ./manage.py jobs. With JOBS_EAGER
+    they are run, retries and all, as soon as their transaction commits,
+    which is what tests use.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from . import db
+        from .model import Job
+        app.config.setdefault('JOBS_EAGER', False)
+        app.config.setdefault('JOBS_WORKER', True)
+        app.config.setdefault('JOBS_MAX_ATTEMPTS', 5)
+        app.config.setdefault('JOBS_BACKOFF_SECONDS', 2)
+        app.config.setdefault('JOBS_LEASE_SECONDS', 300)
+        app.config.setdefault('JOBS_POLL_SECONDS', 1)
+        app.extensions['jobs'] = JobQueue(
+            db, Job, app.config['JOBS_MAX_ATTEMPTS'],
+            app.config['JOBS_BACKOFF_SECONDS'],
+            app.config['JOBS_LEASE_SECONDS'])
+        app.extensions['jobs_worker'] = None
+
+    @property
+    def queue(self):
+        return current_app.extensions['jobs']
+
+    def enqueue(self, kind, payload, key):
+        """
+        Queues a job once per `key` in the current transaction and
+        returns it as it stands
+        """
+        return self.queue.put(kind, payload, key)
+
+    def committed(self, jobs):
+        """
+        Runs jobs queued in a transaction that has just committed, with
+        JOBS_EAGER, and returns them as they stand
+
+        Otherwise they are left to the workers.
+        """
+        if not current_app.config['JOBS_EAGER']:
+            return jobs
+        app = current_app._get_current_object()
+        for job in jobs:
+            while run_job(app, self.queue, self.queue.claim(job.id)):
+                pass
+        return jobs
+
+    def get(self, job_id):
+        return self.queue.get(job_id)
+
+    def start(self, app):
+        """
+        Starts a thread that runs an app's jobs as they fall due, for a
+        worker that has just booted
+        """
+        if app.config['JOBS_EAGER'] or not app.config['JOBS_WORKER']:
+            return
+        stopped = threading.Event()
+        thread = threading.Thread(target=work, args=(app,),
+                                  kwargs={'stopped': stopped}, daemon=True)
+        app.extensions['jobs_worker'] = (thread, stopped)
+        thread.start()
+
+    def stop(self, app):
+        """
+        Stops an app's worker thread, once it is done with the job it is
+        running, if any
+        """
+        worker = app.extensions['jobs_worker']
+        if worker is None:
+            return
+        thread, stopped = worker
+        stopped.set()
+        thread.join()
+        app.extensions['jobs_worker'] = None
+
+
+def run_job(app, queue, job):
+    """
+    Runs a claimed job in the current app context and records how it
+    went
+
+    Returns whether there was a job to run.
+    """
+    if job is None:
+        return False
+    try:
+        HANDLERS[job.kind](job.payload)
+    except Exception as e:
+        queue.db.session.rollback()
+        app.logger.warning('job %s (%s) failed on attempt %d: %s',
+                           job.id, job.kind, job.attempts, e)
+        queue.finish(job, '{}: {}'.format(type(e).__name__, e))
+    else:
+        queue.finish(job)
+    return True
+
+
+def work(app, forever=True, stopped=None):
+    """
+    Runs jobs as they fall due, polling every JOBS_POLL_SECONDS, until
+    `stopped` is set
+    """
+    queue = app.extensions['jobs']
+    stopped = stopped or threading.Event()
+    while not stopped.is_set():
+        with app.app_context():
+            try:
+                ran = run_job(app, queue, queue.claim())
+            except Exception:
+                # such as the database going away, which is retried
+                app.logger.exception('jobs worker failed')
+                ran = False
+        if ran:
+            continue
+        if not forever:
+            return
+        stopped.wait(app.config['JOBS_POLL_SECONDS'])
+
+
+def job_json(job):
+    """
+    What clients are told about a job
+    """
+    return {'id': job.id,
+            'kind': job.kind,
+            'status': job.status,
+            'attempts': job.attempts,
+            'error': job.error,
+            'created_at': (job.created_at - EPOCH).total_seconds(),
+            'updated_at': (job.updated_at - EPOCH).total_seconds()}
+
+
+def delete_children(url, batch):
+    """
+    Deletes a trip's content from one service, `batch` items at a time
+
+    The service answers each DELETE with how many items it deleted, so
+    fewer than `batch` means nothing is left. A 404 means there never
+    was any, or an earlier attempt already deleted it.
+    """
+    headers = {'Accept': 'application/json'}
+    token = current_app.config['TRIP_CHILD_SERVICE_TOKEN']
+    if token:
+        headers['Authorization'] = 'JWT ' + token
+    while True:
+        request = urllib.request.Request(
+            url + '?' + urlencode({'limit': batch}), headers=headers,
+            method='DELETE')
+        try:
+            with urllib.request.urlopen(request, timeout=10) as resp:
+                body = json.loads(resp.read().decode('utf-8') or '{}')
+        except HTTPError as e:
+            if e.code == 404:
+                return
+            raise
+        if body.get('deleted', 0) < batch:
+            return
+
+
+@handler('trip_deleted')
+def trip_deleted(payload):
+    """
+    Deletes the blurbs, images, lines and points of a deleted trip from
+    the services that hold them
+    """
+    for template in current_app.config['TRIP_CHILD_SERVICES']:
+        delete_children(template.format(**payload),
+                        current_app.config['TRIP_CHILD_BATCH'])
@@ -0,0 +1,473 @@
+import os
+import json
+import glob
+import time
+import fcntl
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import current_app, g, request, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .pool import pool_status
+
+# Upper bounds of the latency buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 25, 50, 100)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def format_labels(labels):
+    """
+    Renders label pairs as a Prometheus label set
+    """
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                                         .replace('"', '\\"')
+                                         .replace('\n', '\\n'))
+        for name, value in labels) + '}'
+
+
+class Counter(object):
+    """ A count that only goes up, per set of label values """
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, list(zip(self.labels, key)), value
+
+
+class Histogram(object):
+    """ Counts observations into cumulative buckets, per set of labels """
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            counts, total = self._values.get(key,
+                                             ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total))
+                            for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            labels = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       labels + [('le', format_value(bound))], cumulative)
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+class Registry(object):
+    """
+    The metrics of one process, rendered in the Prometheus text format
+
+    Collectors are called on each render for values that are read from
+    elsewhere, like pool statistics. They return (name, type, help,
+    samples) tuples, with samples as (name, label pairs, value) like
+    the samples of metrics.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self):
+        """
+        The families of every metric and collector, with their samples
+        """
+        families = [(m.name, m.type, m.help, list(m.samples()))
+                    for m in self.metrics]
+        for collect in self.collectors:
+            families.extend((name, type, help, list(samples))
+                            for name, type, help, samples in collect())
+        return families
+
+    def render(self):
+        return format_families(self.collect())
+
+
+def format_families(families):
+    lines = []
+    for name, type, help, samples in families:
+        lines.append('# HELP {} {}'.format(name, help))
+        lines.append('# TYPE {} {}'.format(name, type))
+        for sample, labels, value in samples:
+            lines.append('{}{} {}'.format(sample, format_labels(labels),
+                                          format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def merge_families(snapshots):
+    """
+    Adds up the samples of families collected by several processes
+    """
+    merged = OrderedDict()
+    for families in snapshots:
+        for name, type, help, samples in families:
+            _, _, totals = merged.setdefault(name,
+                                             (type, help, OrderedDict()))
+            for sample, labels, value in samples:
+                key = (sample, tuple(tuple(label) for label in labels))
+                totals[key] = totals.get(key, 0) + value
+    return [(name, type, help,
+             [(sample, list(labels), value)
+              for (sample, labels), value in totals.items()])
+            for name, (type, help, totals) in merged.items()]
+
+
+@contextmanager
+def snapshots_lock(directory, exclusive=False):
+    """
+    Keeps snapshots from being read while a dead worker's are retired
+    """
+    with open(os.path.join(directory, 'lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_snapshot(directory, name, families):
+    path = os.path.join(directory, name + '.json')
+    # written aside and renamed over, so readers never see half of it
+    with open(path + '.tmp', 'w') as f:
+        json.dump(families, f)
+    os.replace(path + '.tmp', path)
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return []
+
+
+def read_snapshots(directory):
+    """
+    The families of every worker that has written to `directory`
+    """
+    with snapshots_lock(directory):
+        return [read_snapshot(path) for path in
+                sorted(glob.glob(os.path.join(directory, '*.json')))]
+
+
+def clear_snapshots(directory):
+    """
+    Removes samples left in `directory` by an earlier run of the server
+    """
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.remove(path)
+
+
+def retire_snapshot(directory, pid):
+    """
+    Folds the counters and histograms of a dead worker into the archive
+    of dead workers, so that totals keep going up as workers recycle,
+    and drops its gauges
+    """
+    path = os.path.join(directory, '{}.json'.format(pid))
+    if not os.path.exists(path):
+        return
+    with snapshots_lock(directory, exclusive=True):
+        archive = read_snapshot(os.path.join(directory, 'archive.json'))
+        kept = [family for family in read_snapshot(path)
+                if family[1] != 'gauge']
+        write_snapshot(directory, 'archive',
+                       merge_families([archive, kept]))
+        os.remove(path)
+
+
+class Metrics(object):
+    """
+    The request metrics of an app
+
+    With METRICS_DIR set, each worker writes its samples there every
+    METRICS_FLUSH_SECONDS and /metrics adds up those of all workers, as
+    one process's metrics would jump around between scrapes that
+    different workers answer.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._dirty = False
+        self._flusher = None
+        self._flusher_pid = None
+        self._flushing = threading.Lock()
+        self._stopped = threading.Event()
+        self.registry = Registry()
+        self.latency = self.registry.histogram(
+            'trips_request_duration_seconds', 'Time to build a response',
+            ('method', 'endpoint', 'status'))
+        self.queries = self.registry.histogram(
+            'trips_request_db_queries', 'Database queries per request',
+            ('endpoint',), QUERY_BUCKETS)
+        self.db_time = self.registry.histogram(
+            'trips_request_db_duration_seconds',
+            'Time spent in database queries per request', ('endpoint',))
+        self.serialize_time = self.registry.histogram(
+            'trips_request_serialize_duration_seconds',
+            'Time spent encoding response bodies per request', ('endpoint',))
+        self.slow_queries = self.registry.counter(
+            'trips_slow_queries_total',
+            'Queries slower than SLOW_QUERY_SECONDS')
+
+    @property
+    def directory(self):
+        return self.config.get('METRICS_DIR')
+
+    def changed(self):
+        """
+        Marks this worker's samples to be written out by its flusher
+        thread, which is started in each worker the first time
+        """
+        if self.directory is None:
+            return
+        self._dirty = True
+        if self._flusher_pid != os.getpid() and not self._stopped.is_set():
+            with self._flushing:
+                if self._flusher_pid != os.getpid():
+                    self._flusher_pid = os.getpid()
+                    self._flusher = threading.Thread(
+                        target=self.flush_every, daemon=True)
+                    self._flusher.start()
+
+    def flush_every(self):
+        interval = self.config.get('METRICS_FLUSH_SECONDS', 1.0)
+        while not self._stopped.wait(interval):
+            if self._dirty:
+                self.flush()
+
+    def stop(self):
+        """
+        Stops this worker's flusher thread, for when the worker or app
+        goes away
+        """
+        self._stopped.set()
+        flusher = self._flusher
+        if flusher is not None and self._flusher_pid == os.getpid():
+            flusher.join()
+        self._flusher = None
+
+    def flush(self):
+        """
+        Writes this worker's samples to METRICS_DIR
+        """
+        if self.directory is None:
+            return
+        with self._flushing:
+            self._dirty = False
+            write_snapshot(self.directory, str(os.getpid()),
+                           self.registry.collect())
+
+    def render(self):
+        """
+        The metrics of this process, or of all workers with METRICS_DIR
+        """
+        if self.directory is None:
+            return self.registry.render()
+        self.flush()
+        return format_families(merge_families(
+            read_snapshots(self.directory)))
+
+
+def init_metrics(app, db):
+    """
+    Times every request and database query of an app
+    """
+    metrics = Metrics(app.config)
+    metrics.registry.collectors.append(
+        lambda: pool_metrics(engines(app, db)))
+    metrics.registry.collectors.append(lambda: token_metrics(app))
+    app.extensions['metrics'] = metrics
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor):
+        event.listen(Engine, 'before_cursor_execute', before_cursor)
+        event.listen(Engine, 'after_cursor_execute', after_cursor)
+        event.listen(Engine, 'handle_error', cursor_error)
+    return metrics
+
+
+def add_timing(name, seconds, count=0):
+    """
+    Adds to one of the timings of the current request
+    """
+    if not has_app_context():
+        return
+    timings = g.get('timings')
+    if timings is None:
+        return
+    spent, calls = timings.get(name, (0.0, 0))
+    timings[name] = (spent + seconds, calls + count)
+
+
+@contextmanager
+def timing(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(name, time.perf_counter() - start, 1)
+
+
+def start_request():
+    g.timings = {}
+    g.request_start = time.perf_counter()
+
+
+def finish_request(response):
+    """
+    Records the timings of a request and reports them to the client in
+    a Server-Timing header
+    """
+    if g.get('timings') is None:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    metrics = current_app.extensions['metrics']
+    endpoint = request.url_rule.rule if request.url_rule else 'none'
+    db_time, queries = g.timings.get('db', (0.0, 0))
+    serialize_time, _ = g.timings.get('serialize', (0.0, 0))
+
+    metrics.latency.observe(elapsed, method=request.method,
+                            endpoint=endpoint, status=response.status_code)
+    metrics.queries.observe(queries, endpoint=endpoint)
+    metrics.db_time.observe(db_time, endpoint=endpoint)
+    metrics.serialize_time.observe(serialize_time, endpoint=endpoint)
+
+    response.headers['Server-Timing'] = (
+        'db;dur={:.2f};desc="{} queries", serialize;dur={:.2f}, '
+        'total;dur={:.2f}'.format(db_time * 1000, queries,
+                                  serialize_time * 1000, elapsed * 1000))
+    g.timings = None
+    metrics.changed()
+    return response
+
+
+def before_cursor(conn, cursor, statement, parameters, context,
+                  executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    add_timing('db', elapsed, 1)
+    if not has_app_context() or 'metrics' not in current_app.extensions:
+        return
+    threshold = current_app.config.get('SLOW_QUERY_SECONDS')
+    if threshold and elapsed >= threshold:
+        current_app.extensions['metrics'].slow_queries.inc()
+        current_app.logger.warning('slow query (%.3fs): %s; parameters: %r',
+                                   elapsed, statement, parameters)
+
+
+def cursor_error(context):
+    """
+    Drops the start time of a query that failed, which after_cursor would
+    otherwise have taken off the connection
+    """
+    if context.statement is None or context.connection is None:
+        return
+    starts = context.connection.info.get('query_start')
+    if starts:
+        starts.pop()
+
+
+def engines(app, db):
+    """
+    The primary's and replicas' engines of an app, by bind, looked up
+    without an app context so the flusher thread can read them
+    """
+    return ([('primary', db.get_engine(app))] +
+            sorted(db.replica_engines(app).items()))
+
+
+def pool_metrics(engines):
+    """
+    The state of the connection pools of (bind, engine) pairs
+    """
+    statuses = [(bind, pool_status(engine)) for bind, engine in engines]
+
+    families = (
+        ('trips_db_pool_size', 'gauge', 'Connections kept open', 'size'),
+        ('trips_db_pool_checked_out', 'gauge', 'Connections in use',
+         'checked_out'),
+        ('trips_db_pool_checkouts_total', 'counter',
+         'Connections handed out', 'checkouts'),
+        ('trips_db_pool_timeouts_total', 'counter',
+         'Checkouts that timed out waiting', 'timeouts'),
+        ('trips_db_pool_wait_seconds_total', 'counter',
+         'Time spent waiting for a connection', 'wait_seconds_total'))
+    for name, type, help, key in families:
+        yield name, type, help, [(name, [('bind', bind)], status[key])
+                                 for bind, status in statuses
+                                 if key in status]
+
+
+def token_metrics(app):
+    """
+    The hit rate and size of the verified token cache
+    """
+    stats = app.extensions['token_cache'].stats()
+    families = (
+        ('trips_token_cache_size', 'gauge', 'Verified tokens remembered',
+         'size'),
+        ('trips_token_cache_hits_total', 'counter',
+         'Tokens found already verified', 'hits'),
+        ('trips_token_cache_misses_total', 'counter',
+         'Tokens that had to be verified', 'misses'))
+    for name, type, help, key in families:
+        yield name, type, help, [(name, [], stats[key])]
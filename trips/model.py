@@ -1,6 +1,17 @@
 from datetime import datetime
-from dateutil import parser
+from sqlalchemy import DDL, event, text
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from . import db
+from .timestamps import parse_timestamp
+
+# Text search configuration of the search_vector column, which queries
+# against it must use too
+SEARCH_CONFIG = 'english'
+SEARCH_DOCUMENT = (
+    "setweight(to_tsvector('{0}', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('{0}', coalesce(description, '')), 'B') || "
+    "setweight(to_tsvector('{0}', coalesce(start, '') || ' ' || "
+    "coalesce(finish, '')), 'C')").format(SEARCH_CONFIG)
 
 
 class Trip(db.Model):
@@ -10,17 +21,27 @@ class Trip(db.Model):
     __tablename__ = 'trips'
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), index=False)
-    username = db.Column(db.String(32), index=True)
+    username = db.Column(db.String(32))
     complete = db.Column(db.Boolean(), default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     start = db.Column(db.String(32))
     finish = db.Column(db.String(32))
     public = db.Column(db.Boolean(), default=True)
     description = db.Column(db.Text())
+    # where start and finish are, when the gazetteer knows them
+    start_lat = db.Column(db.Float())
+    start_lon = db.Column(db.Float())
+    start_geohash = db.Column(db.String(12))
+    finish_lat = db.Column(db.Float())
+    finish_lon = db.Column(db.Float())
+    finish_geohash = db.Column(db.String(12))
+    # maintained by postgres, and only loaded when asked for
+    search_vector = db.deferred(db.Column(
+        TSVECTOR, db.Computed(SEARCH_DOCUMENT, persisted=True)))
 
     def __init__(self, **kwargs):
-        if 'created_at' in kwargs and type(kwargs['created_at']) is str:
-            kwargs['created_at'] = parser.parse(kwargs['created_at'])
+        if isinstance(kwargs.get('created_at'), str):
+            kwargs['created_at'] = parse_timestamp(kwargs['created_at'])
         super(Trip, self).__init__(**kwargs)
 
     def to_json(self):
@@ -34,3 +55,86 @@ class Trip(db.Model):
                 "public": self.public,
                 "description": self.description
                 }
+
+
+class UserTripStats(db.Model):
+    """
+    Counts and the newest trip of each user, kept up to date in the
+    transactions that create and delete their trips
+
+    Everything is kept twice, for the owner and for everyone else, who
+    only sees public trips.
+    """
+    __tablename__ = 'user_trip_stats'
+    username = db.Column(db.String(32), primary_key=True)
+    trips = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    latest_id = db.Column(db.Integer)
+    latest_created_at = db.Column(db.DateTime)
+    public_trips = db.Column(db.Integer, nullable=False, default=0)
+    public_completed = db.Column(db.Integer, nullable=False, default=0)
+    public_latest_id = db.Column(db.Integer)
+    public_latest_created_at = db.Column(db.DateTime)
+
+
+class Job(db.Model):
+    """
+    A background job, queued in the transaction of the work it follows
+    up on so that it is only queued if that work commits
+
+    Each job has a unique key, so the same work is only queued once.
+    """
+    __tablename__ = 'jobs'
+    id = db.Column(db.String(32), primary_key=True)
+    key = db.Column(db.String(255), unique=True, nullable=False)
+    kind = db.Column(db.String(64), nullable=False)
+    payload = db.Column(JSONB, nullable=False)
+    status = db.Column(db.String(16), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    run_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+
+# The feeds are read newest first, keyset paged on (created_at, id)
+db.Index('ix_trips_username_created_at_id',
+         Trip.username, Trip.created_at.desc(), Trip.id.desc())
+db.Index('ix_trips_created_at_id', Trip.created_at.desc(), Trip.id.desc())
+db.Index('ix_trips_public_created_at_id',
+         Trip.created_at.desc(), Trip.id.desc(),
+         postgresql_where=Trip.public.is_(True))
+# What everyone but the owner sees of a user's feed
+db.Index('ix_trips_username_public_created_at_id',
+         Trip.username, Trip.created_at.desc(), Trip.id.desc(),
+         postgresql_where=Trip.public.is_(True))
+db.Index('ix_trips_search_vector', Trip.search_vector,
+         postgresql_using='gin')
+# Workers look for jobs that are due, or running past their lease
+db.Index('ix_jobs_status_run_at', Job.status, Job.run_at)
+# Nearby trips are found by geohash prefix, which needs the pattern ops
+# for LIKE to use the index whatever the collation
+for column in (Trip.start_geohash, Trip.finish_geohash):
+    db.Index('ix_trips_{}'.format(column.key), column,
+             postgresql_ops={column.key: 'varchar_pattern_ops'},
+             postgresql_where=column.isnot(None))
+
+
+def trigram_available(ddl, target, bind, **kwargs):
+    """
+    Checks whether the server can install the pg_trgm extension
+    """
+    return bind.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_available_extensions "
+        "WHERE name = 'pg_trgm')")).scalar()
+
+
+# Trigram indexes on locations, for fuzzy search. Skipped on servers
+# without pg_trgm, where search only matches whole words
+event.listen(Trip.__table__, 'after_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm;'
+    'CREATE INDEX ix_trips_start_trgm ON trips '
+    'USING gin (start gin_trgm_ops);'
+    'CREATE INDEX ix_trips_finish_trgm ON trips '
+    'USING gin (finish gin_trgm_ops)'
+).execute_if(dialect='postgresql', callable_=trigram_available))
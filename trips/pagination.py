@@ -0,0 +1,101 @@
+import base64
+from datetime import timedelta
+from sqlalchemy import desc, tuple_
+
+from . import db
+from .model import Trip
+from .sql import explain
+from .timestamps import EPOCH
+TOTAL_MODES = ('exact', 'estimate', 'none')
+
+
+class CursorError(ValueError):
+    """ Raised when a client sends a cursor that we did not issue """
+
+
+def encode_cursor(created_at, id):
+    """
+    Packs the sort key of the last trip on a page into an opaque token
+    """
+    micros = (created_at - EPOCH) // timedelta(microseconds=1)
+    return pack_token('{}.{}'.format(micros, id))
+
+
+def decode_cursor(cursor):
+    """
+    Unpacks a cursor into the (created_at, id) key it was made from
+    """
+    try:
+        micros, id = unpack_token(cursor).split('.')
+        return EPOCH + timedelta(microseconds=int(micros)), int(id)
+    except (ValueError, TypeError, UnicodeError, OverflowError):
+        raise CursorError('invalid cursor')
+
+
+def pack_token(text):
+    """
+    Encodes the text of a cursor as unpadded urlsafe base64
+    """
+    raw = text.encode('ascii')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def unpack_token(token):
+    """
+    Decodes a token made by `pack_token`
+    """
+    padded = token + '=' * (-len(token) % 4)
+    return base64.urlsafe_b64decode(padded.encode('ascii')).decode('ascii')
+
+
+def keyset_query(query, cursor, size, key=(Trip.created_at, Trip.id)):
+    """
+    Orders a query newest first on `key` and seeks past the cursor
+
+    One extra row is fetched to tell whether there is a page after this.
+    """
+    created_col, id_col = key
+    q = query.order_by(desc(created_col), desc(id_col))
+    if cursor:
+        created_at, id = decode_cursor(cursor)
+        q = q.filter(tuple_(created_col, id_col) < tuple_(created_at, id))
+    return q.limit(size + 1)
+
+
+def keyset_page(query, cursor, size, key=(Trip.created_at, Trip.id)):
+    """
+    Fetches one page of a keyset paged query
+
+    Returns the rows of the page and the cursor for the page after it,
+    which is None once there are no more rows.
+    """
+    rows = keyset_query(query, cursor, size, key).all()
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return rows, next_cursor
+
+
+def page_total(query, mode):
+    """
+    Counts the results of a query according to the requested total mode
+
+    `exact` runs a full COUNT(*), `estimate` asks the planner how many
+    rows it expects and `none` skips counting altogether.
+    """
+    if mode == 'exact':
+        return query.count()
+    if mode == 'estimate':
+        plan = db.session.execute(explain(query.statement,
+                                          format='json')).scalar()
+        return int(plan[0]['Plan']['Plan Rows'])
+    return None
+
+
+def has_results(query):
+    """
+    Checks whether a query matches any rows with an EXISTS
+    """
+    return db.session.query(query.exists()).scalar()
@@ -0,0 +1,75 @@
+from sqlalchemy import text
+
+
+def is_partitioned(conn):
+    return conn.execute(text(
+        "SELECT relkind = 'p' FROM pg_class "
+        "WHERE relname = 'trips' AND relkind IN ('r', 'p')")).scalar()
+
+
+def replace_trips(conn, create, primary_key):
+    """
+    Copies trips into a new table made by the `create` statements, swaps
+    it in, and builds the primary key and the old table's indexes on it
+
+    The columns and indexes are read from the table as it is, so that
+    ones added by later migrations are kept.
+    """
+    conn.execute(text('LOCK TABLE trips IN EXCLUSIVE MODE'))
+    columns = ', '.join(row[0] for row in conn.execute(text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = 'trips' "
+        "AND is_generated = 'NEVER' ORDER BY ordinal_position")))
+    # the indexes of partitioned tables are made ON ONLY the parent
+    indexes = [row[0].replace(' ON ONLY ', ' ON ') for row in conn.execute(
+        text("SELECT indexdef FROM pg_indexes "
+             "WHERE schemaname = current_schema() AND tablename = 'trips' "
+             "AND indexname <> 'trips_pkey'"))]
+    for statement in create:
+        conn.execute(statement)
+    conn.execute('INSERT INTO trips_new ({0}) SELECT {0} FROM trips'
+                 .format(columns))
+    conn.execute('ALTER SEQUENCE trips_id_seq OWNED BY trips_new.id')
+    conn.execute('DROP TABLE trips')
+    conn.execute('ALTER TABLE trips_new RENAME TO trips')
+    conn.execute('ALTER TABLE trips ADD CONSTRAINT trips_pkey '
+                 'PRIMARY KEY ({})'.format(', '.join(primary_key)))
+    # partitioned tables cannot be indexed concurrently, and this one is
+    # locked for writes anyway
+    for indexdef in indexes:
+        conn.execute(indexdef)
+
+
+def partition_trips(conn, partitions):
+    """
+    Hash partitions the trips table by username into `partitions`
+    tables, unless it is partitioned already
+
+    The trips are copied under an exclusive lock, which blocks writes
+    (but not reads) until the transaction commits. Returns whether the
+    table was partitioned.
+    """
+    if is_partitioned(conn):
+        return False
+    create = ['CREATE TABLE trips_new (LIKE trips INCLUDING DEFAULTS '
+              'INCLUDING GENERATED) PARTITION BY HASH (username)']
+    create.extend('CREATE TABLE trips_p{0} PARTITION OF trips_new '
+                  'FOR VALUES WITH (MODULUS {1}, REMAINDER {0})'
+                  .format(i, partitions) for i in range(partitions))
+    replace_trips(conn, create, ['username', 'id'])
+    return True
+
+
+def unpartition_trips(conn):
+    """
+    Copies partitioned trips back into one plain table, unless they are
+    in one already
+
+    Returns whether the table was partitioned.
+    """
+    if not is_partitioned(conn):
+        return False
+    replace_trips(conn, ['CREATE TABLE trips_new (LIKE trips INCLUDING '
+                         'DEFAULTS INCLUDING GENERATED)'], ['id'])
+    conn.execute('ALTER TABLE trips ALTER COLUMN username DROP NOT NULL')
+    return True
@@ -0,0 +1,147 @@
+import time
+import random
+import threading
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+class PoolStats(object):
+    """ Counts the checkouts of a pool and how long they waited """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += int(timed_out)
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def snapshot(self):
+        with self._lock:
+            return {'checkouts': self.checkouts,
+                    'timeouts': self.timeouts,
+                    'wait_seconds_total': self.wait_total,
+                    'wait_seconds_max': self.wait_max}
+
+
+class TimedQueuePool(QueuePool):
+    """
+    A QueuePool that records how long each checkout waited for a
+    connection to become free
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TimedQueuePool, self).__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            conn = super(TimedQueuePool, self)._do_get()
+        except TimeoutError:
+            self.stats.record(time.time() - start, timed_out=True)
+            raise
+        self.stats.record(time.time() - start)
+        return conn
+
+
+def pool_status(engine):
+    """
+    Describes how full an engine's pool is and how long checkouts wait
+    """
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        status.update(size=pool.size(),
+                      checked_out=pool.checkedout(),
+                      overflow=pool.overflow(),
+                      saturation=pool.checkedout() / capacity)
+    stats = getattr(pool, 'stats', None)
+    if stats is not None:
+        status.update(stats.snapshot())
+    return status
+
+
+def replica_binds(app):
+    """
+    The bind keys of an app's SQLALCHEMY_REPLICA_URIS
+    """
+    uris = app.config.get('SQLALCHEMY_REPLICA_URIS') or ()
+    return ['replica{}'.format(i) for i in range(len(uris))]
+
+
+class RoutingSession(SignallingSession):
+    """
+    A session that sends everything to a read replica once `use_replica`
+    is called, and to the primary otherwise
+
+    Only read-only handlers should call `use_replica`, as a session never
+    switches back to the primary by itself.
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        self.replica = None
+        super(RoutingSession, self).__init__(db, **options)
+
+    def use_replica(self):
+        """
+        Picks one of the replicas, if there are any, for this session
+        """
+        binds = replica_binds(self.app)
+        if binds:
+            self.replica = random.choice(binds)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.replica is not None and not self._flushing:
+            return self.db.get_engine(self.app, bind=self.replica)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy with pre-ping and timed pools for postgres, or no
+    pool at all when SQLALCHEMY_PGBOUNCER says PgBouncer does the pooling
+
+    Each of SQLALCHEMY_REPLICA_URIS becomes a bind with its own pool,
+    which sessions read from after `use_replica`.
+    """
+
+    def init_app(self, app):
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        replicas = app.config.get('SQLALCHEMY_REPLICA_URIS') or ()
+        binds.update(zip(replica_binds(app), replicas))
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+        super(PooledSQLAlchemy, self).init_app(app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def replica_engines(self, app=None):
+        """
+        The engines of the replicas, by bind key
+        """
+        app = self.get_app(app)
+        return {bind: self.get_engine(app, bind)
+                for bind in replica_binds(app)}
+
+    def apply_driver_hacks(self, app, info, options):
+        super(PooledSQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if app.config.get('SQLALCHEMY_PGBOUNCER'):
+            for key in ('pool_size', 'pool_timeout', 'pool_recycle',
+                        'max_overflow'):
+                options.pop(key, None)
+            options['poolclass'] = NullPool
+        elif info.drivername.startswith('postgres'):
+            options['poolclass'] = TimedQueuePool
+            options['pool_pre_ping'] = app.config.get(
+                'SQLALCHEMY_POOL_PRE_PING', True)
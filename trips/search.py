@@ -0,0 +1,112 @@
+from flask import current_app
+from sqlalchemy import Float, cast, desc, func, or_, text, tuple_
+
+from . import db
+from .model import Trip, SEARCH_CONFIG
+from .pagination import CursorError, pack_token, unpack_token
+
+# How the results of a search were matched. Cursors carry the mode so
+# that later pages are matched the same way as the first
+FULLTEXT = 'f'
+TRIGRAM = 't'
+
+
+def encode_search_cursor(mode, rank, id):
+    """
+    Packs the match mode and sort key of the last result on a page
+    """
+    return pack_token('{}:{!r}:{}'.format(mode, rank, id))
+
+
+def decode_search_cursor(cursor):
+    """
+    Unpacks a search cursor into its (mode, rank, id)
+    """
+    try:
+        mode, rank, id = unpack_token(cursor).split(':')
+        if mode not in (FULLTEXT, TRIGRAM):
+            raise ValueError(mode)
+        return mode, float(rank), int(id)
+    except (ValueError, TypeError, UnicodeError):
+        raise CursorError('invalid cursor')
+
+
+def fulltext(query, terms):
+    """
+    Filters a query to trips whose search_vector matches the terms, as
+    a web search box would parse them
+
+    Returns the query and the rank of each match.
+    """
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, terms)
+    rank = cast(func.ts_rank_cd(Trip.search_vector, tsquery), Float)
+    return query.filter(Trip.search_vector.op('@@')(tsquery)), rank
+
+
+def trigram(query, terms):
+    """
+    Filters a query to trips starting or finishing somewhere that
+    starts with, or is spelled like, the terms
+
+    Returns the query and the similarity of each match.
+    """
+    prefix = (terms.replace('!', '!!').replace('%', '!%')
+                   .replace('_', '!_') + '%')
+    # pg_trgm's similarity operator, doubled for psycopg2's paramstyle
+    rank = cast(func.greatest(func.similarity(Trip.start, terms),
+                              func.similarity(Trip.finish, terms)), Float)
+    return query.filter(or_(Trip.start.op('%%')(terms),
+                            Trip.finish.op('%%')(terms),
+                            Trip.start.ilike(prefix, escape='!'),
+                            Trip.finish.ilike(prefix, escape='!'))), rank
+
+
+def trigram_enabled():
+    """
+    Checks once per app whether pg_trgm is installed in the database
+    """
+    state = current_app.extensions.setdefault('search', {})
+    if 'trigram' not in state:
+        state['trigram'] = db.session.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_extension "
+            "WHERE extname = 'pg_trgm')")).scalar()
+    return state['trigram']
+
+
+def ranked_page(query, rank, mode, cursor, size):
+    """
+    Fetches one page of matches, best first, seeking past the cursor
+
+    Returns the rows of the page and the cursor for the page after it.
+    """
+    q = query.add_columns(rank.label('rank'))
+    q = q.order_by(desc(rank), desc(Trip.id))
+    if cursor is not None:
+        _, after_rank, after_id = cursor
+        q = q.filter(tuple_(rank, Trip.id) < tuple_(after_rank, after_id))
+    rows = q.limit(size + 1).all()
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_cursor = encode_search_cursor(mode, rows[-1].rank,
+                                           rows[-1].id)
+    return rows, next_cursor
+
+
+def search_page(query, terms, cursor, size):
+    """
+    Searches trips by full text, falling back to fuzzy matching of
+    locations when no trip contains the terms
+
+    Returns the rows of the page, each ending with its rank, and the
+    cursor for the page after it.
+    """
+    after = decode_search_cursor(cursor) if cursor else None
+    if after is None or after[0] == FULLTEXT:
+        matches, rank = fulltext(query, terms)
+        rows, next_cursor = ranked_page(matches, rank, FULLTEXT,
+                                        after, size)
+        if rows or after is not None or not trigram_enabled():
+            return rows, next_cursor
+    matches, rank = trigram(query, terms)
+    return ranked_page(matches, rank, TRIGRAM, after, size)
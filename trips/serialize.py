@@ -0,0 +1,102 @@
+import json
+from collections import OrderedDict
+from flask import current_app, make_response
+
+from .metrics import timing
+from .model import Trip
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+# In the field order of the api's trip_model, which is what clients see
+TRIP_COLUMNS = (Trip.id, Trip.title, Trip.username, Trip.created_at,
+                Trip.start, Trip.finish, Trip.public, Trip.description)
+TRIP_KEYS = tuple(column.key for column in TRIP_COLUMNS)
+
+
+def trip_dict(row):
+    """
+    Turns a row of TRIP_COLUMNS into the dict that marshalling it with
+    the trip_model would give
+    """
+    trip = OrderedDict(zip(TRIP_KEYS, row))
+    if trip['created_at'] is not None:
+        trip['created_at'] = trip['created_at'].isoformat()
+    return trip
+
+
+def trip_fields(value):
+    """
+    Parses a comma separated list of trip fields into the order of
+    TRIP_KEYS, raising ValueError if any is not a field of trips
+    """
+    names = set(name.strip() for name in value.split(','))
+    names.discard('')
+    if not names or not names.issubset(TRIP_KEYS):
+        raise ValueError('fields must be some of: ' + ' '.join(TRIP_KEYS))
+    return tuple(key for key in TRIP_KEYS if key in names)
+
+
+def project(trip, keys):
+    """
+    Leaves only `keys` of a trip dict
+    """
+    return OrderedDict((key, trip[key]) for key in keys)
+
+
+def pretty_print():
+    """
+    Whether responses are indented, by JSON_PRETTY_PRINT or else in debug
+    """
+    pretty = current_app.config.get('JSON_PRETTY_PRINT')
+    return current_app.debug if pretty is None else pretty
+
+
+def dumps(data):
+    """
+    Encodes a response body to bytes
+
+    When pretty printing, or with other RESTPLUS_JSON settings, it uses
+    the settings flask-restplus would in debug, so the output is byte for
+    byte a marshalled response. Otherwise it is one line from
+    `dumps_line`, which decodes to the same JSON but may differ in bytes:
+    orjson and ujson leave out spaces and write non-ASCII text as raw
+    UTF-8 rather than \\u escapes.
+    """
+    settings = dict(current_app.config.get('RESTPLUS_JSON', {}))
+    if pretty_print():
+        settings.setdefault('indent', 4)
+    with timing('serialize'):
+        if not settings:
+            return dumps_line(data)
+        return (json.dumps(data, **settings) + '\n').encode('utf-8')
+
+
+def dumps_line(data):
+    """
+    Encodes data as one line of JSON with the fastest encoder available
+    """
+    if orjson is not None:
+        return orjson.dumps(data) + b'\n'
+    if ujson is not None:
+        return (ujson.dumps(data, escape_forward_slashes=False) +
+                '\n').encode('utf-8')
+    return (json.dumps(data) + '\n').encode('utf-8')
+
+
+def json_response(data, code=200, headers=None):
+    """
+    Makes a response of already marshalled data, skipping flask-restplus
+    """
+    resp = make_response(dumps(data), code)
+    resp.headers.extend(headers or {})
+    resp.headers['Content-Type'] = 'application/json'
+    return resp
@@ -0,0 +1,103 @@
+import tempfile
+from gunicorn.app.base import BaseApplication
+
+from . import db, jobs
+from .metrics import clear_snapshots, retire_snapshot
+
+
+def server_options(config):
+    """
+    Maps the GUNICORN_* settings of a config onto gunicorn's settings
+
+    Raises ValueError for settings that need a cache shared by all
+    workers without one.
+    """
+    if config.GUNICORN_WORKERS > 1 and config.CACHE_TYPE == 'memory':
+        # a write would only invalidate the cache of its own worker
+        raise ValueError('CACHE_TYPE=memory is per process, use redis or '
+                         'null with more than one worker')
+    if (config.SQLALCHEMY_REPLICA_URIS and config.REPLICA_STICKY_SECONDS and
+            config.CACHE_TYPE == 'null'):
+        # reads after a write are kept on the primary through the cache
+        raise ValueError('read replicas with REPLICA_STICKY_SECONDS need '
+                         'CACHE_TYPE=redis, or memory with one worker')
+    return {'bind': config.GUNICORN_BIND,
+            'worker_class': config.GUNICORN_WORKER_CLASS,
+            'workers': config.GUNICORN_WORKERS,
+            'threads': config.GUNICORN_THREADS,
+            'keepalive': config.GUNICORN_KEEPALIVE,
+            'timeout': config.GUNICORN_TIMEOUT,
+            'max_requests': config.GUNICORN_MAX_REQUESTS,
+            'max_requests_jitter': config.GUNICORN_MAX_REQUESTS_JITTER,
+            # load the app once in the master so workers share its memory
+            'preload_app': True,
+            'on_starting': on_starting,
+            'post_fork': post_fork,
+            'worker_exit': worker_exit,
+            'child_exit': child_exit}
+
+
+def on_starting(server):
+    """
+    Clears metrics left in METRICS_DIR by an earlier run
+    """
+    directory = server.app.wsgi().config.get('METRICS_DIR')
+    if directory:
+        clear_snapshots(directory)
+
+
+def post_fork(server, worker):
+    """
+    Drops any database connections the worker inherited from the master,
+    so that each worker opens its own, and starts its jobs thread
+    """
+    app = worker.app.wsgi()
+    with app.app_context():
+        db.engine.dispose()
+        for engine in db.replica_engines().values():
+            engine.dispose()
+    jobs.start(app)
+
+
+def worker_exit(server, worker):
+    """
+    Stops a worker's jobs thread and metrics flusher and writes out what
+    it measured since it last did, before it goes
+    """
+    app = worker.app.wsgi()
+    jobs.stop(app)
+    metrics = app.extensions['metrics']
+    metrics.stop()
+    metrics.flush()
+
+
+def child_exit(server, worker):
+    """
+    Keeps the counters of a worker that exited in the metrics totals
+    """
+    directory = server.app.wsgi().config.get('METRICS_DIR')
+    if directory:
+        retire_snapshot(directory, worker.pid)
+
+
+class Server(BaseApplication):
+    """
+    Runs the app under gunicorn with the options from its config
+    """
+
+    def __init__(self, app, options=None):
+        self.application = app
+        self.options = options or {}
+        if (self.options.get('workers', 1) > 1 and
+                not app.config.get('METRICS_DIR')):
+            # each worker only sees its own requests
+            app.config['METRICS_DIR'] = tempfile.mkdtemp(
+                prefix='trips-metrics-')
+        super(Server, self).__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
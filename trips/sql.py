@@ -0,0 +1,20 @@
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+
+class explain(Executable, ClauseElement):
+    """
+    An EXPLAIN of a select statement, keeping the statement's parameters
+    """
+
+    def __init__(self, statement, format=None):
+        self.statement = statement
+        self.format = format
+
+
+@compiles(explain, 'postgresql')
+def pg_explain(element, compiler, **kw):
+    text = 'EXPLAIN '
+    if element.format:
+        text += '(FORMAT {}) '.format(element.format.upper())
+    return text + compiler.process(element.statement, **kw)
@@ -0,0 +1,148 @@
+from sqlalchemy import case, desc, or_, select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from . import db
+from .model import Trip, UserTripStats
+
+# Trips are passed to these functions as (id, created_at, public, complete)
+# tuples, which is what the bulk inserts and deletes return
+REBUILD = """
+INSERT INTO user_trip_stats (username, trips, completed, latest_id,
+    latest_created_at, public_trips, public_completed, public_latest_id,
+    public_latest_created_at)
+SELECT c.username, c.trips, c.completed, l.id, l.created_at,
+       c.public_trips, c.public_completed, p.id, p.created_at
+FROM (SELECT username, count(*) AS trips,
+             count(*) FILTER (WHERE complete) AS completed,
+             count(*) FILTER (WHERE public) AS public_trips,
+             count(*) FILTER (WHERE public AND complete) AS public_completed
+      FROM trips WHERE username IS NOT NULL GROUP BY username) c
+JOIN (SELECT DISTINCT ON (username) username, id, created_at FROM trips
+      ORDER BY username, created_at DESC, id DESC) l USING (username)
+LEFT JOIN (SELECT DISTINCT ON (username) username, id, created_at
+           FROM trips WHERE public
+           ORDER BY username, created_at DESC, id DESC) p USING (username)
+"""
+
+
+def summary(prefix, trips):
+    """
+    Counts trips into the columns of a view of the stats
+    """
+    newest = max(trips, key=lambda t: (t[1], t[0]), default=None)
+    return {prefix + 'trips': len(trips),
+            prefix + 'completed': sum(1 for t in trips if t[3]),
+            prefix + 'latest_id': newest and newest[0],
+            prefix + 'latest_created_at': newest and newest[1]}
+
+
+def newer_latest(prefix, new):
+    """
+    Keeps whichever of the stored and `new` newest trips is newer
+    """
+    table = UserTripStats.__table__
+    id_col = table.c[prefix + 'latest_id']
+    created_col = table.c[prefix + 'latest_created_at']
+    newer = or_(id_col.is_(None),
+                tuple_(new[prefix + 'latest_created_at'],
+                       new[prefix + 'latest_id']) >
+                tuple_(created_col, id_col))
+    return {id_col.name: case([(newer, new[prefix + 'latest_id'])],
+                              else_=id_col),
+            created_col.name: case(
+                [(newer, new[prefix + 'latest_created_at'])],
+                else_=created_col)}
+
+
+def count_created(username, trips):
+    """
+    Counts a user's new trips in their stats, in the transaction that
+    inserted them
+    """
+    trips = list(trips)
+    if not trips:
+        return
+    table = UserTripStats.__table__
+    values = dict(username=username)
+    values.update(summary('', trips))
+    values.update(summary('public_', [t for t in trips if t[2]]))
+    stmt = insert(table).values(**values)
+    changes = {}
+    for prefix in ('', 'public_'):
+        for column in ('trips', 'completed'):
+            name = prefix + column
+            changes[name] = table.c[name] + stmt.excluded[name]
+        changes.update(newer_latest(prefix, stmt.excluded))
+    # the row lock taken here orders concurrent writes of a user's trips
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.username], set_=changes))
+
+
+def count_deleted(username, trips):
+    """
+    Takes a user's deleted trips out of their stats, in the transaction
+    that deleted them
+    """
+    trips = list(trips)
+    if not trips:
+        return
+    table = UserTripStats.__table__
+    public = [t for t in trips if t[2]]
+    changes = {
+        'trips': table.c.trips - len(trips),
+        'completed': table.c.completed - sum(1 for t in trips if t[3]),
+        'public_trips': table.c.public_trips - len(public),
+        'public_completed': (table.c.public_completed -
+                             sum(1 for t in public if t[3]))}
+    row = db.session.execute(
+        table.update().where(table.c.username == username)
+             .values(**changes)
+             .returning(table.c.latest_id, table.c.public_latest_id)
+    ).first()
+    ids = set(t[0] for t in trips)
+    if row is not None and (row[0] in ids or row[1] in ids):
+        # a statement of its own, so that it sees any trips committed
+        # while this transaction waited for the row lock
+        refresh_latest(username)
+
+
+def refresh_latest(username):
+    """
+    Looks up a user's newest trips again, after one was deleted
+    """
+    table = UserTripStats.__table__
+    values = {}
+    for prefix, public_only in (('', False), ('public_', True)):
+        q = (select([Trip.id, Trip.created_at])
+             .where(Trip.username == username)
+             .order_by(desc(Trip.created_at), desc(Trip.id)).limit(1))
+        if public_only:
+            q = q.where(Trip.public.is_(True))
+        newest = db.session.execute(q).first()
+        values[prefix + 'latest_id'] = newest and newest[0]
+        values[prefix + 'latest_created_at'] = newest and newest[1]
+    db.session.execute(table.update()
+                            .where(table.c.username == username)
+                            .values(**values))
+
+
+def user_stats(username):
+    """
+    A user's stats, or None if they never had any trips
+    """
+    return db.session.query(UserTripStats).get(username)
+
+
+def rebuild_stats():
+    """
+    Counts every user's trips into their stats from scratch, for when
+    they were loaded some other way, such as ./manage.py seed
+
+    Writes to trips wait until it commits. Returns how many users have
+    trips.
+    """
+    db.session.execute(text('LOCK TABLE trips IN SHARE MODE'))
+    db.session.execute(text('DELETE FROM user_trip_stats'))
+    users = db.session.execute(text(REBUILD)).rowcount
+    db.session.commit()
+    return users
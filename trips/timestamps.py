@@ -0,0 +1,50 @@
+import re
+from datetime import datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+ISO_8601 = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d{0,3})?)?'
+    r'(?:(Z)|([+-])(\d{2}):?(\d{2}))?)?$')
+EPOCH_MILLIS = re.compile(r'-?\d{1,15}$')
+
+
+class TimestampError(ValueError):
+    """ Raised for times that are neither ISO 8601 nor epoch millis """
+
+
+def parse_timestamp(value):
+    """
+    Parses a string holding an ISO 8601 date or time, or milliseconds
+    since the epoch as a string or an integer, as a naive UTC datetime
+    like the ones trips are stored with
+
+    Only YYYY-MM-DD, optionally followed by T or a space, HH:MM, seconds,
+    up to nanoseconds and a Z or +HH:MM offset, is ISO 8601 here. A string
+    of digits is always epoch millis, never a year. Anything else, floats
+    and booleans included, raises TimestampError, rather than being
+    guessed at.
+    """
+    try:
+        # bool is a subclass of int, but true is not a time
+        if type(value) is int:
+            value = str(value)
+        if not isinstance(value, str):
+            raise TimestampError('not a string or integer')
+        if EPOCH_MILLIS.match(value):
+            return EPOCH + timedelta(milliseconds=int(value))
+        match = ISO_8601.match(value)
+        if match is None:
+            raise TimestampError(value)
+        (year, month, day, hour, minute, second, fraction, utc, sign,
+         offset_hours, offset_minutes) = match.groups()
+        parsed = datetime(int(year), int(month), int(day), int(hour or 0),
+                          int(minute or 0), int(second or 0),
+                          int((fraction or '0').ljust(6, '0')))
+        if sign is not None:
+            offset = timedelta(hours=int(offset_hours),
+                               minutes=int(offset_minutes))
+            parsed -= offset if sign == '+' else -offset
+        return parsed
+    except (ValueError, OverflowError) as e:
+        raise TimestampError('invalid time: {}'.format(e))